@@ -0,0 +1,218 @@
+"""
+Catalog Artifact - Precompiled clinical catalog for fast server startup
+Compiles the protocol batches, the peptide reference and the master library indexes into
+one versioned pickle at build time; each worker unpickles it (a copy per process) instead of
+recompiling and re-indexing the catalog on every boot
+
+Build:  python catalog_artifact.py build
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import struct
+import subprocess
+import time
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).parent
+DEFAULT_ARTIFACT_PATH = BACKEND_DIR / 'build' / 'catalog.pkl'
+
+# Bump when the payload layout (or the pickled index classes) change incompatibly
+ARTIFACT_FORMAT_VERSION = 1
+ARTIFACT_MAGIC = b'PPCATLG1'
+# magic, format version, sha256 of the sources
+HEADER = struct.Struct('>8sI32s')
+
+# Modules holding the protocol data itself
+DATA_FILES = [
+    'enhanced_clinical_database.py',
+    'complete_enhanced_protocols_batch2.py',
+    'accelerated_batch3_protocols.py',
+    'final_completion_batch4.py',
+    'critical_missing_peptides_batch5.py',
+    'essential_peptide_blends_batch6.py',
+    'advanced_weight_management_batch7.py',
+    'capsule_protocols_batch8.py',
+    'comprehensive_peptide_reference.py',
+    'comprehensive_peptide_reference_expanded.py'
+]
+
+# Everything whose content ends up in the artifact; any edit makes the artifact stale
+SOURCE_FILES = DATA_FILES + [
+    'master_protocol_manager.py',
+    'protocol_search_index.py',
+    'catalog_index.py',
+    'catalog_snapshot.py',
+    'catalog_artifact.py'
+]
+
+
+def artifact_path() -> Path:
+    return Path(os.environ.get('CATALOG_ARTIFACT_PATH') or DEFAULT_ARTIFACT_PATH)
+
+
+def source_digest() -> bytes:
+    """SHA-256 over every source file that feeds the artifact"""
+    hasher = hashlib.sha256()
+    hasher.update(str(ARTIFACT_FORMAT_VERSION).encode())
+    for filename in SOURCE_FILES:
+        hasher.update(filename.encode())
+        try:
+            hasher.update((BACKEND_DIR / filename).read_bytes())
+        except FileNotFoundError:
+            hasher.update(b'<missing>')
+    return hasher.digest()
+
+
+@lru_cache(maxsize=1)
+def source_updated_at() -> str:
+    """
+    When the protocol data last changed: $CATALOG_UPDATED_AT if set, otherwise the commit time
+    of the newest data file change. Checkouts and copies of the same commit agree on it; the
+    artifact build bakes it in for hosts without the git history
+    """
+    configured = os.environ.get('CATALOG_UPDATED_AT')
+    if configured:
+        return configured
+    try:
+        result = subprocess.run(
+            ['git', 'log', '-1', '--format=%ct', '--', *DATA_FILES],
+            cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10, check=True
+        )
+        return datetime.utcfromtimestamp(int(result.stdout.strip())).isoformat()
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        # No git history here: a fixed stamp still matches on every such host
+        logger.warning(f"Catalog data commit time unavailable ({e}); set CATALOG_UPDATED_AT or load the artifact")
+        return datetime(1970, 1, 1).isoformat()
+
+
+def import_catalog_sources() -> Dict[str, Any]:
+    """Load the raw clinical content from the Python data modules"""
+    from enhanced_clinical_database import ENHANCED_CLINICAL_PEPTIDES
+    from complete_enhanced_protocols_batch2 import COMPLETE_PROTOCOLS_BATCH2
+    from accelerated_batch3_protocols import ACCELERATED_BATCH3_PROTOCOLS
+    from final_completion_batch4 import FINAL_COMPLETION_BATCH4
+    from critical_missing_peptides_batch5 import CRITICAL_MISSING_PEPTIDES_BATCH5
+    from essential_peptide_blends_batch6 import ESSENTIAL_PEPTIDE_BLENDS_BATCH6
+    from advanced_weight_management_batch7 import ADVANCED_WEIGHT_MANAGEMENT_BATCH7
+    from capsule_protocols_batch8 import CAPSULE_PROTOCOLS_BATCH8
+    from comprehensive_peptide_reference_expanded import (
+        EXPANDED_COMPREHENSIVE_PEPTIDES_DATABASE, EXPANDED_PEPTIDE_CATEGORIES
+    )
+
+    return {
+        'enhanced_clinical_peptides': ENHANCED_CLINICAL_PEPTIDES,
+        'protocol_batches': [
+            ENHANCED_CLINICAL_PEPTIDES,
+            COMPLETE_PROTOCOLS_BATCH2,
+            ACCELERATED_BATCH3_PROTOCOLS,
+            FINAL_COMPLETION_BATCH4,
+            CRITICAL_MISSING_PEPTIDES_BATCH5,
+            ESSENTIAL_PEPTIDE_BLENDS_BATCH6,
+            ADVANCED_WEIGHT_MANAGEMENT_BATCH7,
+            CAPSULE_PROTOCOLS_BATCH8
+        ],
+        'comprehensive_peptides': EXPANDED_COMPREHENSIVE_PEPTIDES_DATABASE,
+        'peptide_categories': EXPANDED_PEPTIDE_CATEGORIES
+    }
+
+
+def build_artifact(path: Optional[Path] = None) -> Path:
+    """Compile sources and master library indexes into the artifact file"""
+    # Always compile from source, never from a previous artifact
+    os.environ['CATALOG_ARTIFACT_DISABLED'] = '1'
+    load_artifact.cache_clear()
+    from master_protocol_manager import master_protocol_manager as manager
+
+    path = Path(path or artifact_path())
+    sources = import_catalog_sources()
+
+    payload = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'built_at': datetime.utcnow().isoformat(),
+        'catalog_version': manager.catalog_version,
+        'sources': sources,
+        'master_state': manager.export_state()
+    }
+    body = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    header = HEADER.pack(ARTIFACT_MAGIC, ARTIFACT_FORMAT_VERSION, source_digest())
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix('.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(body)
+    os.replace(temp_path, path)
+
+    logger.info(f"Catalog artifact {manager.catalog_version} written to {path} ({len(body) / 1024:.0f} KB)")
+    return path
+
+
+def read_artifact(path: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+    """Unpickle the artifact; None if it is missing, stale or unreadable"""
+    path = Path(path or artifact_path())
+    if not path.exists():
+        return None
+
+    started = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            # Check the header before reading the body, so a stale artifact costs one small read
+            magic, format_version, digest = HEADER.unpack(f.read(HEADER.size))
+            if magic != ARTIFACT_MAGIC or format_version != ARTIFACT_FORMAT_VERSION:
+                logger.warning(f"Ignoring catalog artifact {path}: unknown format")
+                return None
+            if digest != source_digest():
+                logger.warning(f"Ignoring stale catalog artifact {path}: sources changed since build")
+                return None
+            payload = pickle.load(f)
+    except (OSError, ValueError, struct.error, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        logger.warning(f"Could not load catalog artifact {path}: {e}")
+        return None
+
+    logger.info(f"Loaded catalog artifact {payload.get('catalog_version')} in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return payload
+
+
+@lru_cache(maxsize=1)
+def load_artifact() -> Optional[Dict[str, Any]]:
+    """Process-wide artifact (loaded once); disable with CATALOG_ARTIFACT_DISABLED=1"""
+    if os.environ.get('CATALOG_ARTIFACT_DISABLED') == '1':
+        return None
+    return read_artifact()
+
+
+def catalog_sources() -> Dict[str, Any]:
+    """Raw clinical content, from the artifact when available, otherwise from the data modules"""
+    artifact = load_artifact()
+    if artifact:
+        return artifact['sources']
+    return import_catalog_sources()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build or inspect the precompiled catalog artifact")
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--path', default=None, help="Artifact path (default: $CATALOG_ARTIFACT_PATH or build/catalog.pkl)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'build':
+        build_artifact(args.path)
+    else:
+        payload = read_artifact(args.path)
+        if not payload:
+            raise SystemExit("Catalog artifact missing or stale - run: python catalog_artifact.py build")
+        print(f"Catalog artifact {payload['catalog_version']} built {payload['built_at']} is current")
+
+
+if __name__ == '__main__':
+    main()
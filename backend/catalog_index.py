@@ -0,0 +1,95 @@
+"""
+Catalog Index - Hash indexes for constant-time catalog lookups, and column views for sparse fieldsets
+Shared by the master protocol library and the comprehensive peptide reference
+"""
+
+from typing import Iterable, List, Dict, Any, Optional, Tuple
+
+
+class CatalogIndex:
+    """Id, name, alias and category indexes over a list of catalog entries, built once at load time"""
+
+    def __init__(self, entries: List[Dict[str, Any]], id_field: Optional[str] = 'id'):
+        self.entries = entries
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        self.by_alias: Dict[str, Dict[str, Any]] = {}
+        self.by_category: Dict[str, List[Dict[str, Any]]] = {}
+
+        for entry in entries:
+            if id_field and entry.get(id_field):
+                self.by_id.setdefault(str(entry[id_field]), entry)
+
+            # First occurrence wins, matching the order of the old linear scans
+            name = entry.get('name')
+            if name:
+                self.by_name.setdefault(name.lower(), entry)
+            for alias in entry.get('aliases', []) or []:
+                self.by_alias.setdefault(alias.lower(), entry)
+
+            category = entry.get('category')
+            if category:
+                self.by_category.setdefault(category.lower(), []).append(entry)
+
+    def get_by_id(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        return self.by_id.get(entry_id)
+
+    def get_by_name(self, name: str, include_aliases: bool = True) -> Optional[Dict[str, Any]]:
+        """Case-insensitive exact lookup by canonical name, then by alias"""
+        key = name.lower().strip()
+        entry = self.by_name.get(key)
+        if entry is None and include_aliases:
+            entry = self.by_alias.get(key)
+        return entry
+
+    def get_by_category(self, category: str) -> List[Dict[str, Any]]:
+        """Entries in a category (case-insensitive), in catalog order"""
+        return self.by_category.get(category.lower().strip(), [])
+
+
+class FieldProjection:
+    """
+    Per-field column views over a list of catalog entries, so list endpoints can return
+    only the requested fields (?fields=name,category) without copying whole documents
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]], required: Tuple[str, ...] = ('id',)):
+        # Sparse columns: field -> {ordinal: value}, for entries that have the field
+        self.columns: Dict[str, Dict[int, Any]] = {}
+        for ordinal, entry in enumerate(entries):
+            for field, value in entry.items():
+                self.columns.setdefault(field, {})[ordinal] = value
+        self.required = tuple(field for field in required if field in self.columns)
+
+    @property
+    def available_fields(self) -> List[str]:
+        return sorted(self.columns)
+
+    def parse_fields(self, fields: Optional[str], extra: Tuple[str, ...] = ()) -> Optional[Tuple[str, ...]]:
+        """Validate a comma-separated fieldset; None means full documents"""
+        if not fields:
+            return None
+        requested = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in requested if field not in self.columns and field not in extra]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(self.available_fields)}")
+        # Identifying fields always come first
+        return tuple(dict.fromkeys(self.required + tuple(requested)))
+
+    def row(self, ordinal: int, fields: Tuple[str, ...]) -> Dict[str, Any]:
+        projected = {}
+        for field in fields:
+            column = self.columns.get(field)
+            if column is not None and ordinal in column:
+                projected[field] = column[ordinal]
+        return projected
+
+    def rows(self, ordinals: Iterable[int], fields: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        return [self.row(ordinal, fields) for ordinal in ordinals]
+
+    @staticmethod
+    def project(entry: Dict[str, Any], fields: Optional[Tuple[str, ...]]) -> Dict[str, Any]:
+        """Project a single document resolved through a hash index"""
+        if fields is None:
+            return entry
+        return {field: entry[field] for field in fields if field in entry}
@@ -0,0 +1,133 @@
+"""
+Catalog Responses - Pre-serialized, compressed, ETag-aware responses for static catalog endpoints
+Each payload is JSON-encoded and compressed once per catalog version, off the event loop;
+repeat requests are answered from the byte buffers, or with 304 Not Modified when the client
+already has them
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Hashable, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+# Add brotli support if available
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Bodies smaller than this are not worth compressing
+MINIMUM_COMPRESS_SIZE = 500
+# Moderate levels: bodies are built on demand for client-chosen pages and fieldsets, and the
+# maximum levels cost several times the CPU for a few percent smaller output
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+DEFAULT_CACHE_CONTROL = "public, max-age=300"
+
+
+class SerializedPayload:
+    """A JSON body and its compressed encodings, with a strong ETag over the content"""
+
+    def __init__(self, data: Any):
+        self.body = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+        self.encodings: Dict[str, bytes] = {}
+        if len(self.body) >= MINIMUM_COMPRESS_SIZE:
+            self.encodings['gzip'] = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+            if BROTLI_AVAILABLE:
+                self.encodings['br'] = brotli.compress(self.body, quality=BROTLI_QUALITY)
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """Each content-coding is a distinct representation, so it gets its own strong ETag"""
+        return self.etag if not encoding else f'{self.etag[:-1]}-{encoding}"'
+
+    def matches(self, if_none_match: str) -> bool:
+        """If-None-Match uses weak comparison; any encoding of this content is a match"""
+        if if_none_match.strip() == '*':
+            return True
+        known = {self.etag_for(None), *(self.etag_for(encoding) for encoding in self.encodings)}
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate in known:
+                return True
+        return False
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+class CatalogResponseCache:
+    """Serialized payloads keyed by endpoint, parameters and catalog version (LRU bounded)"""
+
+    def __init__(self, max_entries: int = 256, cache_control: str = DEFAULT_CACHE_CONTROL):
+        self.max_entries = max_entries
+        self.cache_control = cache_control
+        self._payloads: 'OrderedDict[Hashable, SerializedPayload]' = OrderedDict()
+
+    async def payload(self, key: Hashable, build: Callable[[], Any]) -> SerializedPayload:
+        payload = self._payloads.get(key)
+        if payload is not None:
+            self._payloads.move_to_end(key)
+            return payload
+
+        # Building, encoding and compressing a page is CPU work; keep it off the event loop
+        payload = await asyncio.to_thread(lambda: SerializedPayload(build()))
+        self._payloads[key] = payload
+        if len(self._payloads) > self.max_entries:
+            self._payloads.popitem(last=False)
+        return payload
+
+    async def respond(self, request: Request, key: Hashable, build: Callable[[], Any]) -> Response:
+        """Serve the cached payload for key, building it on first use"""
+        payload = await self.payload(key, build)
+        encoding = self._negotiate(request.headers.get('accept-encoding', ''), payload)
+        headers = {
+            'ETag': payload.etag_for(encoding),
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match and payload.matches(if_none_match):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers['Content-Encoding'] = encoding
+            return Response(content=payload.encodings[encoding], media_type='application/json', headers=headers)
+        return Response(content=payload.body, media_type='application/json', headers=headers)
+
+    def _negotiate(self, accept_encoding: str, payload: SerializedPayload) -> Optional[str]:
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in payload.encodings and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return None
+
+    def clear(self):
+        self._payloads.clear()
+
+
+# Global instance
+catalog_responses = CatalogResponseCache()
@@ -0,0 +1,166 @@
+"""
+Catalog Service - One in-memory source for all static clinical content
+Serves the enhanced library, the basic library and the peptide reference as views
+precomputed from the master protocol library and the comprehensive reference
+"""
+
+from typing import List, Dict, Any, Optional, Tuple
+
+from catalog_artifact import catalog_sources
+from catalog_index import CatalogIndex, FieldProjection
+from catalog_snapshot import identity_key, protocol_id_for
+from master_protocol_manager import MasterProtocolManager, master_protocol_manager
+
+# Fields of the enhanced library document (AdvancedProtocolLibraryItem)
+ENHANCED_FIELDS = (
+    'id', 'name', 'aliases', 'sequence', 'molecular_weight', 'category', 'description',
+    'mechanism_of_action', 'clinical_indications', 'complete_dosing_schedule',
+    'administration_techniques', 'safety_profile', 'contraindications_and_precautions',
+    'expected_timelines', 'monitoring_requirements', 'scientific_references',
+    'functional_medicine_approach', 'cost_considerations', 'created_at'
+)
+
+# Upper bound on ids/names resolved by one batch request
+MAX_BATCH_SIZE = 200
+
+# Fields matched by the enhanced library's free-text filter
+ENHANCED_SEARCH_FIELDS = ('name', 'aliases', 'mechanism_of_action', 'clinical_indications')
+
+
+def _searchable_text(item: Dict[str, Any]) -> str:
+    parts = []
+    for field in ENHANCED_SEARCH_FIELDS:
+        value = item.get(field)
+        if isinstance(value, list):
+            parts.extend(str(v) for v in value)
+        elif value:
+            parts.append(str(value))
+    return '\n'.join(parts).lower()
+
+
+def _basic_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Legacy /library shape of an enhanced protocol"""
+    mechanism = item["mechanism_of_action"]
+    return {
+        "id": item["id"],
+        "name": item["name"],
+        "category": item["category"],
+        "mechanism": mechanism[:200] + "..." if len(mechanism) > 200 else mechanism,
+        "indications": item["clinical_indications"][:5],  # Limit for compatibility
+        "standard_dosing": item["complete_dosing_schedule"],
+        "administration": item["administration_techniques"].get("injection_sites", "See detailed protocols"),
+        "contraindications": item["contraindications_and_precautions"].get("absolute_contraindications", []),
+        "side_effects": [effect["effect"] for effect in item["safety_profile"].get("common_side_effects", [])],
+        "monitoring": item["monitoring_requirements"].get("ongoing_monitoring", []),
+        "references": [ref.get("title", "") for ref in item["scientific_references"][:3]]
+    }
+
+
+class CatalogService:
+    """Enhanced, basic and reference views over the compiled catalog, built once per catalog version"""
+
+    def __init__(self, manager: MasterProtocolManager, sources: Dict[str, Any]):
+        self.manager = manager
+        self.catalog_version = manager.catalog_version
+        self._build_enhanced_views(sources['enhanced_clinical_peptides'])
+        self._build_reference_views(sources['comprehensive_peptides'], sources['peptide_categories'])
+        print(f"✓ Catalog service ready: {len(self.enhanced_items)} enhanced protocols, {len(self.reference_peptides)} reference peptides")
+
+    def _build_enhanced_views(self, enhanced_sources: List[Dict[str, Any]]):
+        """Enhanced library entries share IDs and timestamps with the master library"""
+        self.enhanced_items = []
+        occurrences = {}
+        for source in enhanced_sources:
+            identity = identity_key(source)
+            occurrence = occurrences.get(identity, 0)
+            occurrences[identity] = occurrence + 1
+
+            compiled = self.manager.get_protocol_by_id(protocol_id_for(identity, occurrence)) or source
+            item = {field: compiled[field] for field in ENHANCED_FIELDS if field in compiled}
+            item.setdefault('id', protocol_id_for(identity, occurrence))
+            self.enhanced_items.append(item)
+
+        self.enhanced_index = CatalogIndex(self.enhanced_items)
+        self.enhanced_search_text = [_searchable_text(item) for item in self.enhanced_items]
+        self.enhanced_categories = sorted({item['category'] for item in self.enhanced_items})
+        self.basic_items = [_basic_item(item) for item in self.enhanced_items]
+        self.enhanced_field_views = FieldProjection(self.enhanced_items)
+
+    def _build_reference_views(self, peptides: List[Dict[str, Any]], categories: Any):
+        self.reference_peptides = peptides
+        self.reference_categories = categories
+        self.reference_index = CatalogIndex(peptides, id_field=None)
+        # Reference entries have no IDs; the name identifies them
+        self.reference_field_views = FieldProjection(peptides, required=('name',))
+
+    # Enhanced library
+
+    def get_enhanced_library(self, category: Optional[str] = None, search: Optional[str] = None,
+                             fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+        """Enhanced protocols filtered by category and a case-insensitive substring search"""
+        category_key = category.lower() if category else None
+        needle = search.lower() if search else None
+        ordinals = [
+            ordinal for ordinal, (item, text) in enumerate(zip(self.enhanced_items, self.enhanced_search_text))
+            if (category_key is None or item['category'].lower() == category_key)
+            and (needle is None or needle in text)
+        ]
+        if fields is None:
+            return [self.enhanced_items[ordinal] for ordinal in ordinals]
+        return self.enhanced_field_views.rows(ordinals, fields)
+
+    def get_enhanced_protocol(self, protocol_id: str) -> Optional[Dict[str, Any]]:
+        return self.enhanced_index.get_by_id(protocol_id)
+
+    def get_basic_library(self) -> List[Dict[str, Any]]:
+        return self.basic_items
+
+    # Batch reads
+
+    def get_protocols_batch(self, ids: List[str], names: List[str],
+                            fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        """Resolve many protocols by id and/or name in one pass, in request order"""
+        protocols = []
+        seen = set()
+        not_found = []
+        lookups = [(protocol_id, self.manager.get_protocol_by_id) for protocol_id in ids]
+        lookups += [(name, self.manager.get_protocol_by_name) for name in names]
+        for key, lookup in lookups:
+            protocol = lookup(key)
+            if protocol is None:
+                not_found.append(key)
+            elif protocol['id'] not in seen:
+                seen.add(protocol['id'])
+                protocols.append(FieldProjection.project(protocol, fields))
+        return {'protocols': protocols, 'not_found': not_found}
+
+    def get_peptides_batch(self, names: List[str], fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        """Resolve many reference peptides by name in one pass, in request order"""
+        peptides = []
+        seen = set()
+        not_found = []
+        for name in names:
+            peptide = self.get_reference_peptide(name)
+            if peptide is None:
+                not_found.append(name)
+            elif id(peptide) not in seen:
+                seen.add(id(peptide))
+                peptides.append(FieldProjection.project(peptide, fields))
+        return {'peptides': peptides, 'not_found': not_found}
+
+    # Peptide reference
+
+    def get_reference_peptides(self, fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+        if fields is None:
+            return self.reference_peptides
+        return self.reference_field_views.rows(range(len(self.reference_peptides)), fields)
+
+    def get_reference_peptide(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.reference_index.get_by_name(name, include_aliases=False)
+
+    def get_reference_by_category(self, category: str) -> List[Dict[str, Any]]:
+        return self.reference_index.get_by_category(category)
+
+
+# Global instance
+catalog_service = CatalogService(master_protocol_manager, catalog_sources())
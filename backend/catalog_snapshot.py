@@ -0,0 +1,192 @@
+"""
+Catalog Snapshot - Deterministic protocol identities and versioned catalog snapshots
+A protocol's name and category give it a stable ID across restarts, workers and content edits;
+content fingerprints detect edits, and the catalog version is a token derived from the compiled
+content, so it only changes when the content does and is the same on every host
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import uuid
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Namespace for protocol IDs derived from protocol identities
+PROTOCOL_ID_NAMESPACE = uuid.UUID('6f1c2a9e-4b7d-5e3a-9c81-2d4f7a6b0e15')
+
+# Fields that describe when a document was served rather than what it says
+VOLATILE_FIELDS = ('created_at', 'last_updated')
+
+# Hex digits of the catalog digest clients use as the version
+VERSION_TOKEN_LENGTH = 16
+_TOKEN = re.compile(r'[0-9a-f]{%d}' % VERSION_TOKEN_LENGTH)
+
+# Runtime state, kept out of the package directory (git-ignored like the catalog artifact)
+DEFAULT_SNAPSHOT_DIR = Path(__file__).parent / 'build' / 'catalog_snapshots'
+
+
+def content_hash(document: Dict[str, Any], exclude: tuple = ()) -> str:
+    """SHA-256 of a canonical JSON encoding of a document"""
+    canonical = {key: value for key, value in document.items() if key not in exclude}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def identity_key(protocol: Dict[str, Any]) -> str:
+    """What a source protocol is (normalized name and category), independent of what it says"""
+    return '|'.join(
+        ''.join(char for char in str(protocol.get(field) or '').lower() if char.isalnum())
+        for field in ('name', 'category')
+    )
+
+
+def protocol_id_for(identity: str, occurrence: int = 0) -> str:
+    """Stable UUID for a source protocol; repeated entries with the same identity get an occurrence suffix"""
+    name = identity if occurrence == 0 else f"{identity}:{occurrence}"
+    return str(uuid.uuid5(PROTOCOL_ID_NAMESPACE, name))
+
+
+def fingerprint(protocol: Dict[str, Any]) -> str:
+    """Fingerprint of a compiled protocol document, ignoring its timestamps"""
+    return content_hash(protocol, exclude=VOLATILE_FIELDS)
+
+
+def catalog_digest(fingerprints: Dict[str, str]) -> str:
+    """Digest over the whole catalog (ids and their fingerprints)"""
+    hasher = hashlib.sha256()
+    for protocol_id in sorted(fingerprints):
+        hasher.update(f"{protocol_id}:{fingerprints[protocol_id]}\n".encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def version_token(digest: str) -> str:
+    """Catalog version as clients see it: derived from the content, so every host agrees on it"""
+    return digest[:VERSION_TOKEN_LENGTH]
+
+
+class CatalogSnapshotStore:
+    """
+    Persists one JSON snapshot per catalog version ({id: fingerprint and timestamps}), named
+    by its content-derived token, plus a manifest pointing at the latest one. A host only has
+    the snapshots of catalogs it has loaded itself; callers treat any other token as unknown
+    """
+
+    def __init__(self, snapshot_dir: Optional[str] = None):
+        self.snapshot_dir = Path(snapshot_dir or os.environ.get('CATALOG_SNAPSHOT_DIR') or DEFAULT_SNAPSHOT_DIR)
+        self.manifest_path = self.snapshot_dir / 'manifest.json'
+
+    def _version_path(self, version: str) -> Path:
+        return self.snapshot_dir / f"{version}.json"
+
+    def _read_json(self, path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable catalog snapshot {path}: {e}")
+            return None
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """The most recent snapshot, if any"""
+        manifest = self._read_json(self.manifest_path)
+        if not manifest or not isinstance(manifest.get('current_version'), str):
+            return None
+        return self.load(manifest['current_version'])
+
+    def load(self, version: str) -> Optional[Dict[str, Any]]:
+        """A specific historical snapshot; None for tokens this host has never seen"""
+        if not _TOKEN.fullmatch(version or ''):
+            return None
+        return self._read_json(self._version_path(version))
+
+    def resolve(self, fingerprints: Dict[str, str], names: Dict[str, str], updated_at: str) -> Dict[str, Any]:
+        """
+        Return the snapshot describing the current catalog, recording a new one only when
+        no snapshot exists for its digest; updated_at comes from the catalog sources, not
+        the clock, so every host stamps a change the same way
+        """
+        digest = catalog_digest(fingerprints)
+        version = version_token(digest)
+        existing = self.load(version)
+        if existing and existing.get('digest') == digest:
+            self._point_manifest(existing)
+            return existing
+
+        now = updated_at
+        previous = self.latest()
+        previous_protocols = (previous or {}).get('protocols', {})
+        protocols = {}
+        for protocol_id, protocol_fingerprint in fingerprints.items():
+            prior = previous_protocols.get(protocol_id)
+            if prior and prior.get('fingerprint') == protocol_fingerprint:
+                protocols[protocol_id] = prior
+            else:
+                protocols[protocol_id] = {
+                    'name': names.get(protocol_id, ''),
+                    'fingerprint': protocol_fingerprint,
+                    'created_at': prior.get('created_at', now) if prior else now,
+                    'last_updated': now
+                }
+
+        snapshot = {
+            'version': version,
+            'previous_version': (previous or {}).get('version'),
+            'digest': digest,
+            'created_at': now,
+            'protocols': protocols
+        }
+        return self._persist(snapshot)
+
+    def _persist(self, snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        """Write a new snapshot; if another worker already wrote it, adopt theirs"""
+        path = self._version_path(snapshot['version'])
+        try:
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            # Exclusive create so concurrent workers converge on one file per version
+            with open(path, 'x') as f:
+                json.dump(snapshot, f, indent=2, sort_keys=True)
+        except FileExistsError:
+            existing = self._read_json(path)
+            if existing and existing.get('digest') == snapshot['digest']:
+                self._point_manifest(existing)
+                return existing
+            logger.warning(f"Catalog snapshot {snapshot['version']} exists with different content; keeping in-memory snapshot")
+            return snapshot
+        except OSError as e:
+            logger.warning(f"Could not persist catalog snapshot {snapshot['version']}: {e}")
+            return snapshot
+
+        self._point_manifest(snapshot)
+        logger.info(f"Catalog snapshot {snapshot['version']} recorded ({len(snapshot['protocols'])} protocols)")
+        return snapshot
+
+    def _point_manifest(self, snapshot: Dict[str, Any]):
+        """Make snapshot the latest one"""
+        manifest = {'current_version': snapshot['version'], 'digest': snapshot['digest'], 'updated_at': snapshot['created_at']}
+        temp_path = self.manifest_path.with_suffix('.tmp')
+        try:
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(temp_path, self.manifest_path)
+        except OSError as e:
+            logger.warning(f"Could not update catalog manifest: {e}")
+
+    def history(self) -> List[str]:
+        """Versions with snapshots on disk, oldest first"""
+        if not self.snapshot_dir.exists():
+            return []
+        snapshots = []
+        for path in self.snapshot_dir.glob('*.json'):
+            if _TOKEN.fullmatch(path.stem):
+                snapshot = self._read_json(path)
+                if snapshot:
+                    snapshots.append((snapshot.get('created_at', ''), path.stem))
+        return [version for _, version in sorted(snapshots)]
@@ -8,25 +8,284 @@ import os
 import json
 import logging
 import re
-from typing import List, Dict, Any, Optional
+import uuid
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Set, Tuple
 from datetime import datetime
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 # Import enhanced clinical data
-from enhanced_clinical_database import ENHANCED_CLINICAL_PEPTIDES
+from catalog_artifact import catalog_sources
+from protocol_search_index import FuzzyTermIndex
+from llm_cache import llm_response_cache, cache_key
+from llm_metrics import llm_metrics, last_call
+from llm_replay import llm_replay
+from llm_session_pool import LLMSessionPool
+from llm_gateway import llm_gateway
+from local_answer_engine import LocalAnswerEngine
+from prompt_builder import SECTION_BUDGETS, PromptBuilder, ProtocolSummaryCache, truncate_to_budget
+from structured_output import parse_structured, schema_instructions
+from text_matcher import AhoCorasickMatcher, iter_text_leaves
+
+# Common peptide-related keywords in chat messages and their categories
+CHAT_KEYWORD_CATEGORIES = {
+    # Weight management keywords
+    'weight loss': 'Weight Management',
+    'obesity': 'Weight Management', 
+    'fat loss': 'Weight Management',
+    'semaglutide': 'Weight Management',
+    'tirzepatide': 'Weight Management',
+    'glp-1': 'Weight Management',
+    'ozempic': 'Weight Management',
+    'wegovy': 'Weight Management',
+    'metabolism': 'Weight Management',
+    'metabolic': 'Weight Management',
+    'insulin': 'Weight Management',
+    'diabetes': 'Weight Management',
+    'glucose': 'Weight Management',
+    'energy': 'Weight Management',
+
+    # Cognitive keywords
+    'memory': 'Cognitive Enhancement',
+    'cognition': 'Cognitive Enhancement',
+    'brain': 'Cognitive Enhancement',
+    'focus': 'Cognitive Enhancement',
+    'nootropic': 'Cognitive Enhancement',
+    'dementia': 'Cognitive Enhancement',
+    'alzheimer': 'Cognitive Enhancement',
+    'brain fog': 'Cognitive Enhancement',
+    'executive function': 'Cognitive Enhancement',
+    'mental clarity': 'Cognitive Enhancement',
+    'learning': 'Cognitive Enhancement',
+
+    # Growth hormone keywords
+    'growth hormone': 'Growth Hormone Enhancement',
+    'anti-aging': 'Growth Hormone Enhancement',
+    'longevity': 'Growth Hormone Enhancement',
+    'muscle': 'Growth Hormone Enhancement',
+    'recovery': 'Growth Hormone Enhancement',
+    'exercise': 'Growth Hormone Enhancement',
+    'performance': 'Growth Hormone Enhancement',
+    'strength': 'Growth Hormone Enhancement',
+    'sarcopenia': 'Growth Hormone Enhancement',
+    'fat burning': 'Growth Hormone Enhancement',
+    'endurance': 'Growth Hormone Enhancement',
+
+    # Tissue repair/healing keywords
+    'healing': 'Tissue Repair',
+    'repair': 'Tissue Repair',
+    'recovery': 'Tissue Repair',
+    'injury': 'Tissue Repair',
+    'inflammation': 'Tissue Repair',
+    'inflammatory': 'Tissue Repair',
+    'gut health': 'Tissue Repair',
+    'leaky gut': 'Tissue Repair',
+    'digestive': 'Tissue Repair',
+    'GI': 'Tissue Repair',
+    'IBD': 'Tissue Repair',
+    'IBS': 'Tissue Repair',
+    'post-surgical': 'Tissue Repair',
+    'chronic inflammation': 'Tissue Repair',
+    'autoimmune': 'Tissue Repair',
+    'pain': 'Tissue Repair',
+    'gut': 'Tissue Repair'
+}
+
+# Category mapping based on patient concerns in case data
+CASE_CONCERN_CATEGORIES = {
+    'weight': 'Weight Management',
+    'diabetes': 'Weight Management',
+    'obesity': 'Weight Management',
+    'fat': 'Weight Management',
+    'glucose': 'Weight Management',
+
+    'memory': 'Cognitive Enhancement',
+    'brain': 'Cognitive Enhancement', 
+    'focus': 'Cognitive Enhancement',
+    'concentration': 'Cognitive Enhancement',
+    'cognitive': 'Cognitive Enhancement',
+    'dementia': 'Cognitive Enhancement',
+
+    'muscle': 'Growth Hormone Enhancement',
+    'energy': 'Growth Hormone Enhancement',
+    'aging': 'Growth Hormone Enhancement',
+    'recovery': 'Growth Hormone Enhancement',
+    'sleep': 'Growth Hormone Enhancement',
+
+    'pain': 'Tissue Repair',
+    'injury': 'Tissue Repair',
+    'inflammation': 'Tissue Repair',
+    'inflammatory': 'Tissue Repair',
+    'healing': 'Tissue Repair',
+    'repair': 'Tissue Repair',
+    'recovery': 'Tissue Repair',
+    'joint': 'Tissue Repair',
+    'gut': 'Tissue Repair',
+    'gut health': 'Tissue Repair',
+    'leaky gut': 'Tissue Repair',
+    'digestive': 'Tissue Repair',
+    'GI': 'Tissue Repair',
+    'IBD': 'Tissue Repair',
+    'IBS': 'Tissue Repair',
+    'post-surgical': 'Tissue Repair',
+    'chronic inflammation': 'Tissue Repair',
+    'autoimmune': 'Tissue Repair'
+}
+
+# Characters per event when replaying a complete answer as a stream
+STREAM_CHUNK_SIZE = 64
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+# Single-dose amounts in catalog dosing text: "200-300 mcg", "0.25mg", "5-10 mg"
+_DOSE_AMOUNT = re.compile(r'(\d+(?:\.\d+)?)(?:\s*-\s*(\d+(?:\.\d+)?))?\s*(mcg|mg)\b', re.IGNORECASE)
+
+# Shape of the single structured protocol answer (validated and repaired locally)
+PERSONALIZED_PROTOCOL_SCHEMA = {
+    "type": "object",
+    "required": ["recommended_peptides", "primary_peptide", "clinical_reasoning", "dosing"],
+    "properties": {
+        "recommended_peptides": {"type": "array", "items": {"type": "string"}, "minItems": 1},
+        "primary_peptide": {"type": "string"},
+        "clinical_reasoning": {"type": "string"},
+        "dosing": {
+            "type": "object",
+            "required": ["dose_mcg_kg", "frequency", "route"],
+            "properties": {
+                "dose_mcg_kg": {"type": "number"},
+                "frequency": {"type": "string"},
+                "route": {"type": "string"},
+                "timing": {"type": "string"}
+            }
+        },
+        "medication_interactions": _STRING_LIST,
+        "medical_history_considerations": _STRING_LIST,
+        "patient_specific_warnings": _STRING_LIST,
+        "baseline_labs": _STRING_LIST,
+        "follow_up_schedule": {"type": "string"},
+        "expected_timeline": {
+            "type": "object",
+            "properties": {"2_weeks": {"type": "string"}, "4_weeks": {"type": "string"}, "12_weeks": {"type": "string"}}
+        }
+    }
+}
+
+
+def _chunk_text(text: str, size: int = STREAM_CHUNK_SIZE) -> List[str]:
+    """Split on whitespace boundaries into roughly size-character chunks"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            boundary = text.rfind(' ', start + 1, end + 1)
+            if boundary > start:
+                end = boundary + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
 
 class DrPeptideAI:
     def __init__(self):
         self.emergent_api_key = os.environ.get('EMERGENT_LLM_KEY')
-        self.llm_client = LlmChat(
-            api_key=self.emergent_api_key,
-            session_id="dr_peptide_session",
-            system_message="You are Dr. Peptide, a functional medicine expert specializing in peptide therapy."
-        )
-        self.enhanced_protocols = ENHANCED_CLINICAL_PEPTIDES
+        # One LlmChat session per conversation (one-shot calls get a throwaway session)
+        self.session_pool = LLMSessionPool(self._create_llm_session, provider='emergent',
+                                           conversation_factory=self._create_conversation_session)
+        # LlmChat's default model; part of the response cache key
+        self.llm_model = os.environ.get('DR_PEPTIDE_MODEL_KEY', 'emergent-default')
+        self.response_cache = llm_response_cache
+        # Deadlines, hedging and the circuit breaker for every LlmChat call
+        self.gateway = llm_gateway
+        self.enhanced_protocols = catalog_sources()['enhanced_clinical_peptides']
+        self.protocol_name_index = self._build_protocol_name_index()
+        self.text_matcher = self._build_text_matcher()
+        # Compact per-protocol context, rendered once per catalog load
+        self.protocol_summaries = ProtocolSummaryCache(self.enhanced_protocols)
+        # Catalog lookups ("dose of BPC-157") answered without an LLM call
+        self.local_answers = LocalAnswerEngine(self.enhanced_protocols)
         self.system_prompt = self._create_enhanced_system_prompt()
         self.logger = logging.getLogger(__name__)
         
+    def _create_llm_session(self, session_id: str, system_message: Optional[str] = None) -> LlmChat:
+        # LLM_REPLAY_MODE=record|replay swaps in the fixture recorder or offline stub
+        return llm_replay.wrap_chat(lambda: LlmChat(
+            api_key=self.emergent_api_key,
+            session_id=session_id,
+            system_message=system_message or "You are Dr. Peptide, a functional medicine expert specializing in peptide therapy."
+        ), provider='emergent', model=self.llm_model)
+        
+    def _create_conversation_session(self, conversation_id: str) -> LlmChat:
+        """Pooled sessions get the full system prompt once, so their turns need not repeat it"""
+        return self._create_llm_session(conversation_id, truncate_to_budget(self.system_prompt, SECTION_BUDGETS['system']))
+        
+    async def _send_llm_message(self, prompt: str, kind: str, conversation_id: Optional[str] = None,
+                                cache_if: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Single path to the LLM: answers for identical prompts are served from the response cache.
+        cache_if keeps unusable answers (e.g. invalid structured output) out of the cache. Turns of
+        a conversation are never cached: a cache hit would leave the turn out of the session history
+        """
+        key = cache_key(kind, self.llm_model, prompt)
+        async with llm_metrics.track('emergent', self.llm_model, kind, prompt) as call:
+            cached = await self.response_cache.get(key, kind) if conversation_id is None else None
+            if cached is not None:
+                call.cache = 'hit'
+                call.complete(cached)
+                return cached
+            
+            # One-shot calls get a fresh session per attempt, so only they may be hedged
+            response = await self.gateway.call(
+                'emergent', lambda llm_client: llm_client.send_message(UserMessage(text=prompt)),
+                hedge=conversation_id is None, acquire=lambda: self.session_pool.session(conversation_id)
+            )
+            call.complete(response)
+        if conversation_id is None and (cache_if is None or cache_if(response)):
+            await self.response_cache.set(key, kind, response)
+        return response
+        
+    async def _stream_llm_message(self, prompt: str, kind: str, conversation_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Stream the answer as it is generated when the LLM client supports it; otherwise wrap
+        the single completion (or a cached answer) as a chunked stream
+        """
+        key = cache_key(kind, self.llm_model, prompt)
+        cached = await self.response_cache.get(key, kind) if conversation_id is None else None
+        if cached is None:
+            async def open_stream(llm_client) -> AsyncIterator[str]:
+                stream = getattr(llm_client, 'stream_message', None)
+                if stream is None:
+                    # No native streaming: one completion on the session already held
+                    yield await llm_client.send_message(UserMessage(text=prompt))
+                    return
+                async for chunk in stream(UserMessage(text=prompt)):
+                    yield chunk
+            
+            chunks = []
+            async with llm_metrics.track('emergent', self.llm_model, kind, prompt) as call:
+                async for chunk in self.gateway.stream('emergent', lambda: self.session_pool.session(conversation_id), open_stream):
+                    if chunk:
+                        call.first_token()
+                        chunks.append(chunk)
+                        for piece in _chunk_text(chunk):
+                            yield piece
+                call.complete(''.join(chunks))
+            if conversation_id is None:
+                await self.response_cache.set(key, kind, ''.join(chunks))
+            return
+        
+        async with llm_metrics.track('emergent', self.llm_model, kind, prompt) as call:
+            call.cache = 'hit'
+            call.complete(cached)
+            
+        for chunk in _chunk_text(cached):
+            yield chunk
+            
+    @staticmethod
+    def _tokens_used() -> int:
+        """Tokens of the LLM call just made (estimated locally; LlmChat returns text only)"""
+        call = last_call()
+        return call.total_tokens if call is not None else 0
+        
     def _get_enhanced_protocol_data(self) -> str:
         """Generate comprehensive protocol data from enhanced clinical database"""
         protocol_summaries = []
@@ -61,6 +320,34 @@ class DrPeptideAI:
             
         return "\n".join(protocol_summaries)
             
+    def _build_protocol_name_index(self) -> FuzzyTermIndex:
+        """Trigram index over protocol names and aliases for typo-tolerant lookup"""
+        name_index = FuzzyTermIndex()
+        for ordinal, protocol in enumerate(self.enhanced_protocols):
+            name_index.add(ordinal, protocol['name'], weight=1.0)
+            for alias in protocol.get('aliases', []):
+                name_index.add(ordinal, alias, weight=0.9)
+        return name_index
+        
+    def _build_text_matcher(self) -> AhoCorasickMatcher:
+        """One automaton over protocol names, aliases and chat/case keywords, shared by all extractors"""
+        matcher = AhoCorasickMatcher()
+        for ordinal, protocol in enumerate(self.enhanced_protocols):
+            matcher.add(protocol['name'], ('protocol', ordinal))
+            matcher.add_all(protocol.get('aliases', []), ('protocol', ordinal))
+        # Keywords also match inflections ("muscles", "inflammatory"); acronyms only as whole words
+        for kind, keywords in (('chat', CHAT_KEYWORD_CATEGORIES), ('case', CASE_CONCERN_CATEGORIES)):
+            for keyword in keywords:
+                matcher.add(keyword, (kind, keyword), whole_word=keyword.isupper())
+        return matcher.build()
+        
+    def _match_text(self, text: str) -> Tuple[List[int], Set[Tuple[str, str]]]:
+        """Protocol ordinals (catalog order) and (kind, keyword) hits found in one pass over text"""
+        hits = self.text_matcher.find_values(text)
+        ordinals = sorted(value for kind, value in hits if kind == 'protocol')
+        keywords = {hit for hit in hits if hit[0] != 'protocol'}
+        return ordinals, keywords
+        
     def find_enhanced_protocol(self, peptide_name: str) -> Optional[Dict[str, Any]]:
         """Find enhanced protocol data by peptide name (fuzzy matching)"""
         peptide_lower = peptide_name.lower()
@@ -74,68 +361,26 @@ class DrPeptideAI:
             for alias in protocol.get('aliases', []):
                 if peptide_lower in alias.lower():
                     return protocol
+        
+        # Misspellings and spacing variants ("semaglutid", "bpc157", "ipamorlin")
+        matches = self.protocol_name_index.lookup(peptide_name, limit=1)
+        if matches:
+            return self.enhanced_protocols[matches[0][0]]
                     
         return None
         
     def get_protocol_summary(self, protocol: Dict[str, Any]) -> str:
-        """Generate comprehensive protocol summary for AI context"""
+        """Compact, token-budgeted protocol summary for AI context (precomputed)"""
         if not protocol:
             return ""
-            
-        try:
-            # Extract key data points for AI with safe access
-            name = protocol.get('name', 'Unknown')
-            category = protocol.get('category', 'Unknown')
-            indications = protocol.get('clinical_indications', [])
-            dosing = protocol.get('complete_dosing_schedule', {})
-            admin = protocol.get('administration_techniques', {})
-            safety = protocol.get('safety_profile', {})
-            contraindications = protocol.get('contraindications_and_precautions', {})
-            monitoring = protocol.get('monitoring_requirements', {})
-            timelines = protocol.get('expected_timelines', {})
-            cost = protocol.get('cost_considerations', {})
-            references = protocol.get('scientific_references', [])
-            functional_med = protocol.get('functional_medicine_approach', {})
-
-            # Build summary safely
-            summary = f"""
-ENHANCED PROTOCOL DATA FOR {name}:
-
-**Clinical Profile:**
-- Category: {category}
-- Clinical Indications: {indications[:3] if indications else ['General therapeutic use']}
-- Molecular Weight: {protocol.get('molecular_weight', 'Not specified')} Da
-
-**Dosing Protocols:**
-{json.dumps(dosing, indent=2) if dosing else 'Standard dosing protocols available'}
-
-**Safety Profile:**
-- Common Side Effects: {[f"{se.get('effect', 'Unknown')} ({se.get('frequency', 'Unknown')})" for se in safety.get('common_side_effects', [])][:3]}
-- Contraindications: {contraindications.get('absolute_contraindications', [])[:3]}
-
-**Administration:**
-{json.dumps(admin, indent=2) if admin else 'Standard administration techniques available'}
-
-**Monitoring Requirements:**
-{json.dumps(monitoring, indent=2) if monitoring else 'Standard monitoring protocols available'}
-
-**Expected Outcomes:**
-{json.dumps(timelines, indent=2) if timelines else 'Typical therapeutic timelines available'}
-
-**Cost Analysis:**
-{json.dumps(cost, indent=2) if cost else 'Cost information available upon request'}
-
-**Scientific References:**
-{len(references)} peer-reviewed studies available
-
-**Functional Medicine Approach:**
-{json.dumps(functional_med, indent=2) if functional_med else 'Functional medicine protocols available'}
-"""
-            return summary
-            
-        except Exception as e:
-            logging.warning(f"Error generating protocol summary for {protocol.get('name', 'Unknown')}: {e}")
-            return f"Enhanced protocol data available for {protocol.get('name', 'Unknown Protocol')}"
+        return self.protocol_summaries.get(protocol)
+        
+    def _compose_prompt(self, request_heading: str, request: str, system_note: str = "") -> str:
+        """System prompt plus one request section, each held to its token budget"""
+        builder = PromptBuilder()
+        builder.add('system', self.system_prompt + (f"\n\n{system_note}" if system_note else ""), priority=1)
+        builder.add('request', request, priority=2, heading=f"{request_heading}:")
+        return builder.build()
         
     def _create_enhanced_system_prompt(self) -> str:
         """Create optimized system prompt with comprehensive clinical standards within token limits"""
@@ -194,61 +439,94 @@ MANDATORY INTERACTION CHECK: List ALL current medications and provide specific i
 Generate precise clinical protocols matching major medical center documentation standards.
 """
 
-    async def chat_with_dr_peptide(self, message: str, conversation_history: List[Dict[str, str]] = None) -> Dict[str, Any]:
+    def _build_chat_prompt(self, message: str, conversation_history: Optional[List[Dict[str, str]]],
+                           conversation_id: Optional[str] = None) -> tuple:
         """
-        Enhanced chat interface with intelligent protocol integration
+        Token-budgeted chat prompt and the protocols it cites. One-off sessions get the system
+        prompt, protocol context and recent history; a pooled session already holds the system
+        prompt and earlier turns, so it gets the protocol context and the new message only
+        (plus the client's history when the session is new, e.g. after eviction)
         """
-        try:
-            # Analyze message for peptide references
-            relevant_protocols = self._extract_relevant_protocols(message)
-            
-            # Prepare conversation context
-            if conversation_history is None:
-                conversation_history = []
-                
-            # Build enhanced context with protocol data
-            enhanced_context = ""
-            if relevant_protocols:
-                enhanced_context = "\n\n**RELEVANT ENHANCED PROTOCOLS FOR THIS QUERY:**\n"
-                for protocol in relevant_protocols[:3]:  # Limit to top 3 most relevant
-                    enhanced_context += self.get_protocol_summary(protocol)
-                    enhanced_context += "\n" + "="*50 + "\n"
-                
-            # Build messages for LlmChat
-            messages = []
-            
-            # Add system message
-            system_content = self.system_prompt + enhanced_context
-            
-            # Add conversation history
-            for msg in conversation_history[-8:]:  # Keep last 8 messages for context (reduced due to larger system prompt)
-                if msg.get("role") == "user":
-                    messages.append(UserMessage(text=msg.get("content", "")))
-                # Note: LlmChat handles system messages differently, so we'll include them in the system prompt
-            
-            # Add current message
-            messages.append(UserMessage(text=message))
-            
-            # Get AI response with enhanced parameters  
-            # For LlmChat, we need to send one comprehensive message since it doesn't handle conversation history the same way
-            comprehensive_message = f"{system_content}\n\nCONVERSATION HISTORY:\n"
+        # Analyze message for peptide references
+        relevant_protocols = self._extract_relevant_protocols(message)
+        
+        # Prepare conversation context
+        if conversation_history is None:
+            conversation_history = []
+        pooled = bool(conversation_id)
+            
+        builder = PromptBuilder()
+        if not pooled:
+            builder.add('system', self.system_prompt, priority=2)
+        
+        # Build enhanced context with protocol data
+        if relevant_protocols:
+            builder.add(
+                'protocol_context',
+                "\n\n".join(self.get_protocol_summary(protocol) for protocol in relevant_protocols[:3]),  # Limit to top 3 most relevant
+                priority=1,
+                heading="**RELEVANT ENHANCED PROTOCOLS FOR THIS QUERY:**"
+            )
             
-            # Add conversation context
-            for msg in conversation_history[-3:]:  # Keep last 3 messages for context
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                comprehensive_message += f"\n{role.upper()}: {content}"
+        if not self.session_pool.has_session(conversation_id):
+            history = "\n".join(
+                f"{msg.get('role', 'user').upper()}: {msg.get('content', '')}"
+                for msg in conversation_history[-3:]  # Keep last 3 messages for context
+            )
+            builder.add('history', history, priority=0, heading="CONVERSATION HISTORY:")
+        builder.add('request', f"CURRENT MESSAGE: {message}", priority=3)
+        
+        return builder.build(), relevant_protocols
+
+    def _local_answer(self, message: str, conversation_history: Optional[List[Dict[str, str]]],
+                      conversation_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Catalog answer for a standalone question; follow-ups need the conversation, and a pooled
+        session must see every turn, so those always go to the LLM
+        """
+        if conversation_history or conversation_id:
+            return None
+        return self.local_answers.answer(message)
+
+    @staticmethod
+    def _local_chat_response(local: Dict[str, Any], conversation_id: Optional[str]) -> Dict[str, Any]:
+        """chat_with_dr_peptide's response shape for an answer served from the catalog"""
+        return {
+            "success": True,
+            "response": local['text'],
+            "conversation_id": conversation_id,
+            "enhanced_protocols_used": [local['protocol']['name']],
+            "timestamp": datetime.utcnow().isoformat(),
+            "tokens_used": 0,
+            "answered_locally": True,
+            "intents": local['intents']
+        }
+        
+    async def chat_with_dr_peptide(self, message: str, conversation_history: List[Dict[str, str]] = None,
+                                   conversation_id: Optional[str] = None, kind: str = 'chat') -> Dict[str, Any]:
+        """
+        Enhanced chat interface with intelligent protocol integration.
+        Without a conversation_id the turn runs on a one-off session and the response carries a
+        fresh id; only ids the client echoes back get a pooled session. kind='patient_chat'
+        keeps a message built from patient context out of the shared cache tier
+        """
+        reply_id = conversation_id or str(uuid.uuid4())
+        try:
+            local = self._local_answer(message, conversation_history, conversation_id)
+            if local:
+                return self._local_chat_response(local, reply_id)
             
-            comprehensive_message += f"\n\nCURRENT MESSAGE: {message}"
+            comprehensive_message, relevant_protocols = self._build_chat_prompt(message, conversation_history, conversation_id)
             
-            response = await self.llm_client.send_message(UserMessage(text=comprehensive_message))
+            response = await self._send_llm_message(comprehensive_message, kind=kind, conversation_id=conversation_id)
             
             return {
                 "success": True,
                 "response": response,
+                "conversation_id": reply_id,
                 "enhanced_protocols_used": [p['name'] for p in relevant_protocols] if relevant_protocols else [],
                 "timestamp": datetime.utcnow().isoformat(),
-                "tokens_used": 0  # LlmChat doesn't provide token usage
+                "tokens_used": self._tokens_used()
             }
             
         except Exception as e:
@@ -260,91 +538,58 @@ Generate precise clinical protocols matching major medical center documentation
                 "timestamp": datetime.utcnow().isoformat()
             }
             
+    async def stream_chat_with_dr_peptide(self, message: str, conversation_history: List[Dict[str, str]] = None,
+                                          conversation_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming chat: yields {'event', 'data'} dicts - 'start', then 'token' chunks as they
+        arrive, then 'done' with the protocol metadata (or 'error')
+        """
+        started = datetime.utcnow()
+        reply_id = conversation_id or str(uuid.uuid4())
+        try:
+            local = self._local_answer(message, conversation_history, conversation_id)
+            if local:
+                answer = self._local_chat_response(local, reply_id)
+                yield {"event": "start", "data": {"conversation_id": reply_id, "timestamp": started.isoformat()}}
+                for chunk in _chunk_text(answer.pop("response")):
+                    yield {"event": "token", "data": {"text": chunk}}
+                answer.pop("conversation_id")
+                yield {"event": "done", "data": answer}
+                return
+            
+            comprehensive_message, relevant_protocols = self._build_chat_prompt(message, conversation_history, conversation_id)
+            yield {"event": "start", "data": {"conversation_id": reply_id, "timestamp": started.isoformat()}}
+            
+            async for chunk in self._stream_llm_message(comprehensive_message, kind='chat', conversation_id=conversation_id):
+                yield {"event": "token", "data": {"text": chunk}}
+                
+            yield {"event": "done", "data": {
+                "success": True,
+                "enhanced_protocols_used": [p['name'] for p in relevant_protocols] if relevant_protocols else [],
+                "timestamp": datetime.utcnow().isoformat(),
+                "tokens_used": self._tokens_used()
+            }}
+            
+        except Exception as e:
+            logging.error(f"Streaming Dr. Peptide chat error: {e}")
+            yield {"event": "error", "data": {
+                "success": False,
+                "error": str(e),
+                "response": "I apologize, but I'm experiencing technical difficulties accessing my enhanced clinical database right now. Please try again in a moment, or consult with a healthcare provider for immediate assistance.",
+                "timestamp": datetime.utcnow().isoformat()
+            }}
+            
     def _extract_relevant_protocols(self, message: str) -> List[Dict[str, Any]]:
         """Extract relevant enhanced protocols based on message content"""
-        relevant_protocols = []
-        message_lower = message.lower()
-        
-        # Common peptide-related keywords and their categories
-        keywords_to_category = {
-            # Weight management keywords
-            'weight loss': 'Weight Management',
-            'obesity': 'Weight Management', 
-            'fat loss': 'Weight Management',
-            'semaglutide': 'Weight Management',
-            'tirzepatide': 'Weight Management',
-            'glp-1': 'Weight Management',
-            'ozempic': 'Weight Management',
-            'wegovy': 'Weight Management',
-            'metabolism': 'Weight Management',
-            'metabolic': 'Weight Management',
-            'insulin': 'Weight Management',
-            'diabetes': 'Weight Management',
-            'glucose': 'Weight Management',
-            'energy': 'Weight Management',
-            
-            # Cognitive keywords
-            'memory': 'Cognitive Enhancement',
-            'cognition': 'Cognitive Enhancement',
-            'brain': 'Cognitive Enhancement',
-            'focus': 'Cognitive Enhancement',
-            'nootropic': 'Cognitive Enhancement',
-            'dementia': 'Cognitive Enhancement',
-            'alzheimer': 'Cognitive Enhancement',
-            'brain fog': 'Cognitive Enhancement',
-            'executive function': 'Cognitive Enhancement',
-            'mental clarity': 'Cognitive Enhancement',
-            'learning': 'Cognitive Enhancement',
-            
-            # Growth hormone keywords
-            'growth hormone': 'Growth Hormone Enhancement',
-            'anti-aging': 'Growth Hormone Enhancement',
-            'longevity': 'Growth Hormone Enhancement',
-            'muscle': 'Growth Hormone Enhancement',
-            'recovery': 'Growth Hormone Enhancement',
-            'exercise': 'Growth Hormone Enhancement',
-            'performance': 'Growth Hormone Enhancement',
-            'strength': 'Growth Hormone Enhancement',
-            'sarcopenia': 'Growth Hormone Enhancement',
-            'fat burning': 'Growth Hormone Enhancement',
-            'endurance': 'Growth Hormone Enhancement',
-            
-            # Tissue repair/healing keywords
-            'healing': 'Tissue Repair',
-            'repair': 'Tissue Repair',
-            'recovery': 'Tissue Repair',
-            'injury': 'Tissue Repair',
-            'inflammation': 'Tissue Repair',
-            'inflammatory': 'Tissue Repair',
-            'gut health': 'Tissue Repair',
-            'leaky gut': 'Tissue Repair',
-            'digestive': 'Tissue Repair',
-            'GI': 'Tissue Repair',
-            'IBD': 'Tissue Repair',
-            'IBS': 'Tissue Repair',
-            'post-surgical': 'Tissue Repair',
-            'chronic inflammation': 'Tissue Repair',
-            'autoimmune': 'Tissue Repair',
-            'pain': 'Tissue Repair',
-            'gut': 'Tissue Repair'
-        }
+        ordinals, keywords = self._match_text(message)
         
-        # Find protocols by direct name mention
-        for protocol in self.enhanced_protocols:
-            if protocol['name'].lower() in message_lower:
-                relevant_protocols.append(protocol)
-                continue
-                
-            # Check aliases
-            for alias in protocol.get('aliases', []):
-                if alias.lower() in message_lower:
-                    relevant_protocols.append(protocol)
-                    break
+        # Find protocols by direct name or alias mention
+        relevant_protocols = [self.enhanced_protocols[ordinal] for ordinal in ordinals]
         
         # If no direct matches, find by category/keywords
         if not relevant_protocols:
-            for keyword, category in keywords_to_category.items():
-                if keyword in message_lower:
+            for keyword, category in CHAT_KEYWORD_CATEGORIES.items():
+                if ('chat', keyword) in keywords:
                     category_protocols = [p for p in self.enhanced_protocols if p['category'] == category]
                     relevant_protocols.extend(category_protocols[:2])  # Add top 2 from category
                     
@@ -355,6 +600,11 @@ Generate precise clinical protocols matching major medical center documentation
         try:
             self.logger.info("Generating comprehensive AI-powered protocol...")
             
+            if not self.gateway.available('emergent'):
+                # Provider failing or request budget spent: skip the LLM round trip entirely
+                self.logger.warning("Dr. Peptide LLM unavailable, using enhanced fallback protocol")
+                return self._create_enhanced_fallback_protocol(patient_data)
+            
             # Create comprehensive patient prompt for AI analysis
             patient_concerns = patient_data.get('primary_concerns', ['general health'])
             patient_goals = patient_data.get('health_goals', ['improve wellness'])
@@ -397,27 +647,42 @@ Focus on their specific concerns: {', '.join(patient_concerns)}
 Address their specific goals: {', '.join(patient_goals)}
 
 Provide detailed, evidence-based recommendations that are truly personalized for this individual patient.
+
+Choose recommended_peptides from: {', '.join(protocol['name'] for protocol in self.enhanced_protocols)}
+
+{schema_instructions(PERSONALIZED_PROTOCOL_SCHEMA)}
 """
 
-            # Get AI-powered analysis
-            ai_response = await self.chat_with_dr_peptide(protocol_prompt, [])
+            # One schema-constrained call; the answer is validated (and repaired) locally
+            prompt = self._compose_prompt("PROTOCOL REQUEST", protocol_prompt)
+            ai_response = await self._send_llm_message(
+                prompt, kind='protocol_structured',
+                cache_if=lambda answer: parse_structured(answer, PERSONALIZED_PROTOCOL_SCHEMA).ok
+            )
+            structured = parse_structured(ai_response, PERSONALIZED_PROTOCOL_SCHEMA)
             
-            if ai_response.get("success"):
-                ai_analysis = ai_response["response"]
-                
-                # Parse AI response and create structured protocol
-                return self._create_personalized_protocol_from_ai(ai_analysis, patient_data)
-            else:
-                self.logger.warning("AI analysis failed, using enhanced fallback")
-                return self._create_enhanced_fallback_protocol(patient_data)
+            if structured.ok:
+                if structured.repaired:
+                    self.logger.info("Repaired near-valid structured protocol output")
+                return self._create_personalized_protocol_from_ai(
+                    structured.data['clinical_reasoning'], patient_data, structured.data
+                )
+            
+            # Unusable structure: keep the text for the reasoning and select peptides heuristically
+            self.logger.warning(f"Structured protocol output invalid ({'; '.join(structured.errors[:3])}), using heuristic selection")
+            return self._create_personalized_protocol_from_ai(ai_response, patient_data)
             
         except Exception as e:
             self.logger.error(f"Comprehensive protocol generation failed: {e}")
             # Enhanced fallback protocol
             return self._create_enhanced_fallback_protocol(patient_data)
 
-    def _create_personalized_protocol_from_ai(self, ai_analysis: str, patient_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Create structured protocol from AI analysis with evidence-based peptide selection"""
+    def _create_personalized_protocol_from_ai(self, ai_analysis: str, patient_data: Dict[str, Any],
+                                               structured: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Create structured protocol from AI analysis with evidence-based peptide selection. A
+        validated structured answer supplies the selection and dosing; otherwise keyword heuristics do
+        """
         try:
             patient_concerns = patient_data.get('primary_concerns', ['general health'])
             patient_goals = patient_data.get('health_goals', ['improve wellness'])
@@ -565,6 +830,11 @@ Provide detailed, evidence-based recommendations that are truly personalized for
                     'route': 'subcutaneous'
                 }
             
+            if structured:
+                primary_peptide, recommended_peptides, dosing_info = self._structured_selection(
+                    structured, primary_peptide, recommended_peptides, dosing_info, patient_weight
+                )
+            
             # Calculate personalized dosing
             total_dose = round(dosing_info['dose_mcg_kg'] * patient_weight, 1)
             
@@ -668,12 +938,85 @@ Provide detailed, evidence-based recommendations that are truly personalized for
                 "recommended_peptides": recommended_peptides
             }
             
+            if structured:
+                self._merge_structured_details(personalized_protocol, structured)
+            
             return personalized_protocol
             
         except Exception as e:
             self.logger.error(f"Failed to parse AI response: {e}")
             return self._create_enhanced_fallback_protocol(patient_data)
     
+    def _structured_selection(self, structured: Dict[str, Any], primary_peptide: str, recommended_peptides: List[str],
+                              dosing_info: Dict[str, Any], patient_weight: float) -> Tuple[str, List[str], Dict[str, Any]]:
+        """
+        Model's peptide choice, kept only for names that resolve to catalog protocols. Its mcg/kg
+        dose is used only when the resulting dose lies within the catalog's range for the primary
+        peptide; otherwise the heuristic primary and dosing stand
+        """
+        resolved = []
+        for name in structured['recommended_peptides']:
+            protocol = self.find_enhanced_protocol(name)
+            if protocol and protocol['name'] not in resolved:
+                resolved.append(protocol['name'])
+        if not resolved:
+            return primary_peptide, recommended_peptides, dosing_info
+        
+        primary = self.find_enhanced_protocol(structured['primary_peptide'])
+        primary_name = primary['name'] if primary and primary['name'] in resolved else resolved[0]
+        dosing = structured['dosing']
+        dose_range = self._catalog_dose_range_mcg(self.find_enhanced_protocol(primary_name))
+        total_dose = (dosing['dose_mcg_kg'] or 0) * patient_weight
+        if not dose_range or not dose_range[0] <= total_dose <= dose_range[1]:
+            self.logger.warning(
+                f"Structured dose {dosing['dose_mcg_kg']} mcg/kg for {primary_name} is outside the catalog range "
+                f"{dose_range} mcg, using heuristic dosing for {primary_peptide}"
+            )
+            return primary_peptide, [primary_peptide] + [name for name in resolved if name != primary_peptide], dosing_info
+        
+        structured_dosing = {
+            'dose_mcg_kg': dosing['dose_mcg_kg'],
+            'frequency': dosing['frequency'],
+            'route': dosing['route']
+        }
+        if dosing.get('timing'):
+            structured_dosing['timing'] = dosing['timing']
+        return primary_name, resolved, structured_dosing
+    
+    @staticmethod
+    def _catalog_dose_range_mcg(protocol: Optional[Dict[str, Any]]) -> Optional[Tuple[float, float]]:
+        """Smallest and largest single dose (mcg) stated in a protocol's dosing schedule"""
+        if not protocol:
+            return None
+        amounts = []
+        for text in iter_text_leaves(protocol.get('complete_dosing_schedule', {})):
+            for low, high, unit in _DOSE_AMOUNT.findall(text):
+                scale = 1000.0 if unit.lower() == 'mg' else 1.0
+                amounts.extend(float(value) * scale for value in (low, high) if value)
+        return (min(amounts), max(amounts)) if amounts else None
+    
+    @staticmethod
+    def _merge_structured_details(protocol: Dict[str, Any], structured: Dict[str, Any]):
+        """Add the model's patient-specific safety, monitoring and timeline detail to the protocol"""
+        contraindications = protocol['comprehensive_contraindications']
+        for field in ('medication_interactions', 'medical_history_considerations', 'patient_specific_warnings'):
+            for item in structured.get(field) or []:
+                if item not in contraindications[field]:
+                    contraindications[field].append(item)
+        
+        monitoring = protocol['monitoring_requirements']
+        for lab in structured.get('baseline_labs') or []:
+            if lab not in monitoring['baseline_labs']:
+                monitoring['baseline_labs'].append(lab)
+        if structured.get('follow_up_schedule'):
+            monitoring['follow_up_schedule'] = structured['follow_up_schedule']
+        
+        timeline = structured.get('expected_timeline') or {}
+        protocol['outcome_statistics']['expected_timeline'].update(
+            {period: text for period, text in timeline.items() if text}
+        )
+        protocol['structured_output'] = True
+        
     def _get_mechanism_for_peptide(self, peptide: str, concerns: list) -> list:
         """Get mechanism of action for specific peptide"""
         mechanisms = {
@@ -1058,60 +1401,17 @@ Provide detailed, evidence-based recommendations that are truly personalized for
         """Extract relevant protocols based on comprehensive patient data"""
         relevant_protocols = []
         
-        # Extract all text from patient data
-        all_text = ""
-        for key, value in patient_data.items():
-            if isinstance(value, (str, list, dict)):
-                all_text += f" {json.dumps(value) if not isinstance(value, str) else value}"
-        
-        all_text_lower = all_text.lower()
-        
-        # Category mapping based on patient concerns
-        concern_mappings = {
-            'weight': 'Weight Management',
-            'diabetes': 'Weight Management',
-            'obesity': 'Weight Management',
-            'fat': 'Weight Management',
-            'glucose': 'Weight Management',
-            
-            'memory': 'Cognitive Enhancement',
-            'brain': 'Cognitive Enhancement', 
-            'focus': 'Cognitive Enhancement',
-            'concentration': 'Cognitive Enhancement',
-            'cognitive': 'Cognitive Enhancement',
-            'dementia': 'Cognitive Enhancement',
-            
-            'muscle': 'Growth Hormone Enhancement',
-            'energy': 'Growth Hormone Enhancement',
-            'aging': 'Growth Hormone Enhancement',
-            'recovery': 'Growth Hormone Enhancement',
-            'sleep': 'Growth Hormone Enhancement',
-            
-            'pain': 'Tissue Repair',
-            'injury': 'Tissue Repair',
-            'inflammation': 'Tissue Repair',
-            'inflammatory': 'Tissue Repair',
-            'healing': 'Tissue Repair',
-            'repair': 'Tissue Repair',
-            'recovery': 'Tissue Repair',
-            'joint': 'Tissue Repair',
-            'gut': 'Tissue Repair',
-            'gut health': 'Tissue Repair',
-            'leaky gut': 'Tissue Repair',
-            'digestive': 'Tissue Repair',
-            'GI': 'Tissue Repair',
-            'IBD': 'Tissue Repair',
-            'IBS': 'Tissue Repair',
-            'post-surgical': 'Tissue Repair',
-            'chronic inflammation': 'Tissue Repair',
-            'autoimmune': 'Tissue Repair'
-        }
+        # Match over every text field of the patient record in one pass
+        all_text = "\n".join(
+            leaf for value in patient_data.values() if isinstance(value, (str, list, dict))
+            for leaf in iter_text_leaves(value)
+        )
+        _, keywords = self._match_text(all_text)
         
         # Find relevant categories
-        relevant_categories = set()
-        for concern, category in concern_mappings.items():
-            if concern in all_text_lower:
-                relevant_categories.add(category)
+        relevant_categories = {
+            category for concern, category in CASE_CONCERN_CATEGORIES.items() if ('case', concern) in keywords
+        }
         
         # Get protocols from relevant categories
         for protocol in self.enhanced_protocols:
@@ -1132,21 +1432,8 @@ Provide detailed, evidence-based recommendations that are truly personalized for
         
     def _extract_peptide_names(self, text: str) -> List[str]:
         """Extract peptide names mentioned in text"""
-        peptide_names = []
-        text_lower = text.lower()
-        
-        for protocol in self.enhanced_protocols:
-            if protocol['name'].lower() in text_lower:
-                peptide_names.append(protocol['name'])
-                continue
-            
-            # Check aliases
-            for alias in protocol.get('aliases', []):
-                if alias.lower() in text_lower:
-                    peptide_names.append(protocol['name'])
-                    break
-        
-        return peptide_names
+        ordinals, _ = self._match_text(text)
+        return [self.enhanced_protocols[ordinal]['name'] for ordinal in ordinals]
     
     def check_contraindications(self, patient_data: Dict[str, Any], peptides: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -1290,9 +1577,9 @@ Provide detailed, evidence-based recommendations that are truly personalized for
             
             messages = [UserMessage(text=analysis_prompt)]
             
-            comprehensive_prompt = f"{self.system_prompt}\n\nANALYSIS REQUEST:\n{analysis_prompt}"
+            comprehensive_prompt = self._compose_prompt("ANALYSIS REQUEST", analysis_prompt)
             
-            response = await self.llm_client.send_message(UserMessage(text=comprehensive_prompt))
+            response = await self._send_llm_message(comprehensive_prompt, kind='case_analysis')
             
             analysis = response
             
@@ -1308,7 +1595,7 @@ Provide detailed, evidence-based recommendations that are truly personalized for
                 "analysis": analysis,
                 "patient_id": patient_name,
                 "timestamp": datetime.utcnow().isoformat(),
-                "tokens_used": response.usage.total_tokens if response.usage else 0
+                "tokens_used": self._tokens_used()
             }
             
         except Exception as e:
@@ -1778,11 +2065,13 @@ Please provide specific, actionable recommendations while emphasizing the import
             
             messages = [UserMessage(text=lab_prompt)]
             
-            system_content = self.system_prompt + "\n\nFocus on functional medicine lab interpretation with optimal ranges, not just reference ranges."
-            
-            comprehensive_prompt = f"{system_content}\n\nLAB ANALYSIS REQUEST:\n{lab_prompt}"
+            comprehensive_prompt = self._compose_prompt(
+                "LAB ANALYSIS REQUEST",
+                lab_prompt,
+                system_note="Focus on functional medicine lab interpretation with optimal ranges, not just reference ranges."
+            )
             
-            response = await self.llm_client.send_message(UserMessage(text=comprehensive_prompt))
+            response = await self._send_llm_message(comprehensive_prompt, kind='lab_interpretation')
             
             interpretation = response
             
@@ -1790,7 +2079,7 @@ Please provide specific, actionable recommendations while emphasizing the import
                 "success": True,
                 "interpretation": interpretation,
                 "timestamp": datetime.utcnow().isoformat(),
-                "tokens_used": getattr(response, 'usage', {}).get('total_tokens', 0)
+                "tokens_used": self._tokens_used()
             }
             
         except Exception as e:
@@ -1879,9 +2168,9 @@ Keep the explanation clear and educational for both practitioners and patients.
 
             messages = [UserMessage(text=rationale_prompt)]
             
-            comprehensive_prompt = f"{self.system_prompt}\n\nRATIONALE REQUEST:\n{rationale_prompt}"
+            comprehensive_prompt = self._compose_prompt("RATIONALE REQUEST", rationale_prompt)
             
-            response = await self.llm_client.send_message(UserMessage(text=comprehensive_prompt))
+            response = await self._send_llm_message(comprehensive_prompt, kind='rationale')
             
             rationale = response
             
@@ -1940,16 +2229,9 @@ Please provide a structured monitoring plan including:
 Format as a clear, actionable monitoring plan.
 """
 
-            messages = [UserMessage(content=monitoring_prompt)]
-            
-            response = await self.llm_client.chat_async(
-                messages=messages,
-                system_prompt=self.system_prompt,
-                temperature=0.3,
-                max_tokens=2000
-            )
+            comprehensive_prompt = self._compose_prompt("MONITORING PLAN REQUEST", monitoring_prompt)
             
-            monitoring_plan = response.content
+            monitoring_plan = await self._send_llm_message(comprehensive_prompt, kind='monitoring_plan')
             
             return {
                 "success": True,
@@ -1967,10 +2249,11 @@ Format as a clear, actionable monitoring plan.
 
     async def process_chat(self, message: str) -> str:
         """
-        Simple chat processing method for collective intelligence integration
+        Simple chat processing method for collective intelligence integration; its messages
+        embed patient context (follow-ups, feedback), so they are cached per process only
         """
         try:
-            response = await self.chat_with_dr_peptide(message)
+            response = await self.chat_with_dr_peptide(message, kind='patient_chat')
             if response.get("success"):
                 return response.get("response", "")
             else:
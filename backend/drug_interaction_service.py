@@ -8,6 +8,8 @@ from typing import List, Dict, Optional, Tuple
 from enum import Enum
 import logging
 
+from text_matcher import AhoCorasickMatcher
+
 logger = logging.getLogger(__name__)
 
 class InteractionSeverity(str, Enum):
@@ -16,6 +18,19 @@ class InteractionSeverity(str, Enum):
     MAJOR = "major"
     CONTRAINDICATED = "contraindicated"
 
+# Medication classes referenced by interaction entries, with the drugs they cover
+MEDICATION_CLASSES = {
+    "insulin": ["insulin", "humalog", "novolog", "lantus", "levemir"],
+    "sulfonylureas": ["glipizide", "glyburide", "glimepiride"],
+    "nsaids": ["ibuprofen", "naproxen", "celecoxib", "diclofenac"],
+    "anticoagulants": ["warfarin", "heparin", "rivaroxaban", "apixaban"],
+    "diabetes_medications": ["metformin", "glipizide", "insulin", "pioglitazone"],
+    "antihypertensives": ["lisinopril", "amlodipine", "metoprolol", "losartan"],
+    "pde5_inhibitors": ["sildenafil", "tadalafil", "vardenafil"],
+    "ssri_antidepressants": ["sertraline", "fluoxetine", "citalopram", "escitalopram"],
+    "benzodiazepines": ["lorazepam", "alprazolam", "clonazepam", "diazepam"]
+}
+
 class DrugInteractionService:
     """
     Drug interaction service with built-in database of common drug interactions
@@ -25,6 +40,28 @@ class DrugInteractionService:
     def __init__(self):
         self.interaction_database = self._initialize_interaction_database()
         self.peptide_interactions = self._initialize_peptide_interactions()
+        self.drug_matcher = self._build_drug_matcher()
+        
+    def _build_drug_matcher(self) -> AhoCorasickMatcher:
+        """Automaton over every known drug and peptide term, so free-text entries
+        ("Metformin 500mg BID", "BPC-157") resolve to database keys in one pass"""
+        terms = set(self.interaction_database) | set(self.peptide_interactions)
+        for database in (self.interaction_database, self.peptide_interactions):
+            for entry in database.values():
+                terms.update(interaction["drug"] for interaction in entry["interactions"])
+        for members in MEDICATION_CLASSES.values():
+            terms.update(members)
+        
+        matcher = AhoCorasickMatcher()
+        for term in terms:
+            # Keys use underscores; entries are written with spaces or hyphens
+            matcher.add_all({term, term.replace("_", " "), term.replace("_", "-")}, term)
+        return matcher.build()
+        
+    def _drug_terms(self, name: str) -> List[str]:
+        """Known drug terms mentioned in a medication or peptide entry (the entry itself if none)"""
+        terms = self.drug_matcher.find_values(name)
+        return sorted(terms) if terms else [name]
         
     def _initialize_interaction_database(self) -> Dict:
         """Initialize comprehensive drug interaction database"""
@@ -362,10 +399,15 @@ class DrugInteractionService:
     
     def _find_interaction(self, drug1: str, drug2: str, interaction_type: str) -> Optional[Dict]:
         """Find interaction between two regular medications"""
+        terms1 = self._drug_terms(drug1)
+        terms2 = self._drug_terms(drug2)
+        
         # Check if drug1 has interactions with drug2
-        if drug1 in self.interaction_database:
-            for interaction in self.interaction_database[drug1]["interactions"]:
-                if interaction["drug"] == drug2:
+        for term in terms1:
+            if term not in self.interaction_database:
+                continue
+            for interaction in self.interaction_database[term]["interactions"]:
+                if interaction["drug"] in terms2:
                     return {
                         "drug1": drug1,
                         "drug2": drug2,
@@ -377,9 +419,11 @@ class DrugInteractionService:
                     }
         
         # Check reverse direction
-        if drug2 in self.interaction_database:
-            for interaction in self.interaction_database[drug2]["interactions"]:
-                if interaction["drug"] == drug1:
+        for term in terms2:
+            if term not in self.interaction_database:
+                continue
+            for interaction in self.interaction_database[term]["interactions"]:
+                if interaction["drug"] in terms1:
                     return {
                         "drug1": drug2,
                         "drug2": drug1,
@@ -394,8 +438,10 @@ class DrugInteractionService:
     
     def _find_peptide_medication_interaction(self, peptide: str, medication: str) -> Optional[Dict]:
         """Find interaction between peptide and medication"""
-        if peptide in self.peptide_interactions:
-            for interaction in self.peptide_interactions[peptide]["interactions"]:
+        for term in self._drug_terms(peptide):
+            if term not in self.peptide_interactions:
+                continue
+            for interaction in self.peptide_interactions[term]["interactions"]:
                 if self._medication_matches(interaction["drug"], medication):
                     return {
                         "drug1": peptide,
@@ -430,23 +476,13 @@ class DrugInteractionService:
     
     def _medication_matches(self, interaction_drug: str, medication: str) -> bool:
         """Check if medication matches interaction drug pattern"""
-        # Handle medication classes
-        medication_classes = {
-            "insulin": ["insulin", "humalog", "novolog", "lantus", "levemir"],
-            "sulfonylureas": ["glipizide", "glyburide", "glimepiride"],
-            "nsaids": ["ibuprofen", "naproxen", "celecoxib", "diclofenac"],
-            "anticoagulants": ["warfarin", "heparin", "rivaroxaban", "apixaban"],
-            "diabetes_medications": ["metformin", "glipizide", "insulin", "pioglitazone"],
-            "antihypertensives": ["lisinopril", "amlodipine", "metoprolol", "losartan"],
-            "pde5_inhibitors": ["sildenafil", "tadalafil", "vardenafil"],
-            "ssri_antidepressants": ["sertraline", "fluoxetine", "citalopram", "escitalopram"],
-            "benzodiazepines": ["lorazepam", "alprazolam", "clonazepam", "diazepam"]
-        }
+        medication_terms = self._drug_terms(medication)
         
-        if interaction_drug in medication_classes:
-            return medication in medication_classes[interaction_drug]
+        # Handle medication classes
+        if interaction_drug in MEDICATION_CLASSES:
+            return any(term in MEDICATION_CLASSES[interaction_drug] for term in medication_terms)
         
-        return interaction_drug == medication
+        return interaction_drug in medication_terms
     
     def _generate_interaction_summary(self, interactions: List[Dict]) -> str:
         """Generate a summary of interactions found"""
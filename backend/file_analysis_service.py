@@ -12,11 +12,9 @@ import tempfile
 from pathlib import Path
 from datetime import datetime
 
-# Import required libraries for file processing
-import pytesseract
-from PIL import Image
-import pdfplumber
-from openai import AsyncOpenAI
+from llm_gateway import llm_gateway
+
+# OCR (pytesseract, PIL) and PDF (pdfplumber) libraries are imported on first use; OpenAI calls go through the LLM gateway
 
 # Add docx support if available
 try:
@@ -34,7 +32,6 @@ except ImportError:
 
 class FileAnalysisService:
     def __init__(self):
-        self.openai_client = AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
         self.supported_formats = {
             'pdf': self._analyze_pdf,
             'jpg': self._analyze_image, 
@@ -97,6 +94,7 @@ class FileAnalysisService:
     async def _analyze_pdf(self, file_content: bytes) -> str:
         """Extract text from PDF files"""
         try:
+            import pdfplumber
             text_content = ""
             with io.BytesIO(file_content) as pdf_file:
                 with pdfplumber.open(pdf_file) as pdf:
@@ -112,6 +110,9 @@ class FileAnalysisService:
     async def _analyze_image(self, file_content: bytes) -> str:
         """Extract text from images using OCR"""
         try:
+            import pytesseract
+            from PIL import Image
+
             # Save to temporary file for pytesseract
             with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
                 temp_file.write(file_content)
@@ -243,7 +244,8 @@ class FileAnalysisService:
                 }
             ]
             
-            response = await self.openai_client.chat.completions.create(
+            response = await llm_gateway.openai_chat(
+                kind="file_analysis",
                 model="gpt-5",
                 messages=messages,
                 temperature=0.2,  # Low temperature for consistent medical analysis
@@ -537,7 +539,8 @@ Focus on creating a cohesive, comprehensive treatment strategy.
                 }
             ]
             
-            response = await self.openai_client.chat.completions.create(
+            response = await llm_gateway.openai_chat(
+                kind="integrated_file_analysis",
                 model="gpt-5",
                 messages=messages,
                 temperature=0.3,
@@ -0,0 +1,133 @@
+"""
+Lazy Imports - Deferred loading of heavy subsystems and import cost reporting
+PDF, OCR and email stacks load on first use, so API-only workers never pay for them
+"""
+
+import importlib
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LazyService:
+    """
+    Stand-in for a module-level service instance; imports the module and resolves
+    the attribute on first attribute access, then behaves like the real object
+    """
+
+    def __init__(self, module_name: str, attribute: str):
+        self._module_name = module_name
+        self._attribute = attribute
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+    def _resolve(self) -> Any:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._module_name)
+                    self._instance = getattr(module, self._attribute)
+                    elapsed = (time.perf_counter() - started) * 1000
+                    import_timer.record(self._module_name, elapsed)
+                    logger.info(f"Loaded {self._module_name}.{self._attribute} on first use in {elapsed:.0f}ms")
+        return self._instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._resolve(), name)
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f"<LazyService {self._module_name}.{self._attribute} ({state})>"
+
+
+class _TimedLoader:
+    """Wraps a module loader to time module execution"""
+
+    def __init__(self, loader, timer: 'ImportTimer'):
+        self._loader = loader
+        self._timer = timer
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.record(module.__name__, (time.perf_counter() - started) * 1000)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._loader, name)
+
+
+class ImportTimer:
+    """Records cumulative import time per module (including the modules it imports)"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._started_at: Optional[float] = None
+
+    def record(self, module_name: str, elapsed_ms: float):
+        self.timings.setdefault(module_name, elapsed_ms)
+
+    # Meta path finder protocol: delegate to the real finders, wrap their loader
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def start(self):
+        """Time every module first imported from now until stop()"""
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+            sys.meta_path.insert(0, self)
+
+    def stop(self, label: str = 'startup'):
+        if self._started_at is None:
+            return
+        sys.meta_path.remove(self)
+        self.record(f"<{label}>", (time.perf_counter() - self._started_at) * 1000)
+        self._started_at = None
+
+    @contextmanager
+    def track(self, label: str = 'startup'):
+        self.start()
+        try:
+            yield
+        finally:
+            self.stop(label)
+
+    def report(self, limit: int = 15, modules: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Most expensive imports first, optionally restricted to the given top-level modules"""
+        entries = [
+            {'module': name, 'import_ms': round(elapsed, 1)}
+            for name, elapsed in self.timings.items()
+            if modules is None or name in modules
+        ]
+        entries.sort(key=lambda entry: entry['import_ms'], reverse=True)
+        return entries[:limit]
+
+    def log_report(self, limit: int = 15):
+        lines = [f"  {entry['import_ms']:8.1f}ms  {entry['module']}" for entry in self.report(limit)]
+        logger.info("Import cost by module (cumulative):\n" + "\n".join(lines))
+
+
+# Global instance
+import_timer = ImportTimer()
@@ -0,0 +1,174 @@
+"""
+LLM Response Cache - Reuse Dr. Peptide answers for repeated prompts
+Keys hash the normalized prompt (including injected protocol context) and the model;
+entries live in an in-process LRU with TTLs, optionally backed by Mongo
+"""
+
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached answer stays valid, per kind of call
+DEFAULT_TTLS = {
+    'chat': 6 * 3600,
+    'patient_chat': 3600,
+    'protocol_structured': 6 * 3600,
+    'rationale': 24 * 3600,
+    'lab_interpretation': 3600,
+    'case_analysis': 3600
+}
+DEFAULT_TTL = 3600
+
+# Prompts and answers carrying patient names, medications and labs stay in this process and
+# are never written to (or read from) the shared Mongo tier
+LOCAL_ONLY_KINDS = frozenset({
+    'case_analysis', 'lab_interpretation', 'protocol_structured', 'monitoring_plan', 'patient_chat'
+})
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_prompt(text: str) -> str:
+    """Canonical form for cache keys: Unicode NFKC, case-folded, whitespace collapsed"""
+    text = unicodedata.normalize('NFKC', text or '')
+    return _WHITESPACE.sub(' ', text).strip().casefold()
+
+
+def cache_key(kind: str, model: str, prompt: str) -> str:
+    """The prompt already carries the system prompt and any injected protocol context"""
+    hasher = hashlib.sha256()
+    for part in (kind, model, normalize_prompt(prompt)):
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\x1f')
+    return hasher.hexdigest()
+
+
+class MongoCacheTier:
+    """Shared second tier so workers reuse each other's answers; expiry via a TTL index"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._index_ready = False
+
+    async def _ensure_index(self):
+        if not self._index_ready:
+            await self.collection.create_index('expires_at', expireAfterSeconds=0)
+            self._index_ready = True
+
+    async def get(self, key: str) -> Optional[Tuple[str, float]]:
+        document = await self.collection.find_one({'_id': key})
+        if not document:
+            return None
+        remaining = (document['expires_at'] - datetime.utcnow()).total_seconds()
+        if remaining <= 0:
+            return None
+        return document['response'], remaining
+
+    async def set(self, key: str, kind: str, response: str, ttl: float):
+        await self._ensure_index()
+        await self.collection.replace_one(
+            {'_id': key},
+            {'_id': key, 'kind': kind, 'response': response, 'expires_at': datetime.utcnow() + timedelta(seconds=ttl)},
+            upsert=True
+        )
+
+
+class LLMResponseCache:
+    """In-process LRU with per-entry TTL, plus an optional shared tier"""
+
+    def __init__(self, max_entries: int = 1000, ttls: Optional[Dict[str, int]] = None):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.shared_tier: Optional[MongoCacheTier] = None
+        self._entries: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self.metrics = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'errors': 0
+        }
+
+    def attach_shared_tier(self, collection):
+        """Enable the Mongo tier (e.g. db.llm_response_cache)"""
+        self.shared_tier = MongoCacheTier(collection)
+
+    def ttl_for(self, kind: str) -> int:
+        return self.ttls.get(kind, DEFAULT_TTL)
+
+    def _shares(self, kind: Optional[str]) -> bool:
+        return self.shared_tier is not None and kind not in LOCAL_ONLY_KINDS
+
+    async def get(self, key: str, kind: Optional[str] = None) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            response, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.metrics['hits'] += 1
+                return response
+            del self._entries[key]
+            self.metrics['expirations'] += 1
+
+        if self._shares(kind):
+            try:
+                shared = await self.shared_tier.get(key)
+            except Exception as e:
+                self.metrics['errors'] += 1
+                logger.warning(f"LLM cache shared tier read failed: {e}")
+                shared = None
+            if shared:
+                response, remaining = shared
+                self._store_local(key, response, remaining)
+                self.metrics['shared_hits'] += 1
+                return response
+
+        self.metrics['misses'] += 1
+        return None
+
+    async def set(self, key: str, kind: str, response: str):
+        if not response:
+            return
+        ttl = self.ttl_for(kind)
+        self._store_local(key, response, ttl)
+        self.metrics['stores'] += 1
+        if self._shares(kind):
+            try:
+                await self.shared_tier.set(key, kind, response, ttl)
+            except Exception as e:
+                self.metrics['errors'] += 1
+                logger.warning(f"LLM cache shared tier write failed: {e}")
+
+    def _store_local(self, key: str, response: str, ttl: float):
+        self._entries[key] = (response, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.metrics['evictions'] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.metrics['hits'] + self.metrics['shared_hits'] + self.metrics['misses']
+        hit_rate = (self.metrics['hits'] + self.metrics['shared_hits']) / lookups if lookups else 0.0
+        return {
+            **self.metrics,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hit_rate': round(hit_rate, 3),
+            'shared_tier': self.shared_tier is not None
+        }
+
+
+# Global instance
+llm_response_cache = LLMResponseCache()
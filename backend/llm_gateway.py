@@ -0,0 +1,336 @@
+"""
+LLM Gateway - One front door for LlmChat and OpenAI calls
+Pooled clients, per-call deadlines bounded by the caller's remaining request budget,
+optional hedged retries once a call runs past the provider's latency percentile, and a
+circuit breaker per provider so callers can go straight to deterministic fallbacks
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Optional
+
+from llm_metrics import llm_metrics
+from llm_replay import llm_replay
+from request_coalescing import AdmissionController, AdmissionRejected, llm_admission
+
+logger = logging.getLogger(__name__)
+
+# Per-call ceiling when the caller has no tighter budget
+DEFAULT_TIMEOUTS = {
+    'emergent': float(os.environ.get('LLM_TIMEOUT_SECONDS', '90')),
+    'openai': float(os.environ.get('OPENAI_TIMEOUT_SECONDS', '60'))
+}
+DEFAULT_TIMEOUT = 60.0
+# Calls are not started with less budget than this left; the caller falls back instead
+MIN_CALL_SECONDS = 2.0
+# Hedge a call still running past this latency percentile (0 disables hedging)
+DEFAULT_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', '0'))
+HEDGE_MIN_SAMPLES = 20
+MIN_HEDGE_DELAY = 2.0
+# Consecutive failures that open a provider's breaker, and seconds before a probe is let through
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('LLM_BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('LLM_BREAKER_RESET_SECONDS', '30'))
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar('llm_deadline', default=None)
+
+
+class LLMUnavailable(Exception):
+    """The call was not made (or abandoned); callers should use their fallback"""
+
+
+class CircuitOpen(LLMUnavailable):
+    pass
+
+
+class DeadlineExceeded(LLMUnavailable):
+    pass
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """Budget for everything awaited inside the block; nested scopes can only tighten it"""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left in the current request budget (None when unbounded)"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open (one probe) after the reset timeout"""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.metrics = {'opened': 0, 'short_circuited': 0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def available(self) -> bool:
+        """Whether a call would be let through right now (does not claim the probe)"""
+        state = self.state
+        return state == 'closed' or (state == 'half_open' and not self._probing)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self._probing:
+            self._probing = True
+            return True
+        self.metrics['short_circuited'] += 1
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self):
+        """The probe was cancelled without an outcome; let the next call probe instead"""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                self.metrics['opened'] += 1
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class ProviderRoute:
+    """Timeout, latency history, hedging policy and breaker for one provider"""
+
+    def __init__(self, name: str, timeout: float, hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE):
+        self.name = name
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.breaker = CircuitBreaker()
+        self.latencies = deque(maxlen=200)
+        self.metrics = {'calls': 0, 'successes': 0, 'failures': 0, 'timeouts': 0, 'hedged': 0, 'hedge_wins': 0}
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_percentile:
+            return None
+        latency = self.latency_percentile(self.hedge_percentile)
+        return None if latency is None else max(latency, MIN_HEDGE_DELAY)
+
+
+class LLMGateway:
+    """Routes every LLM call through its provider's deadline, hedging and breaker policy"""
+
+    def __init__(self, timeouts: Optional[Dict[str, float]] = None, admission: Optional[AdmissionController] = None):
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.admission = admission or llm_admission
+        self.routes: Dict[str, ProviderRoute] = {}
+        self._openai_client = None
+
+    def route(self, provider: str) -> ProviderRoute:
+        route = self.routes.get(provider)
+        if route is None:
+            route = self.routes[provider] = ProviderRoute(provider, self.timeouts.get(provider, DEFAULT_TIMEOUT))
+        return route
+
+    def available(self, provider: str) -> bool:
+        """False while the provider's breaker is open or too little budget is left for a call"""
+        budget = remaining_budget()
+        if budget is not None and budget < MIN_CALL_SECONDS:
+            return False
+        return self.route(provider).breaker.available()
+
+    def openai_client(self):
+        """One pooled AsyncOpenAI client (and its HTTP connection pool) for the process"""
+        if self._openai_client is None:
+            def create():
+                from openai import AsyncOpenAI
+                return AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+            # LLM_REPLAY_MODE=record|replay swaps in the fixture recorder or offline stub
+            self._openai_client = llm_replay.wrap_openai(create)
+        return self._openai_client
+
+    def _timeout(self, route: ProviderRoute) -> float:
+        """Per-call timeout, bounded by the remaining request budget"""
+        budget = remaining_budget()
+        if budget is None:
+            return route.timeout
+        if budget < MIN_CALL_SECONDS:
+            raise DeadlineExceeded(f"{route.name}: {max(budget, 0):.1f}s of request budget left")
+        return min(route.timeout, budget)
+
+    async def call(self, provider: str, attempt: Callable[..., Awaitable[Any]], hedge: bool = False,
+                   acquire: Optional[Callable[[], AsyncContextManager]] = None) -> Any:
+        """
+        Run attempt() under the provider's policy. With acquire (a session or admission slot),
+        each attempt first waits for it and then runs as attempt(resource); that wait counts
+        neither toward the timeout nor, when rejected, against the breaker. hedge=True allows a
+        second concurrent attempt when the first outlives the latency percentile; only use it
+        for calls that are safe to send twice (no shared conversation state)
+        """
+        route = self.route(provider)
+        timeout = self._timeout(route)
+        if not route.breaker.allow():
+            raise CircuitOpen(f"{provider} circuit is open")
+
+        route.metrics['calls'] += 1
+        try:
+            hedge_delay = route.hedge_delay() if hedge else None
+            if hedge_delay is not None and hedge_delay < timeout:
+                result = await self._hedged(route, lambda: self._attempt(route, attempt, acquire), hedge_delay)
+            else:
+                result = await self._attempt(route, attempt, acquire)
+        except asyncio.TimeoutError:
+            route.metrics['timeouts'] += 1
+            route.breaker.record_failure()
+            raise DeadlineExceeded(f"{provider} call timed out")
+        except (asyncio.CancelledError, AdmissionRejected, DeadlineExceeded):
+            # Local queueing or an exhausted request budget says nothing about the provider
+            route.breaker.release_probe()
+            raise
+        except Exception:
+            route.metrics['failures'] += 1
+            route.breaker.record_failure()
+            raise
+
+        route.metrics['successes'] += 1
+        route.breaker.record_success()
+        return result
+
+    async def _attempt(self, route: ProviderRoute, attempt: Callable[..., Awaitable[Any]],
+                       acquire: Optional[Callable[[], AsyncContextManager]]) -> Any:
+        if acquire is None:
+            return await self._timed(route, attempt)
+        async with acquire() as resource:
+            return await self._timed(route, lambda: attempt(resource))
+
+    async def _timed(self, route: ProviderRoute, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        # The timeout starts once the slot is granted
+        timeout = self._timeout(route)
+        started = time.monotonic()
+        result = await asyncio.wait_for(attempt(), timeout=timeout)
+        route.latencies.append(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, route: ProviderRoute, run: Callable[[], Awaitable[Any]], hedge_delay: float) -> Any:
+        # Each run is bounded by its own timeout
+        primary = asyncio.ensure_future(run())
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+            if not done:
+                route.metrics['hedged'] += 1
+                pending.add(asyncio.ensure_future(run()))
+            last_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            route.metrics['hedge_wins'] += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, provider: str, acquire: Callable[[], AsyncContextManager],
+                     open_stream: Callable[[Any], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        call() for a streamed answer: chunks of open_stream(resource) are passed through, the
+        whole stream must finish within the timeout (started once acquire() is granted) and
+        its outcome is recorded on the breaker
+        """
+        route = self.route(provider)
+        self._timeout(route)
+        if not route.breaker.allow():
+            raise CircuitOpen(f"{provider} circuit is open")
+
+        route.metrics['calls'] += 1
+        try:
+            async with acquire() as resource:
+                deadline = time.monotonic() + self._timeout(route)
+                started = time.monotonic()
+                chunks = open_stream(resource).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline - time.monotonic())
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+        except asyncio.TimeoutError:
+            route.metrics['timeouts'] += 1
+            route.breaker.record_failure()
+            raise DeadlineExceeded(f"{provider} stream timed out")
+        except (asyncio.CancelledError, GeneratorExit, AdmissionRejected, DeadlineExceeded):
+            # Includes the consumer going away mid-stream: no verdict on the provider
+            route.breaker.release_probe()
+            raise
+        except Exception:
+            route.metrics['failures'] += 1
+            route.breaker.record_failure()
+            raise
+
+        route.metrics['successes'] += 1
+        route.latencies.append(time.monotonic() - started)
+        route.breaker.record_success()
+
+    async def openai_chat(self, kind: str = 'chat', **request) -> Any:
+        """chat.completions.create through the pooled client; stateless, so it may be hedged"""
+        prompt = '\n'.join(str(message.get('content', '')) for message in request.get('messages', []))
+        async with llm_metrics.track('openai', request.get('model', 'unknown'), kind, prompt) as call:
+            response = await self.call(
+                'openai', lambda _: self.openai_client().chat.completions.create(**request), hedge=True,
+                acquire=lambda: self.admission.slot('openai')
+            )
+            choices = getattr(response, 'choices', None) or []
+            call.complete(choices[0].message.content if choices else None, getattr(response, 'usage', None))
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {}
+        for name, route in self.routes.items():
+            p50 = route.latency_percentile(0.5)
+            p95 = route.latency_percentile(0.95)
+            stats[name] = {
+                **route.metrics,
+                **route.breaker.metrics,
+                'breaker_state': route.breaker.state,
+                'consecutive_failures': route.breaker.failures,
+                'timeout_seconds': route.timeout,
+                'latency_p50': round(p50, 3) if p50 is not None else None,
+                'latency_p95': round(p95, 3) if p95 is not None else None
+            }
+        return stats
+
+
+# Global instance
+llm_gateway = LLMGateway()
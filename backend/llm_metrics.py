@@ -0,0 +1,257 @@
+"""
+LLM Metrics - Per-call instrumentation for every LLM request
+Records prompt/completion tokens, wall time, time to first token, model, cache outcome,
+estimated cost and the calling endpoint; aggregates them per endpoint for the metrics
+endpoint and keeps a per-request breakdown for debug response headers
+"""
+
+import contextvars
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import List, Dict, Any, Callable, Optional, Tuple, Union
+
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# USD per 1M tokens (input, output); extend or override with LLM_MODEL_PRICES='{"model": [in, out]}'
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    'gpt-5': (1.25, 10.0)
+}
+try:
+    MODEL_PRICES.update({model: tuple(price) for model, price in json.loads(os.environ.get('LLM_MODEL_PRICES', '{}')).items()})
+except (ValueError, TypeError) as e:
+    logger.warning(f"Ignoring malformed LLM_MODEL_PRICES: {e}")
+
+# Latency samples kept per series for percentiles
+LATENCY_WINDOW = 500
+
+_endpoint: contextvars.ContextVar = contextvars.ContextVar('llm_endpoint', default='background')
+_request_calls: contextvars.ContextVar = contextvars.ContextVar('llm_request_calls', default=None)
+_last_call: contextvars.ContextVar = contextvars.ContextVar('llm_last_call', default=None)
+
+
+class LLMCall:
+    """Measurements for one LLM call (or cache hit standing in for one)"""
+
+    def __init__(self, provider: str, model: str, kind: str, prompt: str):
+        self.provider = provider
+        self.model = model
+        self.kind = kind
+        self.endpoint = current_endpoint()
+        self.prompt_tokens = estimate_tokens(prompt)
+        self.completion_tokens = 0
+        self.tokens_estimated = True
+        self.cache = 'miss'
+        self.status = 'ok'
+        self.started = time.monotonic()
+        self.wall_ms = 0.0
+        self.ttft_ms: Optional[float] = None
+
+    def first_token(self):
+        if self.ttft_ms is None:
+            self.ttft_ms = (time.monotonic() - self.started) * 1000
+
+    def complete(self, completion: Optional[str] = None, usage: Any = None):
+        """Provider-reported usage when available, otherwise local token estimates"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', None) if usage is not None else None
+        completion_tokens = getattr(usage, 'completion_tokens', None) if usage is not None else None
+        if prompt_tokens is not None and completion_tokens is not None:
+            self.prompt_tokens = prompt_tokens
+            self.completion_tokens = completion_tokens
+            self.tokens_estimated = False
+        else:
+            self.completion_tokens = estimate_tokens(completion or '')
+        self.first_token()
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def cost_usd(self) -> Optional[float]:
+        price = MODEL_PRICES.get(self.model)
+        if price is None or self.cache == 'hit':
+            return None if price is None else 0.0
+        return (self.prompt_tokens * price[0] + self.completion_tokens * price[1]) / 1_000_000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'provider': self.provider,
+            'model': self.model,
+            'kind': self.kind,
+            'endpoint': self.endpoint,
+            'cache': self.cache,
+            'status': self.status,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'tokens_estimated': self.tokens_estimated,
+            'wall_ms': round(self.wall_ms, 1),
+            'ttft_ms': round(self.ttft_ms, 1) if self.ttft_ms is not None else None,
+            'cost_usd': self.cost_usd
+        }
+
+
+class _Series:
+    def __init__(self):
+        self.counts = {
+            'calls': 0, 'errors': 0, 'cache_hits': 0,
+            'prompt_tokens': 0, 'completion_tokens': 0, 'estimated_token_calls': 0
+        }
+        self.cost_usd = 0.0
+        self.wall_ms = deque(maxlen=LATENCY_WINDOW)
+        self.ttft_ms = deque(maxlen=LATENCY_WINDOW)
+
+    def add(self, call: LLMCall):
+        self.counts['calls'] += 1
+        self.counts['errors'] += call.status != 'ok'
+        self.counts['cache_hits'] += call.cache == 'hit'
+        self.counts['prompt_tokens'] += call.prompt_tokens
+        self.counts['completion_tokens'] += call.completion_tokens
+        self.counts['estimated_token_calls'] += call.tokens_estimated
+        self.cost_usd += call.cost_usd or 0.0
+        if call.cache != 'hit' and call.status == 'ok':
+            self.wall_ms.append(call.wall_ms)
+            if call.ttft_ms is not None:
+                self.ttft_ms.append(call.ttft_ms)
+
+
+def _percentile(samples, percentile: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(percentile * len(ordered)))], 1)
+
+
+class LLMMetrics:
+    """Aggregates calls per (endpoint, provider, model, kind)"""
+
+    def __init__(self):
+        self.series: Dict[Tuple[str, str, str, str], _Series] = {}
+
+    def record(self, call: LLMCall):
+        key = (call.endpoint, call.provider, call.model, call.kind)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = _Series()
+        series.add(call)
+        calls = _request_calls.get()
+        if calls is not None:
+            calls.append(call)
+        _last_call.set(call)
+
+    @asynccontextmanager
+    async def track(self, provider: str, model: str, kind: str, prompt: str):
+        """Instrument one call: the caller sets cache/first_token/complete on the yielded LLMCall"""
+        call = LLMCall(provider, model, kind, prompt)
+        try:
+            yield call
+        except BaseException:
+            call.status = 'error'
+            raise
+        finally:
+            call.wall_ms = (time.monotonic() - call.started) * 1000
+            self.record(call)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        stats = []
+        for (endpoint, provider, model, kind), series in sorted(self.series.items()):
+            stats.append({
+                'endpoint': endpoint,
+                'provider': provider,
+                'model': model,
+                'kind': kind,
+                **series.counts,
+                'cost_usd': round(series.cost_usd, 6),
+                'latency_p50_ms': _percentile(series.wall_ms, 0.5),
+                'latency_p95_ms': _percentile(series.wall_ms, 0.95),
+                'ttft_p50_ms': _percentile(series.ttft_ms, 0.5),
+                'ttft_p95_ms': _percentile(series.ttft_ms, 0.95)
+            })
+        return stats
+
+    def prometheus(self) -> str:
+        """Counters and latency quantiles in the Prometheus text exposition format"""
+        lines = []
+        counters = (
+            ('llm_calls_total', 'calls'), ('llm_errors_total', 'errors'), ('llm_cache_hits_total', 'cache_hits'),
+            ('llm_prompt_tokens_total', 'prompt_tokens'), ('llm_completion_tokens_total', 'completion_tokens')
+        )
+        stats = self.get_stats()
+        for metric, field in counters:
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f"{metric}{{{_labels(row)}}} {row[field]}" for row in stats)
+        lines.append("# TYPE llm_cost_usd_total counter")
+        lines.extend(f"llm_cost_usd_total{{{_labels(row)}}} {row['cost_usd']}" for row in stats)
+        for metric, field in (('llm_latency_ms', 'latency'), ('llm_ttft_ms', 'ttft')):
+            lines.append(f"# TYPE {metric} summary")
+            for row in stats:
+                for quantile, suffix in (('0.5', 'p50'), ('0.95', 'p95')):
+                    value = row[f'{field}_{suffix}_ms']
+                    if value is not None:
+                        lines.append(f'{metric}{{{_labels(row)},quantile="{quantile}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        self.series.clear()
+
+
+def _labels(row: Dict[str, Any]) -> str:
+    return ','.join(f'{name}="{row[name]}"' for name in ('endpoint', 'provider', 'model', 'kind'))
+
+
+@contextmanager
+def endpoint_scope(endpoint: Union[str, Callable[[], str]]):
+    """
+    Attribute LLM calls made inside the block to endpoint and collect them for the request.
+    endpoint may be a callable, resolved only if an LLM call is actually made
+    """
+    endpoint_token = _endpoint.set(endpoint)
+    calls_token = _request_calls.set([])
+    try:
+        yield
+    finally:
+        _request_calls.reset(calls_token)
+        _endpoint.reset(endpoint_token)
+
+
+def current_endpoint() -> str:
+    endpoint = _endpoint.get()
+    return endpoint() if callable(endpoint) else endpoint
+
+
+def request_calls() -> List[LLMCall]:
+    """Calls recorded so far in the current request (empty outside a request)"""
+    return list(_request_calls.get() or [])
+
+
+def last_call() -> Optional[LLMCall]:
+    """Most recent call recorded in this task, e.g. to report tokens_used in a response"""
+    return _last_call.get()
+
+
+def debug_headers(calls: List[LLMCall]) -> Dict[str, str]:
+    """Per-request breakdown for X-LLM-* and Server-Timing response headers"""
+    if not calls:
+        return {'X-LLM-Calls': '0'}
+    wall_ms = sum(call.wall_ms for call in calls)
+    breakdown = ', '.join(
+        f"{call.kind};model={call.model};cache={call.cache};status={call.status};"
+        f"prompt={call.prompt_tokens};completion={call.completion_tokens};ms={call.wall_ms:.0f}"
+        + (f";ttft={call.ttft_ms:.0f}" if call.ttft_ms is not None else '')
+        for call in calls
+    )
+    return {
+        'X-LLM-Calls': str(len(calls)),
+        'X-LLM-Tokens': f"prompt={sum(c.prompt_tokens for c in calls)};completion={sum(c.completion_tokens for c in calls)}",
+        'X-LLM-Breakdown': breakdown,
+        'Server-Timing': f'llm;dur={wall_ms:.1f};desc="{len(calls)} LLM call(s)"'
+    }
+
+
+# Global instance
+llm_metrics = LLMMetrics()
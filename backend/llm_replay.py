@@ -0,0 +1,411 @@
+"""
+LLM Replay - Record real LLM responses to fixtures and replay them offline
+With LLM_REPLAY_MODE=record every LlmChat and OpenAI response is saved under the fixtures
+directory; with LLM_REPLAY_MODE=replay the same prompts are answered from those fixtures
+(or synthetic text) at a configurable time-to-first-token and token rate, so the chat,
+lab, file-analysis and protocol generation pipelines can be benchmarked without network access
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+OFF = 'off'
+RECORD = 'record'
+REPLAY = 'replay'
+
+DEFAULT_MODE = os.environ.get('LLM_REPLAY_MODE', OFF).lower() or OFF
+# Fixtures hold full answers to patient case and lab prompts, so they default to the
+# git-ignored build directory rather than the source tree
+DEFAULT_FIXTURES_DIR = Path(os.environ.get('LLM_REPLAY_FIXTURES', str(Path(__file__).parent / 'build' / 'llm_fixtures')))
+# Characters of the prompt saved with each fixture for debugging (0 = none; prompts carry patient data)
+DEFAULT_PROMPT_PREVIEW_CHARS = int(os.environ.get('LLM_REPLAY_PROMPT_PREVIEW', '0'))
+# Replay latency model: time to first token, then a steady generation rate, both +/- jitter
+DEFAULT_TTFT_MS = float(os.environ.get('LLM_REPLAY_TTFT_MS', '400'))
+DEFAULT_TOKENS_PER_SECOND = float(os.environ.get('LLM_REPLAY_TOKENS_PER_SECOND', '60'))
+DEFAULT_JITTER = float(os.environ.get('LLM_REPLAY_JITTER', '0.2'))
+# Prompts without a fixture get synthetic text of this many tokens ('error' mode raises instead)
+DEFAULT_ON_MISS = os.environ.get('LLM_REPLAY_ON_MISS', 'synthetic')
+DEFAULT_SYNTHETIC_TOKENS = int(os.environ.get('LLM_REPLAY_SYNTHETIC_TOKENS', '400'))
+
+_SYNTHETIC_WORDS = (
+    "peptide protocol dosing inflammation recovery insulin sensitivity mitochondrial support "
+    "gut barrier sleep quality cortisol thyroid markers monitoring weeks subcutaneous titrate "
+    "baseline labs follow-up contraindications functional root cause lifestyle nutrition"
+).split()
+
+
+class ReplayMiss(Exception):
+    """No fixture recorded for the prompt and synthetic answers are disabled"""
+
+
+class LatencyModel:
+    """Synthetic timing for replayed answers: ttft + tokens / rate, scaled by random jitter"""
+
+    def __init__(self,
+                 ttft_ms: float = DEFAULT_TTFT_MS,
+                 tokens_per_second: float = DEFAULT_TOKENS_PER_SECOND,
+                 jitter: float = DEFAULT_JITTER):
+        self.ttft_ms = ttft_ms
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+
+    def _scaled(self, seconds: float) -> float:
+        if self.jitter:
+            seconds *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(seconds, 0.0)
+
+    def first_token_delay(self) -> float:
+        return self._scaled(self.ttft_ms / 1000)
+
+    def generation_delay(self, tokens: int) -> float:
+        if not self.tokens_per_second:
+            return 0.0
+        return self._scaled(tokens / self.tokens_per_second)
+
+
+class FixtureStore:
+    """One JSON file per (provider, model, prompt), read once and kept in memory"""
+
+    def __init__(self, directory: Path = DEFAULT_FIXTURES_DIR):
+        self.directory = Path(directory)
+        self._loaded: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    @staticmethod
+    def key(provider: str, model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{provider}\0{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        if key not in self._loaded:
+            path = self._path(key)
+            self._loaded[key] = json.loads(path.read_text()) if path.exists() else None
+        return self._loaded[key]
+
+    def save(self, key: str, record: Dict[str, Any]):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(record, indent=2))
+        temporary.replace(path)
+        self._loaded[key] = record
+
+    def __len__(self) -> int:
+        return len(list(self.directory.glob('*.json'))) if self.directory.exists() else 0
+
+
+class LLMReplay:
+    """Provider-agnostic record/replay layer wrapped around the real LLM clients"""
+
+    def __init__(self,
+                 mode: str = DEFAULT_MODE,
+                 store: Optional[FixtureStore] = None,
+                 latency: Optional[LatencyModel] = None,
+                 on_miss: str = DEFAULT_ON_MISS,
+                 synthetic_tokens: int = DEFAULT_SYNTHETIC_TOKENS):
+        if mode not in (OFF, RECORD, REPLAY):
+            raise ValueError(f"Unknown LLM replay mode: {mode}")
+        self.mode = mode
+        self.store = store or FixtureStore()
+        self.latency = latency or LatencyModel()
+        self.on_miss = on_miss
+        self.synthetic_tokens = synthetic_tokens
+        self.metrics = {'recorded': 0, 'replayed': 0, 'synthetic': 0}
+        if mode != OFF:
+            logger.info(f"LLM replay mode '{mode}' using fixtures in {self.store.directory}")
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    # Recording and lookup
+
+    async def record(self, provider: str, model: str, prompt: str,
+                     live: Callable[[], Awaitable[Any]], text_of: Callable[[Any], str] = str,
+                     usage_of: Callable[[Any], Optional[Dict[str, int]]] = lambda response: None) -> Any:
+        """Make the real call and save its answer (and timing) as the prompt's fixture"""
+        started = time.monotonic()
+        response = await live()
+        fixture = {
+            'provider': provider,
+            'model': model,
+            'response': text_of(response),
+            'usage': usage_of(response),
+            'latency_ms': round((time.monotonic() - started) * 1000, 1),
+            'recorded_at': datetime.utcnow().isoformat()
+        }
+        if DEFAULT_PROMPT_PREVIEW_CHARS > 0:
+            fixture['prompt_preview'] = prompt[:DEFAULT_PROMPT_PREVIEW_CHARS]
+        self.store.save(FixtureStore.key(provider, model, prompt), fixture)
+        self.metrics['recorded'] += 1
+        return response
+
+    def lookup(self, provider: str, model: str, prompt: str) -> Dict[str, Any]:
+        """The recorded answer for the prompt, or deterministic synthetic text when none exists"""
+        key = FixtureStore.key(provider, model, prompt)
+        fixture = self.store.load(key)
+        if fixture is not None:
+            self.metrics['replayed'] += 1
+            return fixture
+        if self.on_miss == 'error':
+            raise ReplayMiss(f"No {provider}/{model} fixture for prompt {key[:12]}")
+        self.metrics['synthetic'] += 1
+        words = random.Random(key).choices(_SYNTHETIC_WORDS, k=self.synthetic_tokens)
+        return {'response': ' '.join(words), 'usage': None}
+
+    # Replayed answers at the modelled speed
+
+    async def complete(self, provider: str, model: str, prompt: str) -> Dict[str, Any]:
+        fixture = self.lookup(provider, model, prompt)
+        tokens = estimate_tokens(fixture['response'])
+        await asyncio.sleep(self.latency.first_token_delay() + self.latency.generation_delay(tokens))
+        return fixture
+
+    async def stream(self, provider: str, model: str, prompt: str, chunk_tokens: int = 8) -> AsyncIterator[str]:
+        fixture = self.lookup(provider, model, prompt)
+        words = fixture['response'].split(' ')
+        await asyncio.sleep(self.latency.first_token_delay())
+        for start in range(0, len(words), chunk_tokens):
+            chunk = ' '.join(words[start:start + chunk_tokens])
+            await asyncio.sleep(self.latency.generation_delay(estimate_tokens(chunk)))
+            yield chunk if start + chunk_tokens >= len(words) else chunk + ' '
+
+    # Client wrappers
+
+    def wrap_chat(self, client_factory: Callable[[], Any], provider: str, model: str) -> Any:
+        """LlmChat session for DrPeptideAI: the real client, a recording wrapper, or a replay stub"""
+        if self.mode == REPLAY:
+            return _ReplayChat(self, provider, model)
+        client = client_factory()
+        if self.mode == RECORD:
+            return _RecordingChat(self, client, provider, model)
+        return client
+
+    def wrap_openai(self, client_factory: Callable[[], Any]) -> Any:
+        """AsyncOpenAI-shaped client for the gateway (and so FileAnalysisService and the protocol parser)"""
+        if self.mode == REPLAY:
+            return _ReplayOpenAI(self)
+        client = client_factory()
+        if self.mode == RECORD:
+            return _RecordingOpenAI(self, client)
+        return client
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            'mode': self.mode,
+            'fixtures': len(self.store),
+            'fixtures_dir': str(self.store.directory),
+            'ttft_ms': self.latency.ttft_ms,
+            'tokens_per_second': self.latency.tokens_per_second
+        }
+
+
+class _RecordingChat:
+    def __init__(self, replay: LLMReplay, client: Any, provider: str, model: str):
+        self._replay = replay
+        self._client = client
+        self._provider = provider
+        self._model = model
+
+    async def send_message(self, message: Any) -> str:
+        return await self._replay.record(self._provider, self._model, message.text,
+                                         lambda: self._client.send_message(message))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+class _ReplayChat:
+    def __init__(self, replay: LLMReplay, provider: str, model: str):
+        self._replay = replay
+        self._provider = provider
+        self._model = model
+
+    async def send_message(self, message: Any) -> str:
+        fixture = await self._replay.complete(self._provider, self._model, message.text)
+        return fixture['response']
+
+    def stream_message(self, message: Any) -> AsyncIterator[str]:
+        return self._replay.stream(self._provider, self._model, message.text)
+
+
+def _chat_prompt(request: Dict[str, Any]) -> str:
+    return '\n'.join(f"{message.get('role')}: {message.get('content', '')}" for message in request.get('messages', []))
+
+
+def _completion_text(response: Any) -> str:
+    return response.choices[0].message.content or ''
+
+
+def _completion_usage(response: Any) -> Optional[Dict[str, int]]:
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return None
+    return {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens}
+
+
+def _completion_response(text: str, usage: Optional[Dict[str, int]], prompt: str) -> Any:
+    """Minimal ChatCompletion shape: choices[0].message.content and usage"""
+    if usage is None:
+        usage = {'prompt_tokens': estimate_tokens(prompt), 'completion_tokens': estimate_tokens(text)}
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(role='assistant', content=text), finish_reason='stop')],
+        usage=SimpleNamespace(total_tokens=usage['prompt_tokens'] + usage['completion_tokens'], **usage)
+    )
+
+
+class _Completions:
+    def __init__(self, create: Callable[..., Awaitable[Any]]):
+        self.create = create
+
+
+class _RecordingOpenAI:
+    def __init__(self, replay: LLMReplay, client: Any):
+        self._replay = replay
+        self._client = client
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    async def _create(self, **request) -> Any:
+        return await self._replay.record('openai', request.get('model', 'unknown'), _chat_prompt(request),
+                                         lambda: self._client.chat.completions.create(**request),
+                                         _completion_text, _completion_usage)
+
+
+class _ReplayOpenAI:
+    def __init__(self, replay: LLMReplay):
+        self._replay = replay
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    async def _create(self, **request) -> Any:
+        prompt = _chat_prompt(request)
+        fixture = await self._replay.complete('openai', request.get('model', 'unknown'), prompt)
+        return _completion_response(fixture['response'], fixture.get('usage'), prompt)
+
+
+# Global instance
+llm_replay = LLMReplay()
+
+
+# Offline benchmark
+
+SAMPLE_PATIENT = {
+    "patient_name": "Benchmark Patient",
+    "age": 46,
+    "gender": "female",
+    "weight": 168.0,
+    "height_feet": 5,
+    "height_inches": 6,
+    "primary_concerns": ["chronic fatigue", "joint pain", "poor sleep"],
+    "health_goals": ["more energy", "faster recovery", "weight loss"],
+    "current_medications": ["metformin", "sertraline"],
+    "medical_history": ["prediabetes"],
+    "allergies": [],
+    "lifestyle_factors": {"exercise": "2x per week", "sleep_hours": 6}
+}
+
+SAMPLE_LABS = {"glucose": 104, "hba1c": 5.9, "crp": 3.2, "vitamin_d": 24, "tsh": 2.8}
+
+SAMPLE_CHAT = [
+    "What peptides help with joint recovery after injury?",
+    "Is BPC-157 safe to combine with metformin?",
+    "How should I titrate semaglutide for a prediabetic patient?",
+    "What labs should I monitor during a CJC-1295 / Ipamorelin protocol?"
+]
+
+
+def _flows() -> Dict[str, Callable[[int], Awaitable[Any]]]:
+    """Pipeline entry points, imported only when benchmarked"""
+
+    async def chat(index: int):
+        from server import dr_peptide_ai
+        return await dr_peptide_ai.chat_with_dr_peptide(SAMPLE_CHAT[index % len(SAMPLE_CHAT)], [])
+
+    async def lab(index: int):
+        from server import dr_peptide_ai
+        return await dr_peptide_ai.interpret_lab_results(SAMPLE_LABS, SAMPLE_PATIENT)
+
+    async def file(index: int):
+        from server import file_analysis_service
+        content = '\n'.join(f"{name}: {value}" for name, value in SAMPLE_LABS.items()).encode()
+        return await file_analysis_service.analyze_uploaded_file(content, f"labs_{index}.txt", 'text/plain')
+
+    async def protocol(index: int):
+        from server import PatientAssessment, generate_functional_medicine_protocol
+        return await generate_functional_medicine_protocol(PatientAssessment(**SAMPLE_PATIENT))
+
+    return {'chat': chat, 'lab': lab, 'file': file, 'protocol': protocol}
+
+
+async def benchmark(flow: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    """Run a pipeline flow requests times with the given concurrency; report latency and LLM usage"""
+    from llm_metrics import llm_metrics
+
+    run = _flows()[flow]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async def one(index: int):
+        nonlocal failures
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                await run(index)
+            except Exception as e:
+                failures += 1
+                logger.error(f"Benchmark {flow} request {index} failed: {e}")
+            latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        'flow': flow,
+        'requests': requests,
+        'concurrency': concurrency,
+        'failures': failures,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 2) if elapsed else None,
+        'latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+        'latency_p95_ms': round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000, 1),
+        'replay': llm_replay.get_stats(),
+        'llm': llm_metrics.get_stats()
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # LLM_REPLAY_MODE=replay python llm_replay.py bench protocol --requests 50 --concurrency 10
+    parser = argparse.ArgumentParser(description="Offline LLM pipeline benchmark")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    bench = subcommands.add_parser('bench')
+    bench.add_argument('flow', choices=sorted(_flows()))
+    bench.add_argument('--requests', type=int, default=20)
+    bench.add_argument('--concurrency', type=int, default=5)
+    bench.add_argument('--no-cache', action='store_true', help="disable the Dr. Peptide response cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if llm_replay.mode == OFF:
+        print("LLM_REPLAY_MODE is off: the benchmark will call the real providers")
+    if args.no_cache:
+        from llm_cache import llm_response_cache
+        llm_response_cache.max_entries = 0
+    print(json.dumps(asyncio.run(benchmark(args.flow, args.requests, args.concurrency)), indent=2))
@@ -0,0 +1,109 @@
+"""
+LLM Session Pool - One LLM chat session per conversation instead of a process-wide shared one
+Sessions are created on demand, evicted when idle or when the pool is full, and calls are
+admitted per provider so concurrent conversations do not overrun provider rate limits
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Callable, Optional
+
+from request_coalescing import AdmissionController, llm_admission
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SESSIONS = int(os.environ.get('LLM_SESSION_POOL_SIZE', '256'))
+DEFAULT_IDLE_TIMEOUT = int(os.environ.get('LLM_SESSION_IDLE_SECONDS', '1800'))
+
+
+class _PooledSession:
+    def __init__(self, client: Any):
+        self.client = client
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class LLMSessionPool:
+    """
+    Bounded pool of chat sessions keyed by conversation id. Calls within one conversation
+    are serialized (a session's history must stay ordered); different conversations run
+    in parallel up to the provider's concurrency cap (enforced by the admission controller)
+    """
+
+    def __init__(self,
+                 session_factory: Callable[[str], Any],
+                 provider: str = 'default',
+                 max_sessions: int = DEFAULT_MAX_SESSIONS,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 admission: Optional[AdmissionController] = None,
+                 conversation_factory: Optional[Callable[[str], Any]] = None):
+        self.session_factory = session_factory
+        # Pooled sessions outlive one call, so they may carry more setup (e.g. the full system prompt)
+        self.conversation_factory = conversation_factory or session_factory
+        self.provider = provider
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.admission = admission or llm_admission
+        self._sessions: 'OrderedDict[str, _PooledSession]' = OrderedDict()
+        self.metrics = {'created': 0, 'reused': 0, 'evicted_idle': 0, 'evicted_capacity': 0, 'ephemeral': 0}
+
+    def _checkout(self, conversation_id: Optional[str]) -> _PooledSession:
+        if not conversation_id:
+            # One-shot calls (case analysis, lab interpretation, ...) get a throwaway session
+            self.metrics['ephemeral'] += 1
+            return _PooledSession(self.session_factory(f"dr_peptide_{uuid.uuid4()}"))
+
+        self.evict_idle()
+        pooled = self._sessions.get(conversation_id)
+        if pooled is not None:
+            self._sessions.move_to_end(conversation_id)
+            self.metrics['reused'] += 1
+        else:
+            pooled = self._sessions[conversation_id] = _PooledSession(self.conversation_factory(conversation_id))
+            self.metrics['created'] += 1
+            while len(self._sessions) > self.max_sessions:
+                oldest = next(iter(self._sessions.values()))
+                if oldest.lock.locked():
+                    # Never drop a session mid-call; allow a temporary overshoot instead
+                    break
+                self._sessions.popitem(last=False)
+                self.metrics['evicted_capacity'] += 1
+        pooled.last_used = time.monotonic()
+        return pooled
+
+    @asynccontextmanager
+    async def session(self, conversation_id: Optional[str] = None, provider: Optional[str] = None):
+        """Borrow the conversation's session for one call"""
+        pooled = self._checkout(conversation_id)
+        # Queue on the conversation first so waiting calls do not hold a provider slot
+        async with pooled.lock:
+            async with self.admission.slot(provider or self.provider):
+                try:
+                    yield pooled.client
+                finally:
+                    pooled.last_used = time.monotonic()
+
+    def has_session(self, conversation_id: Optional[str]) -> bool:
+        """Whether the conversation's session (and the history it holds) is still pooled"""
+        self.evict_idle()
+        return bool(conversation_id) and conversation_id in self._sessions
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [cid for cid, pooled in self._sessions.items() if pooled.last_used < cutoff and not pooled.lock.locked()]
+        for conversation_id in idle:
+            del self._sessions[conversation_id]
+        self.metrics['evicted_idle'] += len(idle)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            'active_sessions': len(self._sessions),
+            'max_sessions': self.max_sessions,
+            'concurrency_limit': self.admission.limit_for(self.provider)
+        }
@@ -0,0 +1,219 @@
+"""
+Local Answer Engine - Catalog-backed answers for common Dr. Peptide questions
+Questions about one named protocol's dosing, side effects, storage, contraindications,
+timelines, cost or monitoring are classified with one Aho-Corasick pass and answered from the
+protocol's structured fields in milliseconds; only bare question templates qualify, anything
+open-ended or patient-specific is left to the LLM
+"""
+
+import logging
+import os
+import re
+from collections import Counter
+from typing import List, Dict, Any, Iterable, Optional, Set, Tuple
+
+from text_matcher import AhoCorasickMatcher
+
+logger = logging.getLogger(__name__)
+
+LOCAL_ANSWERS_ENABLED = os.environ.get('LOCAL_ANSWERS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Longer messages are treated as open-ended
+MAX_LOCAL_QUESTION_WORDS = 25
+MAX_INTENTS = 2
+
+# Cue phrases per intent; they also match inflections ("stored", "doses") except the short ones
+INTENT_CUES = {
+    'dosing': ['dose', 'dosage', 'dosing', 'how much', 'how often', 'frequency', 'mcg', 'mg'],
+    'side_effects': ['side effect', 'adverse', 'safe', 'safety', 'risks'],
+    'storage': ['store', 'storage', 'refrigerat', 'reconstitut', 'shelf life', 'expire'],
+    'contraindications': ['contraindicat', 'who should not', "who shouldn't", 'who should avoid', 'precaution'],
+    'interactions': ['interaction', 'interact'],
+    'timeline': ['how long', 'how soon', 'how quickly', 'timeline', 'take to work', 'start working', 'results'],
+    'mechanism': ['mechanism', 'how does it work', 'how it works', 'works', 'mode of action'],
+    'administration': ['inject', 'injection site', 'administer', 'administration', 'how to take', 'how do i take', 'route'],
+    'cost': ['cost', 'price', 'expensive', 'insurance'],
+    'monitoring': ['monitor', 'labs', 'lab tests', 'bloodwork', 'blood work', 'blood test'],
+    'indications': ['used for', 'use for', 'indication', 'benefits', 'good for'],
+    'overview': ['what is', "what's", 'tell me about', 'overview']
+}
+
+# Everything a templated question may contain besides the protocol name and its intent cues;
+# any other word (a population, condition, medication, number) makes the question patient-specific
+TEMPLATE_WORDS = {
+    'what', 'whats', "what's", 'is', 'are', 'the', 'a', 'an', 'of', 'for', 'on', 'about', 'does', 'do',
+    'how', 'to', 'it', 'its', "it's", 'be', 'should', 'typical', 'usual', 'standard', 'recommended',
+    'normal', 'main', 'common', 'any', 'there', 'tell', 'me', 'please', 'can', 'you', 'and', 'or', 'take'
+}
+
+# (heading, path into the protocol) per intent; intents with no data fall through to the LLM
+INTENT_SECTIONS: Dict[str, List[Tuple[str, Tuple[str, ...]]]] = {
+    'dosing': [('Dosing', ('complete_dosing_schedule',)), ('Timing', ('administration_techniques', 'timing'))],
+    'side_effects': [('Common side effects', ('safety_profile', 'common_side_effects')),
+                     ('Rare side effects', ('safety_profile', 'rare_side_effects')),
+                     ('Serious side effects', ('safety_profile', 'serious_side_effects'))],
+    'storage': [('Storage', ('administration_techniques', 'storage')),
+                ('Preparation', ('administration_techniques', 'preparation'))],
+    'contraindications': [('Contraindications and precautions', ('contraindications_and_precautions',))],
+    'interactions': [('Drug interactions', ('safety_profile', 'drug_interactions'))],
+    'timeline': [('Expected timeline', ('expected_timelines',))],
+    'mechanism': [('Mechanism of action', ('mechanism_of_action',))],
+    'administration': [('Administration', ('administration_techniques',))],
+    'cost': [('Cost', ('cost_considerations',)), ('Cost', ('cost_analysis',))],
+    'monitoring': [('Monitoring', ('monitoring_requirements',))],
+    'indications': [('Clinical indications', ('clinical_indications',))],
+    'overview': [('Overview', ('description',)), ('Category', ('category',)),
+                 ('Clinical indications', ('clinical_indications',))]
+}
+
+DISCLAIMER = "_From the PeptideProtocols.ai clinical database. Individual protocols should be set by a qualified healthcare provider._"
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def _label(key: str) -> str:
+    return key.replace('_', ' ').capitalize()
+
+
+def _inline(item: Any) -> str:
+    """One list entry on one line: {'effect': 'Nausea', 'frequency': '20%'} -> 'Nausea (20%)'"""
+    if isinstance(item, dict):
+        values = [str(value) for value in item.values() if value not in (None, '') and not isinstance(value, (dict, list))]
+        if not values:
+            return ''
+        return values[0] + (f" ({', '.join(values[1:])})" if len(values) > 1 else '')
+    if isinstance(item, list):
+        return ', '.join(str(value) for value in item)
+    return str(item)
+
+
+def _render(value: Any, indent: str = '') -> List[str]:
+    """Markdown lines for a catalog field (strings, lists and nested dicts of either)"""
+    if isinstance(value, dict):
+        lines = []
+        for key, item in value.items():
+            if isinstance(item, (dict, list)):
+                nested = _render(item, indent + '  ')
+                if nested:
+                    lines.append(f"{indent}- **{_label(key)}:**")
+                    lines.extend(nested)
+            elif item not in (None, ''):
+                lines.append(f"{indent}- **{_label(key)}:** {item}")
+        return lines
+    if isinstance(value, list):
+        entries = [_inline(item) for item in value]
+        return [f"{indent}- {entry}" for entry in entries if entry]
+    return [f"{indent}{value}"] if value not in (None, '') else []
+
+
+def _lookup(protocol: Dict[str, Any], path: Tuple[str, ...]) -> Any:
+    value: Any = protocol
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+class LocalAnswerEngine:
+    """Intent classifier plus templated answers over the enhanced protocol catalog"""
+
+    def __init__(self, protocols: List[Dict[str, Any]], enabled: bool = LOCAL_ANSWERS_ENABLED):
+        self.protocols = protocols
+        self.enabled = enabled
+        self.matcher = self._build_matcher(protocols)
+        self.metrics = {'answered': 0, 'deferred': 0}
+        self.intent_counts: Counter = Counter()
+
+    @staticmethod
+    def _build_matcher(protocols: List[Dict[str, Any]]) -> AhoCorasickMatcher:
+        matcher = AhoCorasickMatcher()
+        for ordinal, protocol in enumerate(protocols):
+            for name in [protocol['name']] + list(protocol.get('aliases', [])):
+                # "BPC-157", "BPC 157" and "BPC157" all name the same protocol
+                matcher.add_all({name, name.replace('-', ' '), name.replace('-', '')}, ('protocol', ordinal))
+        for intent, cues in INTENT_CUES.items():
+            for cue in cues:
+                matcher.add(cue, ('intent', (intent, cue)), whole_word=len(cue) <= 3)
+        return matcher.build()
+
+    def classify(self, message: str) -> Optional[Tuple[int, List[str]]]:
+        """(protocol ordinal, intents) when the question is a catalog lookup about exactly one protocol"""
+        if len(message.split()) > MAX_LOCAL_QUESTION_WORDS:
+            return None
+        text = message.lower()
+        protocol_spans: List[Tuple[int, int, int]] = []
+        intent_cues: Dict[str, Set[str]] = {}
+        covered = [False] * len(text)
+        for start, end, (kind, value) in self.matcher.finditer(text):
+            if kind == 'protocol':
+                protocol_spans.append((start, end, value))
+            else:
+                intent_cues.setdefault(value[0], set()).add(value[1])
+            # Prefix cues cover the whole word they start ("stored" for "store")
+            while end < len(text) and text[end].isalnum():
+                end += 1
+            covered[start:end] = [True] * (end - start)
+        # "how much does it cost" asks about price, not dose
+        if 'cost' in intent_cues and intent_cues.get('dosing') == {'how much'}:
+            del intent_cues['dosing']
+        intents = list(intent_cues)
+
+        # Keep the longest names: "BPC-157 Capsules" rather than the "BPC-157" inside it
+        spans = [span for span in protocol_spans
+                 if not any(other[0] <= span[0] and span[1] <= other[1] and other[1] - other[0] > span[1] - span[0]
+                            for other in protocol_spans)]
+        if len({ordinal for _, _, ordinal in spans}) != 1:
+            return None
+
+        # Only a bare template ("what is the dose of X") is a catalog lookup; "for a child",
+        # "on warfarin" or a weight make it patient-specific
+        remainder = ''.join(' ' if covered[index] else char for index, char in enumerate(text))
+        if any(word not in TEMPLATE_WORDS for word in _WORD.findall(remainder)):
+            return None
+
+        specific = [intent for intent in intents if intent != 'overview']
+        intents = specific or intents
+        if not intents or len(intents) > MAX_INTENTS:
+            return None
+        return spans[0][2], intents
+
+    def answer(self, message: str) -> Optional[Dict[str, Any]]:
+        """{'protocol', 'intents', 'text'} for a catalog-answerable question, otherwise None (ask the LLM)"""
+        if not self.enabled or not message:
+            return None
+        classified = self.classify(message)
+        text = self.render(*classified) if classified else None
+        if text is None:
+            self.metrics['deferred'] += 1
+            return None
+        ordinal, intents = classified
+        self.metrics['answered'] += 1
+        self.intent_counts.update(intents)
+        return {'protocol': self.protocols[ordinal], 'intents': intents, 'text': text}
+
+    def render(self, ordinal: int, intents: Iterable[str]) -> Optional[str]:
+        protocol = self.protocols[ordinal]
+        blocks = []
+        for intent in intents:
+            lines = []
+            for heading, path in INTENT_SECTIONS[intent]:
+                rendered = _render(_lookup(protocol, path))
+                if rendered:
+                    if lines:
+                        lines.append('')
+                    lines.append(f"**{heading}**")
+                    lines.extend(rendered)
+            if not lines:
+                # Catalog has nothing for this part of the question
+                return None
+            blocks.append('\n'.join(lines))
+        return f"### {protocol['name']}\n\n" + '\n\n'.join(blocks) + f"\n\n{DISCLAIMER}"
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.metrics['answered'] + self.metrics['deferred']
+        return {
+            **self.metrics,
+            'enabled': self.enabled,
+            'local_rate': round(self.metrics['answered'] / total, 3) if total else 0.0,
+            'intents': dict(self.intent_counts)
+        }
@@ -4,66 +4,75 @@ Handles all protocol data, search, filtering, PDF generation, and analytics
 """
 
 import json
-from datetime import datetime
-from typing import List, Dict, Any, Optional
-import uuid
+from typing import List, Dict, Any, Optional, Tuple
 
-# Import all existing protocol batches
-from enhanced_clinical_database import ENHANCED_CLINICAL_PEPTIDES
-from complete_enhanced_protocols_batch2 import COMPLETE_PROTOCOLS_BATCH2
-from accelerated_batch3_protocols import ACCELERATED_BATCH3_PROTOCOLS
-from final_completion_batch4 import FINAL_COMPLETION_BATCH4
-from critical_missing_peptides_batch5 import CRITICAL_MISSING_PEPTIDES_BATCH5
-from essential_peptide_blends_batch6 import ESSENTIAL_PEPTIDE_BLENDS_BATCH6
-from advanced_weight_management_batch7 import ADVANCED_WEIGHT_MANAGEMENT_BATCH7
-from capsule_protocols_batch8 import CAPSULE_PROTOCOLS_BATCH8
+# Protocol batches come precompiled from the catalog artifact when one is available
+from catalog_artifact import catalog_sources, load_artifact, source_updated_at
+from catalog_index import CatalogIndex, FieldProjection
+from catalog_snapshot import CatalogSnapshotStore, identity_key, protocol_id_for, fingerprint
+from protocol_search_index import (
+    ProtocolSearchIndex, FuzzyTermIndex, PrefixSuggestIndex, FacetBitmaps,
+    bitmap_from_ordinals, iter_bitmap, popcount
+)
 
 class MasterProtocolManager:
-    def __init__(self):
+    def __init__(self, sources: Optional[List[List[Dict[str, Any]]]] = None,
+                 precompiled: Optional[Dict[str, Any]] = None):
+        self.snapshot_store = CatalogSnapshotStore()
+        if precompiled:
+            # Compiled protocols and indexes restored from the build-time artifact
+            self.__dict__.update(precompiled)
+            print(f"✓ Loaded {len(self.all_protocols)} precompiled protocols (catalog version {self.catalog_version})")
+            return
+            
         self.all_protocols = []
         self.categories = set()
         self.tags = set()
-        self._compile_all_protocols()
+        self._compile_all_protocols(sources or catalog_sources()['protocol_batches'])
+        self._apply_catalog_snapshot()
         self._generate_search_indices()
         
-    def _compile_all_protocols(self):
+    @classmethod
+    def load(cls) -> 'MasterProtocolManager':
+        """Restore from the catalog artifact if it is current, otherwise compile from source"""
+        artifact = load_artifact()
+        if artifact:
+            return cls(precompiled=artifact['master_state'])
+        return cls()
+        
+    def export_state(self) -> Dict[str, Any]:
+        """Compiled protocols and indexes, for the catalog artifact"""
+        return {key: value for key, value in self.__dict__.items() if key != 'snapshot_store'}
+        
+    def _compile_all_protocols(self, all_batches: List[List[Dict[str, Any]]]):
         """Compile all protocols from various batches into unified format"""
-        all_batches = [
-            ENHANCED_CLINICAL_PEPTIDES,
-            COMPLETE_PROTOCOLS_BATCH2,
-            ACCELERATED_BATCH3_PROTOCOLS,
-            FINAL_COMPLETION_BATCH4,
-            CRITICAL_MISSING_PEPTIDES_BATCH5,
-            ESSENTIAL_PEPTIDE_BLENDS_BATCH6,
-            ADVANCED_WEIGHT_MANAGEMENT_BATCH7,
-            CAPSULE_PROTOCOLS_BATCH8
-        ]
+        # The same protocol repeats across batches; count repeats so each gets its own stable ID
+        occurrences = {}
         
         for batch in all_batches:
             for protocol in batch:
-                enhanced_protocol = self._enhance_protocol(protocol)
+                identity = identity_key(protocol)
+                occurrence = occurrences.get(identity, 0)
+                occurrences[identity] = occurrence + 1
+                
+                enhanced_protocol = self._enhance_protocol(protocol, protocol_id_for(identity, occurrence))
                 self.all_protocols.append(enhanced_protocol)
                 
-                # Extract categories and tags
+                # Extract categories and tags (tags may be generated during enhancement)
                 if 'category' in protocol:
                     self.categories.add(protocol['category'])
-                if 'tags' in protocol:
-                    self.tags.update(protocol['tags'])
+                self.tags.update(enhanced_protocol.get('tags', []))
                     
         print(f"✓ Compiled {len(self.all_protocols)} protocols across {len(self.categories)} categories")
         
-    def _enhance_protocol(self, protocol: Dict[str, Any]) -> Dict[str, Any]:
+    def _enhance_protocol(self, protocol: Dict[str, Any], protocol_id: str) -> Dict[str, Any]:
         """Enhance protocol with additional metadata and standardized fields"""
         enhanced = protocol.copy()
         
-        # Add unique ID if missing
+        # Add deterministic ID (name and category of the source protocol) if missing
         if 'id' not in enhanced:
-            enhanced['id'] = str(uuid.uuid4())
+            enhanced['id'] = protocol_id
             
-        # Add timestamps
-        enhanced['last_updated'] = datetime.utcnow().isoformat()
-        enhanced['created_at'] = datetime.utcnow().isoformat()
-        
         # Standardize tags
         if 'tags' not in enhanced:
             enhanced['tags'] = self._generate_tags(enhanced)
@@ -110,7 +119,7 @@ class MasterProtocolManager:
             if 'joint' in indication_lower or 'arthritis' in indication_lower:
                 tags.append('joint-health')
                 
-        return list(set(tags))
+        return sorted(set(tags))
         
     def _generate_search_keywords(self, protocol: Dict[str, Any]) -> List[str]:
         """Generate comprehensive search keywords"""
@@ -135,10 +144,30 @@ class MasterProtocolManager:
         keywords.append(protocol.get('category', '').lower())
         keywords.extend(protocol.get('tags', []))
         
-        return list(set([kw for kw in keywords if len(kw) > 2]))
+        return sorted(set([kw for kw in keywords if len(kw) > 2]))
+        
+    def _apply_catalog_snapshot(self):
+        """Stamp timestamps from the versioned catalog snapshot instead of the process start time"""
+        self.protocol_fingerprints = {protocol['id']: fingerprint(protocol) for protocol in self.all_protocols}
+        names = {protocol['id']: protocol.get('name', '') for protocol in self.all_protocols}
+            
+        snapshot = self.snapshot_store.resolve(self.protocol_fingerprints, names, source_updated_at())
+        self.catalog_version = snapshot['version']
+        self.catalog_digest = snapshot['digest']
+        self.catalog_updated_at = snapshot['created_at']
+        
+        for protocol in self.all_protocols:
+            entry = snapshot['protocols'].get(protocol['id'], {})
+            protocol['created_at'] = entry.get('created_at', snapshot['created_at'])
+            protocol['last_updated'] = entry.get('last_updated', snapshot['created_at'])
+            
+        print(f"✓ Catalog version {self.catalog_version}")
         
     def _generate_search_indices(self):
         """Generate search indices for fast lookup"""
+        # Constant-time id / name / alias / category lookups
+        self.catalog_index = CatalogIndex(self.all_protocols)
+        
         self.name_index = {}
         self.keyword_index = {}
         self.category_index = {}
@@ -160,69 +189,173 @@ class MasterProtocolManager:
             if category not in self.category_index:
                 self.category_index[category] = []
             self.category_index[category].append(protocol_id)
+                
+        # Ranked full-text index (postings keyed by position in all_protocols)
+        self.search_index = ProtocolSearchIndex()
+        self.search_index.build(self.all_protocols)
+        
+        # Typo-tolerant index over names, aliases and keywords
+        self.fuzzy_index = FuzzyTermIndex()
+        for ordinal, protocol in enumerate(self.all_protocols):
+            self.fuzzy_index.add(ordinal, protocol['name'], weight=1.0)
+            for alias in protocol.get('aliases', []):
+                self.fuzzy_index.add(ordinal, alias, weight=0.9)
+            for keyword in protocol.get('search_keywords', []):
+                self.fuzzy_index.add(ordinal, keyword, weight=0.6)
+                
+        # Typeahead over names, aliases, categories and tags
+        self.suggest_index = PrefixSuggestIndex()
+        self.suggest_index.build(self.all_protocols, {
+            'categories': self.categories,
+            'tags': self.tags
+        })
+        
+        # Category/tag bitmaps for filter intersection and facet counts
+        self.facet_bitmaps = FacetBitmaps()
+        self.facet_bitmaps.build(self.all_protocols, ['category', 'tags'])
+        
+        # Column views for sparse fieldsets (?fields=)
+        self.field_views = FieldProjection(self.all_protocols)
             
     def search_protocols(self, 
                         query: Optional[str] = None,
                         category: Optional[str] = None,
                         tags: Optional[List[str]] = None,
                         limit: int = 50) -> List[Dict[str, Any]]:
-        """Advanced protocol search with filters"""
+        """Advanced protocol search with filters, ranked by BM25 over the inverted index"""
+        return self.search(query=query, category=category, tags=tags, limit=limit)['protocols']
         
-        results = self.all_protocols.copy()
+    def search(self,
+               query: Optional[str] = None,
+               category: Optional[str] = None,
+               tags: Optional[List[str]] = None,
+               limit: int = 50,
+               fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        """Ranked search plus live category/tag facet counts; fields projects each result"""
+        facets = self.facet_bitmaps
+        category_filter = facets.match_any('category', [category] if category and category != 'all' else None)
+        tag_filter = facets.match_any('tags', tags)
         
         # Text search
+        scores = None
+        query_matches = facets.universe
+        query = query.strip() if query else ''
         if query:
-            query = query.lower().strip()
-            filtered_results = []
+            scores = self.search_index.score(query)
+            if not scores:
+                # No exact or prefix hits: fall back to typo-tolerant matching
+                scores = self.fuzzy_search(query)
+            query_matches = bitmap_from_ordinals(scores)
             
-            for protocol in results:
-                score = 0
+        matches = query_matches & category_filter & tag_filter
+        
+        if scores is not None:
+            ranked = self.search_index.top_k(scores, limit, (o for o in scores if matches >> o & 1))
+            protocols = [
+                {**self._document(ordinal, fields), 'search_score': round(score, 2)}
+                for ordinal, score in ranked
+            ]
+        else:
+            protocols = []
+            for ordinal in iter_bitmap(matches):
+                if len(protocols) >= limit:
+                    break
+                protocols.append(self._document(ordinal, fields))
                 
-                # Exact name match (highest score)
-                if query in protocol['name'].lower():
-                    score += 100
-                    
-                # Alias match
-                for alias in protocol.get('aliases', []):
-                    if query in alias.lower():
-                        score += 80
-                        
-                # Keyword match
-                for keyword in protocol['search_keywords']:
-                    if query in keyword:
-                        score += 50
-                        
-                # Clinical indication match
-                for indication in protocol.get('clinical_indications', []):
-                    if query in indication.lower():
-                        score += 70
-                        
-                # Mechanism match
-                if query in protocol.get('mechanism_of_action', '').lower():
-                    score += 40
-                    
-                if score > 0:
-                    protocol['search_score'] = score
-                    filtered_results.append(protocol)
-                    
-            results = sorted(filtered_results, key=lambda x: x['search_score'], reverse=True)
-            
-        # Category filter
-        if category and category != 'all':
-            results = [p for p in results if p.get('category') == category]
-            
-        # Tags filter
-        if tags:
-            results = [p for p in results if any(tag in p.get('tags', []) for tag in tags)]
-            
-        return results[:limit]
+        # Each facet is counted with the other facet's filter applied, so selecting
+        # a category still shows how the query spreads across the other categories
+        return {
+            'protocols': protocols,
+            'total_matches': popcount(matches),
+            'facet_counts': {
+                'categories': facets.counts('category', query_matches & tag_filter),
+                'tags': facets.counts('tags', query_matches & category_filter)
+            }
+        }
+        
+    def _document(self, ordinal: int, fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        """Full protocol document, or only the given fields"""
+        if fields is None:
+            return self.all_protocols[ordinal]
+        return self.field_views.row(ordinal, fields)
+        
+    def page(self, offset: int, limit: int, fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+        """A slice of the library in catalog order, optionally projected"""
+        ordinals = range(len(self.all_protocols))[offset:offset + limit]
+        return [self._document(ordinal, fields) for ordinal in ordinals]
+        
+    def suggest(self, prefix: str, limit: int = 8) -> Dict[str, Any]:
+        """Typeahead suggestions: lightweight protocol entries plus matching categories and tags"""
+        protocols = []
+        seen = set()
+        for ordinal in self.suggest_index.suggest_protocols(prefix, limit=limit * 2):
+            protocol = self.all_protocols[ordinal]
+            # Batches repeat some protocols under the same name; show each once
+            key = (protocol['name'], protocol.get('category', ''))
+            if key in seen:
+                continue
+            seen.add(key)
+            protocols.append({
+                'id': protocol['id'],
+                'name': protocol['name'],
+                'category': protocol.get('category', '')
+            })
+            if len(protocols) >= limit:
+                break
+                
+        return {
+            'protocols': protocols,
+            'categories': self.suggest_index.suggest_labels('categories', prefix),
+            'tags': self.suggest_index.suggest_labels('tags', prefix)
+        }
+        
+    def fuzzy_search(self, query: str, limit: int = 50) -> Dict[int, float]:
+        """Scores for misspelled queries ("semaglutid", "ipamorlin"), on the same 0-100 scale as name matches"""
+        return {
+            ordinal: similarity * 100
+            for ordinal, similarity, _ in self.fuzzy_index.lookup(query, limit=limit)
+        }
         
     def get_protocol_by_id(self, protocol_id: str) -> Optional[Dict[str, Any]]:
         """Get single protocol by ID"""
-        for protocol in self.all_protocols:
-            if protocol['id'] == protocol_id:
-                return protocol
-        return None
+        return self.catalog_index.get_by_id(protocol_id)
+        
+    def get_protocol_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Get single protocol by canonical name or alias (case-insensitive)"""
+        return self.catalog_index.get_by_name(name)
+        
+    def changes_since(self, since_version: str, fields: Optional[Tuple[str, ...]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Protocols added, changed and removed since a client's catalog version token, by comparing
+        content fingerprints against that version's snapshot. '' or '0' means an empty client.
+        None when this host has no snapshot for the token and the client has to resync in full.
+        """
+        if since_version == self.catalog_version:
+            previous = self.protocol_fingerprints
+        elif since_version in ('', '0'):
+            previous = {}
+        else:
+            snapshot = self.snapshot_store.load(since_version)
+            if not snapshot:
+                return None
+            previous = {protocol_id: entry.get('fingerprint') for protocol_id, entry in snapshot['protocols'].items()}
+            
+        added, changed = [], []
+        for ordinal, protocol in enumerate(self.all_protocols):
+            prior = previous.get(protocol['id'])
+            if prior is None:
+                added.append(self._document(ordinal, fields))
+            elif prior != self.protocol_fingerprints[protocol['id']]:
+                changed.append(self._document(ordinal, fields))
+        removed = sorted(set(previous) - set(self.protocol_fingerprints))
+        
+        return {
+            'from_version': since_version,
+            'to_version': self.catalog_version,
+            'added': added,
+            'changed': changed,
+            'removed': removed
+        }
         
     def get_categories(self) -> List[str]:
         """Get all available categories"""
@@ -240,7 +373,8 @@ class MasterProtocolManager:
             'tags': len(self.tags),
             'most_popular_category': self._get_most_popular_category(),
             'average_rating': self._get_average_rating(),
-            'last_updated': datetime.utcnow().isoformat()
+            'catalog_version': self.catalog_version,
+            'last_updated': self.catalog_updated_at
         }
         
     def _get_most_popular_category(self) -> str:
@@ -257,4 +391,4 @@ class MasterProtocolManager:
         return sum(ratings) / len(ratings) if ratings else 4.0
 
 # Global instance
-master_protocol_manager = MasterProtocolManager()
\ No newline at end of file
+master_protocol_manager = MasterProtocolManager.load()
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+Prompt Builder - Token-budgeted prompt assembly and compact protocol summaries for Dr. Peptide
+Protocol context is rendered once per catalog load in a compact text form, and every prompt
+section is held to a token budget estimated locally before the LLM call
+"""
+
+import logging
+import math
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Add tiktoken support if available (exact counts); otherwise estimate from length
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding('cl100k_base')
+    TIKTOKEN_AVAILABLE = True
+except Exception:
+    _ENCODING = None
+    TIKTOKEN_AVAILABLE = False
+
+# Default per-section budgets (tokens); None means the section is never truncated
+SECTION_BUDGETS: Dict[str, Optional[int]] = {
+    'system': 1000,
+    'protocol_context': 1200,
+    'history': 400,
+    # Patient medications, history and labs live here; the other sections give way instead
+    'request': None
+}
+DEFAULT_TOTAL_BUDGET = 8000
+
+# Budget for one protocol summary inside the protocol context
+PROTOCOL_SUMMARY_BUDGET = 380
+
+TRUNCATION_MARK = ' [...]'
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count for budgeting; roughly 4 characters per token for English without tiktoken"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def truncate_to_budget(text: str, max_tokens: int) -> str:
+    """Cut text to fit the budget, preferring a line break near the cut"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ''
+    low, high = 0, len(text)
+    # Largest prefix that fits (token estimates are monotonic in prefix length)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle] + TRUNCATION_MARK) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text.rfind('\n', 0, low)
+    if cut < low * 0.8:
+        cut = low
+    return text[:cut].rstrip() + TRUNCATION_MARK
+
+
+def render_compact(value: Any, indent: int = 0, max_items: int = 6) -> str:
+    """Nested dosing/monitoring blocks as terse 'key: value' lines instead of indented JSON"""
+    pad = ' ' * indent
+    if isinstance(value, dict):
+        lines = []
+        for key, item in list(value.items())[:max_items * 2]:
+            label = str(key).replace('_', ' ')
+            if isinstance(item, (dict, list)) and item and not _is_flat_list(item):
+                lines.append(f"{pad}{label}:")
+                lines.append(render_compact(item, indent + 1, max_items))
+            else:
+                lines.append(f"{pad}{label}: {_render_scalar(item, max_items)}")
+        return '\n'.join(line for line in lines if line.strip())
+    if isinstance(value, list):
+        if _is_flat_list(value):
+            return pad + _render_scalar(value, max_items)
+        return '\n'.join(render_compact(item, indent, max_items) for item in value[:max_items])
+    return pad + _render_scalar(value, max_items)
+
+
+def _is_flat_list(value: Any) -> bool:
+    return isinstance(value, list) and all(not isinstance(item, (dict, list)) for item in value)
+
+
+def _render_scalar(value: Any, max_items: int) -> str:
+    if isinstance(value, list):
+        shown = '; '.join(str(item) for item in value[:max_items])
+        return shown + ('; ...' if len(value) > max_items else '')
+    if isinstance(value, dict):
+        return '; '.join(f"{k}: {v}" for k, v in list(value.items())[:max_items])
+    return str(value)
+
+
+def compact_protocol_summary(protocol: Dict[str, Any], max_tokens: int = PROTOCOL_SUMMARY_BUDGET) -> str:
+    """Compact clinical summary of one protocol for chat context"""
+    safety = protocol.get('safety_profile', {}) or {}
+    contraindications = protocol.get('contraindications_and_precautions', {}) or {}
+    side_effects = [
+        f"{effect.get('effect', 'Unknown')} ({effect.get('frequency', 'Unknown')})"
+        for effect in safety.get('common_side_effects', [])[:3]
+        if isinstance(effect, dict)
+    ]
+    sections = [
+        f"PROTOCOL: {protocol.get('name', 'Unknown')} ({protocol.get('category', 'Unknown')})",
+        f"Indications: {'; '.join(protocol.get('clinical_indications', [])[:4]) or 'General therapeutic use'}",
+        f"Contraindications: {'; '.join(map(str, contraindications.get('absolute_contraindications', [])[:3])) or 'None listed'}",
+        f"Side effects: {'; '.join(side_effects) or 'None listed'}"
+    ]
+    for title, field in (('Dosing', 'complete_dosing_schedule'),
+                         ('Administration', 'administration_techniques'),
+                         ('Monitoring', 'monitoring_requirements'),
+                         ('Timeline', 'expected_timelines'),
+                         ('Cost', 'cost_considerations'),
+                         ('Functional medicine', 'functional_medicine_approach')):
+        block = protocol.get(field)
+        if block:
+            sections.append(f"{title}:\n{render_compact(block, indent=1, max_items=4)}")
+    sections.append(f"References: {len(protocol.get('scientific_references', []))} peer-reviewed studies")
+    return truncate_to_budget('\n'.join(sections), max_tokens)
+
+
+class ProtocolSummaryCache:
+    """Compact summaries for every protocol, rendered once when the catalog is loaded"""
+
+    def __init__(self, protocols: List[Dict[str, Any]], max_tokens: int = PROTOCOL_SUMMARY_BUDGET):
+        self.summaries: Dict[str, str] = {}
+        for protocol in protocols:
+            name = protocol.get('name', '').lower()
+            if name in self.summaries:
+                continue
+            try:
+                self.summaries[name] = compact_protocol_summary(protocol, max_tokens)
+            except Exception as e:
+                logger.warning(f"Could not summarize protocol {protocol.get('name', 'Unknown')}: {e}")
+
+    def get(self, protocol: Dict[str, Any]) -> str:
+        summary = self.summaries.get(protocol.get('name', '').lower())
+        if summary is None:
+            summary = compact_protocol_summary(protocol)
+        return summary
+
+
+class PromptBuilder:
+    """
+    Assembles a prompt from named sections, each held to its own token budget; if the total
+    still exceeds the overall budget, the lowest-priority sections are trimmed first
+    """
+
+    def __init__(self, total_budget: int = DEFAULT_TOTAL_BUDGET, budgets: Optional[Dict[str, int]] = None):
+        self.total_budget = total_budget
+        self.budgets = dict(SECTION_BUDGETS, **(budgets or {}))
+        self._sections: List[Tuple[str, str, int]] = []
+
+    def add(self, name: str, text: str, priority: int = 0, heading: Optional[str] = None) -> 'PromptBuilder':
+        """Add a section; higher priority sections are trimmed last, unbudgeted ones never"""
+        if text and text.strip():
+            body = text.strip()
+            if self._trimmable(name):
+                body = truncate_to_budget(body, self.budgets.get(name, self.total_budget))
+            self._sections.append((name, f"{heading}\n{body}" if heading else body, priority))
+        return self
+
+    def _trimmable(self, name: str) -> bool:
+        return name not in self.budgets or self.budgets[name] is not None
+
+    def section_tokens(self) -> Dict[str, int]:
+        return {name: estimate_tokens(text) for name, text, _ in self._sections}
+
+    def build(self) -> str:
+        sections = list(self._sections)
+        overflow = sum(estimate_tokens(text) for _, text, _ in sections) - self.total_budget
+        if overflow > 0:
+            # Trim from the lowest priority upwards until the prompt fits
+            for index in sorted(range(len(sections)), key=lambda i: sections[i][2]):
+                if overflow <= 0:
+                    break
+                name, text, priority = sections[index]
+                if not self._trimmable(name):
+                    continue
+                tokens = estimate_tokens(text)
+                trimmed = truncate_to_budget(text, max(0, tokens - overflow))
+                overflow -= tokens - estimate_tokens(trimmed)
+                sections[index] = (name, trimmed, priority)
+            if overflow > 0:
+                logger.warning(f"Prompt exceeds its {self.total_budget}-token budget by {overflow} tokens; "
+                               f"untruncated sections kept whole")
+        return '\n\n'.join(text for _, text, _ in sections if text)
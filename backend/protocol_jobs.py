@@ -0,0 +1,346 @@
+"""
+Protocol Jobs - Mongo-backed job queue for long-running protocol generation
+Endpoints enqueue a job and return its id; workers (in the API process or a separate
+`python protocol_jobs.py worker` process) claim jobs under a lease, run them stage by
+stage and record progress that clients follow by polling or server-sent events
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+from llm_metrics import endpoint_scope
+
+logger = logging.getLogger(__name__)
+
+# Workers started inside the API process (0 = only enqueue; run workers separately)
+DEFAULT_WORKERS = int(os.environ.get('PROTOCOL_JOB_WORKERS', '2'))
+# A running job whose lease is not renewed within this many seconds is re-queued
+DEFAULT_LEASE_SECONDS = int(os.environ.get('PROTOCOL_JOB_LEASE_SECONDS', '60'))
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_INTERVAL = 1.0
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+TERMINAL_STATUSES = (SUCCEEDED, FAILED)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+_current_job: contextvars.ContextVar = contextvars.ContextVar('protocol_job', default=None)
+
+
+async def report_stage(stage: str):
+    """Mark the running job's next stage; a no-op outside a job (e.g. synchronous endpoints)"""
+    job = _current_job.get()
+    if job is not None:
+        await job.enter_stage(stage)
+
+
+def current_job_id() -> Optional[str]:
+    """Id of the job being run, so handlers can make their writes idempotent across re-runs"""
+    job = _current_job.get()
+    return job.job_id if job is not None else None
+
+
+class _JobRun:
+    """Progress reporting for one claimed job"""
+
+    def __init__(self, queue: 'ProtocolJobQueue', job: Dict[str, Any]):
+        self.queue = queue
+        self.job_id = job['id']
+        # Matches the job only while this claim holds the lease (attempts grows with every claim)
+        self.owner = {'id': job['id'], 'worker_id': queue.worker_id, 'attempts': job['attempts']}
+        self.stages = [stage['name'] for stage in job.get('stages', [])]
+        self.current: Optional[str] = None
+        self.lease_lost = False
+
+    async def enter_stage(self, stage: str):
+        now = datetime.utcnow()
+        updates = {'stage': stage, 'updated_at': now}
+        if self.current in self.stages:
+            index = self.stages.index(self.current)
+            updates[f'stages.{index}.status'] = SUCCEEDED
+            updates[f'stages.{index}.finished_at'] = now
+        if stage in self.stages:
+            index = self.stages.index(stage)
+            updates[f'stages.{index}.status'] = RUNNING
+            updates[f'stages.{index}.started_at'] = now
+        self.current = stage
+        await self.queue._update(self.owner, updates)
+
+    def finish_stage_updates(self, status: str, now: datetime) -> Dict[str, Any]:
+        if self.current not in self.stages:
+            return {}
+        index = self.stages.index(self.current)
+        return {f'stages.{index}.status': status, f'stages.{index}.finished_at': now}
+
+
+class ProtocolJobQueue:
+    """Durable job queue over a Mongo collection, with an in-process worker pool"""
+
+    def __init__(self,
+                 collection,
+                 lease_seconds: int = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers: Dict[str, JobHandler] = {}
+        self._stages: Dict[str, List[str]] = {}
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._indexes_ready = False
+
+    def register(self, kind: str, handler: JobHandler, stages: List[str]):
+        """Handler for a job kind, with the stages it reports (in order) for clients to display"""
+        self._handlers[kind] = handler
+        self._stages[kind] = list(stages)
+
+    async def _ensure_indexes(self):
+        if not self._indexes_ready:
+            await self.collection.create_index('id', unique=True)
+            await self.collection.create_index([('status', 1), ('created_at', 1)])
+            # At most one active job per dedupe key; the key is unset once the job finishes
+            await self.collection.create_index('active_key', unique=True, sparse=True)
+            self._indexes_ready = True
+
+    # Submitting and reading jobs
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a job; while one with the same dedupe key is queued or running, return that one instead"""
+        from pymongo.errors import DuplicateKeyError
+
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        await self._ensure_indexes()
+
+        now = datetime.utcnow()
+        job = {
+            'id': str(uuid.uuid4()),
+            'kind': kind,
+            'payload': payload,
+            'status': QUEUED,
+            'stage': None,
+            'stages': [{'name': stage, 'status': 'pending'} for stage in self._stages[kind]],
+            'attempts': 0,
+            'result': None,
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+        if dedupe_key:
+            job['active_key'] = f"{kind}:{dedupe_key}"
+        try:
+            await self.collection.insert_one(job)
+        except DuplicateKeyError:
+            existing = await self.collection.find_one({'active_key': job['active_key']})
+            if existing:
+                logger.info(f"Joined active {kind} job {existing['id']} for {dedupe_key}")
+                return self._public(existing)
+            await self.collection.insert_one(job)
+        self._notify()
+        return self._public(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await self.collection.find_one({'id': job_id})
+        return self._public(job) if job else None
+
+    async def watch(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job each time its status or stage changes, ending once it finishes"""
+        last_seen = None
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            marker = (job['status'], job['stage'], job['updated_at'])
+            if marker != last_seen:
+                last_seen = marker
+                yield job
+            if job['status'] in TERMINAL_STATUSES:
+                return
+            # Updates from this process wake watchers at once; other workers are picked up by polling
+            changed = self._change_event()
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in job.items() if key not in ('_id', 'active_key', 'lease_until')}
+
+    # Workers
+
+    def start(self, workers: int = DEFAULT_WORKERS):
+        for number in range(workers):
+            self._workers.append(asyncio.ensure_future(self._worker_loop(number)))
+        if workers:
+            logger.info(f"Started {workers} protocol job worker(s) on {self.worker_id}")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    async def run_forever(self, workers: int = DEFAULT_WORKERS):
+        """Standalone worker process: generation scales separately from the API"""
+        self.start(max(workers, 1))
+        try:
+            await asyncio.gather(*self._workers)
+        finally:
+            await self.stop()
+
+    async def _worker_loop(self, number: int):
+        await self._ensure_indexes()
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Protocol job worker {number} could not claim a job: {e}")
+                job = None
+            if job is None:
+                wakeup = self._wakeup_event()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+                continue
+            await self._run(job)
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest queued job, or a running one whose worker stopped renewing its lease"""
+        from pymongo import ReturnDocument
+
+        now = datetime.utcnow()
+        job = await self.collection.find_one_and_update(
+            {'$or': [
+                {'status': QUEUED},
+                {'status': RUNNING, 'lease_until': {'$lt': now}}
+            ]},
+            {
+                '$set': {
+                    'status': RUNNING,
+                    'worker_id': self.worker_id,
+                    'lease_until': now + timedelta(seconds=self.lease_seconds),
+                    'started_at': now,
+                    'updated_at': now
+                },
+                '$inc': {'attempts': 1}
+            },
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job and job['attempts'] > self.max_attempts:
+            await self._finish(_JobRun(self, job), FAILED, error=f"Abandoned after {self.max_attempts} attempts")
+            return None
+        return job
+
+    async def _run(self, job: Dict[str, Any]):
+        run = _JobRun(self, job)
+        token = _current_job.set(run)
+
+        async def execute():
+            handler = self._handlers[job['kind']]
+            # LLM calls made by the job are attributed to it rather than to the enqueueing endpoint
+            with endpoint_scope(f"job:{job['kind']}"):
+                return await handler(job['payload'])
+
+        work = asyncio.ensure_future(execute())
+        heartbeat = asyncio.ensure_future(self._heartbeat(run, work))
+        try:
+            result = await work
+            await self._finish(run, SUCCEEDED, result=result)
+        except asyncio.CancelledError:
+            if not run.lease_lost:
+                # Shutdown: leave the job for another worker once its lease expires
+                raise
+            logger.warning(f"Protocol job {job['id']} lost its lease to another worker; abandoned this run")
+        except Exception as e:
+            logger.error(f"Protocol job {job['id']} failed: {e}")
+            await self._finish(run, FAILED, error=str(getattr(e, 'detail', e)))
+        finally:
+            heartbeat.cancel()
+            _current_job.reset(token)
+
+    async def _heartbeat(self, run: _JobRun, work: asyncio.Future):
+        """Renew the lease while the job runs; stop the run once another worker has taken it over"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await self.collection.update_one(
+                    run.owner,
+                    {'$set': {'lease_until': datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep trying; the lease only lapses if renewals keep failing for lease_seconds
+                logger.error(f"Could not renew the lease on protocol job {run.job_id}: {e}")
+                continue
+            if renewed.matched_count == 0:
+                run.lease_lost = True
+                work.cancel()
+                return
+
+    async def _finish(self, run: _JobRun, status: str, result: Optional[Dict[str, Any]] = None,
+                      error: Optional[str] = None):
+        now = datetime.utcnow()
+        updates = {'status': status, 'result': result, 'error': error, 'finished_at': now, 'updated_at': now}
+        updates.update(run.finish_stage_updates(status, now))
+        finished = await self.collection.update_one(
+            run.owner,
+            {'$set': updates, '$unset': {'active_key': '', 'lease_until': ''}}
+        )
+        if finished.matched_count == 0:
+            logger.warning(f"Protocol job {run.job_id} was taken over by another worker; discarded this run's {status} result")
+        self._notify_watchers()
+
+    async def _update(self, owner: Dict[str, Any], updates: Dict[str, Any]):
+        await self.collection.update_one(owner, {'$set': updates})
+        self._notify_watchers()
+
+    # In-process notifications
+
+    def _wakeup_event(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _change_event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def _notify(self):
+        self._wakeup_event().set()
+
+    def _notify_watchers(self):
+        changed, self._changed = self._change_event(), asyncio.Event()
+        changed.set()
+
+
+if __name__ == '__main__':
+    import sys
+
+    # python protocol_jobs.py worker [count]
+    if len(sys.argv) < 2 or sys.argv[1] != 'worker':
+        print("usage: python protocol_jobs.py worker [count]")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from server import protocol_job_queue
+    asyncio.run(protocol_job_queue.run_forever(int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_WORKERS))
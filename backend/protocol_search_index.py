@@ -0,0 +1,459 @@
+"""
+Protocol Search Index - Tokenized inverted index with BM25 ranking
+Backs MasterProtocolManager.search_protocols so query cost scales with matches, not library size,
+plus a trigram index for typo-tolerant name lookup, a prefix index for typeahead
+and bitmap facets for filtering and counts
+"""
+
+import heapq
+import math
+import re
+from bisect import bisect_left
+from typing import List, Dict, Any, Optional, Iterable, Tuple, Set
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Per-field boosts (mirror the original substring scoring: name 100, alias 80,
+# indication 70, keyword 50, mechanism 40)
+FIELD_WEIGHTS = {
+    'name': 100.0,
+    'aliases': 80.0,
+    'clinical_indications': 70.0,
+    'search_keywords': 50.0,
+    'mechanism_of_action': 40.0
+}
+
+# Prefix expansions keep "sema" finding "semaglutide" like the old substring scan,
+# but score below an exact token hit (and below more widely used completions)
+PREFIX_MATCH_DISCOUNT = 0.6
+MAX_PREFIX_EXPANSIONS = 64
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase alphanumeric tokens.
+
+    Hyphenated or slashed words also emit their joined form so "BPC157" finds "BPC-157".
+    """
+    if not text:
+        return []
+    tokens = []
+    for word in str(text).lower().split():
+        parts = TOKEN_PATTERN.findall(word)
+        tokens.extend(parts)
+        if len(parts) > 1:
+            tokens.append(''.join(parts))
+    return tokens
+
+
+def _field_text(protocol: Dict[str, Any], field: str) -> List[str]:
+    """Get the tokens for one searchable field of a protocol"""
+    value = protocol.get(field)
+    if isinstance(value, str):
+        return tokenize(value)
+    if isinstance(value, (list, tuple, set)):
+        tokens = []
+        for item in value:
+            tokens.extend(tokenize(item) if isinstance(item, str) else [])
+        return tokens
+    return []
+
+
+class ProtocolSearchIndex:
+    """Per-field inverted index over protocol ordinals with BM25 scoring"""
+
+    def __init__(self, field_weights: Optional[Dict[str, float]] = None, k1: float = 1.2, b: float = 0.75):
+        self.field_weights = field_weights or FIELD_WEIGHTS
+        self.k1 = k1
+        self.b = b
+        self.doc_count = 0
+        # field -> term -> {ordinal: term frequency}
+        self.postings: Dict[str, Dict[str, Dict[int, int]]] = {}
+        # field -> [token count per ordinal]
+        self.field_lengths: Dict[str, List[int]] = {}
+        self.average_lengths: Dict[str, float] = {}
+        self.vocabulary: List[str] = []
+        # compact name or alias -> ordinals, so a query naming a protocol ranks it first
+        self.exact_names: Dict[str, List[int]] = {}
+
+    def build(self, protocols: List[Dict[str, Any]]):
+        """Index protocols by their position in the list"""
+        self.doc_count = len(protocols)
+        self.postings = {field: {} for field in self.field_weights}
+        self.field_lengths = {field: [0] * self.doc_count for field in self.field_weights}
+
+        for ordinal, protocol in enumerate(protocols):
+            for field in self.field_weights:
+                tokens = _field_text(protocol, field)
+                self.field_lengths[field][ordinal] = len(tokens)
+                field_postings = self.postings[field]
+                for token in tokens:
+                    postings = field_postings.setdefault(token, {})
+                    postings[ordinal] = postings.get(ordinal, 0) + 1
+
+        self.average_lengths = {
+            field: (sum(lengths) / len(lengths)) if lengths else 0.0
+            for field, lengths in self.field_lengths.items()
+        }
+        self.vocabulary = sorted({term for field_postings in self.postings.values() for term in field_postings})
+        self.exact_names = {}
+        for ordinal, protocol in enumerate(protocols):
+            for name in {compact(name) for name in [protocol.get('name', '')] + list(protocol.get('aliases', []))}:
+                if name:
+                    self.exact_names.setdefault(name, []).append(ordinal)
+
+    def _expand_term(self, token: str) -> List[Tuple[str, float]]:
+        """Resolve a query token to indexed terms (exact hit plus prefix expansions)"""
+        expansions = []
+        position = bisect_left(self.vocabulary, token)
+        while position < len(self.vocabulary) and len(expansions) < MAX_PREFIX_EXPANSIONS:
+            term = self.vocabulary[position]
+            if not term.startswith(token):
+                break
+            expansions.append((term, 1.0 if term == token else PREFIX_MATCH_DISCOUNT))
+            position += 1
+        return expansions
+
+    def _idf(self, document_frequency: int) -> float:
+        return math.log(1.0 + (self.doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def _completion_weights(self, expansions: List[Tuple[str, float]]) -> Dict[str, float]:
+        """
+        Prefix completions share the prefix discount in proportion to how many protocols use
+        them, so "sema" prefers the widely used "semaglutide" over the rarer "semax"
+        """
+        document_counts = {
+            term: len({ordinal for field in self.field_weights for ordinal in self.postings[field].get(term, ())})
+            for term, discount in expansions if discount < 1.0
+        }
+        most = max(document_counts.values(), default=0) or 1
+        return {term: discount * document_counts.get(term, most) / most if discount < 1.0 else discount
+                for term, discount in expansions}
+
+    def _score_token(self, token: str) -> Dict[int, float]:
+        """BM25 contribution of one query token per matching ordinal"""
+        expansions = self._expand_term(token)
+        weights = self._completion_weights(expansions)
+        token_scores: Dict[int, float] = {}
+        for field, weight in self.field_weights.items():
+            field_postings = self.postings[field]
+            # Completions are scored with the rarity of the prefix itself, not their own:
+            # otherwise the rarest completion gets the largest IDF and outranks the common ones
+            prefix_ordinals = {ordinal for term, discount in expansions if discount < 1.0
+                               for ordinal in field_postings.get(term, ())}
+            prefix_idf = self._idf(len(prefix_ordinals)) if prefix_ordinals else 0.0
+            average_length = self.average_lengths[field] or 1.0
+            lengths = self.field_lengths[field]
+            for term, discount in expansions:
+                postings = field_postings.get(term)
+                if not postings:
+                    continue
+                idf = self._idf(len(postings)) if discount >= 1.0 else prefix_idf
+                for ordinal, frequency in postings.items():
+                    norm = self.k1 * (1.0 - self.b + self.b * lengths[ordinal] / average_length)
+                    bm25 = idf * frequency * (self.k1 + 1.0) / (frequency + norm)
+                    term_scores = token_scores.setdefault(ordinal, {})
+                    term_scores[term] = term_scores.get(term, 0.0) + weight * bm25
+        # A token counts once per document: keep its best-matching expansion
+        return {
+            ordinal: max(score * weights[term] for term, score in term_scores.items())
+            for ordinal, term_scores in token_scores.items()
+        }
+
+    def score(self, query: str) -> Dict[int, float]:
+        """Score every ordinal that matches all query tokens"""
+        tokens = list(dict.fromkeys(TOKEN_PATTERN.findall(query.lower())))
+        if not tokens:
+            return {}
+
+        scores: Optional[Dict[int, float]] = None
+        for token in tokens:
+            token_scores = self._score_token(token)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    ordinal: total + token_scores[ordinal]
+                    for ordinal, total in scores.items()
+                    if ordinal in token_scores
+                }
+            if not scores:
+                return {}
+
+        # BM25 length normalization favours short fields, which puts "TB-500" below the stacks
+        # that mention it; a query equal to a name or alias outranks every partial match
+        exact = self.exact_names.get(compact(query))
+        if exact:
+            top = max(scores.values())
+            for ordinal in exact:
+                scores[ordinal] = top + scores.get(ordinal, 0.0)
+        return scores
+
+    @staticmethod
+    def top_k(scores: Dict[int, float], limit: int, ordinals: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """Select the highest scoring ordinals with a bounded heap (ties keep catalog order)"""
+        candidates = scores.items() if ordinals is None else ((o, scores[o]) for o in ordinals if o in scores)
+        best = heapq.nlargest(limit, candidates, key=lambda item: (item[1], -item[0]))
+        return best
+
+
+def compact(text: str) -> str:
+    """Normalize text to lowercase alphanumerics only ("BPC-157" -> "bpc157")"""
+    return ''.join(TOKEN_PATTERN.findall(str(text).lower()))
+
+
+def _trigrams(term: str) -> Set[str]:
+    # Left padding only, so a query that is a prefix of a term shares all of its grams
+    padded = f"$${term}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _max_edits(length: int) -> int:
+    """Edit budget that grows with the query length"""
+    if length <= 4:
+        return 0
+    if length <= 7:
+        return 1
+    if length <= 12:
+        return 2
+    return 3
+
+
+def bounded_edit_distance(query: str, term: str, max_distance: int) -> Tuple[Optional[int], Optional[int]]:
+    """Levenshtein distance to the whole term and to its best prefix, or None past the bound"""
+    # A term much shorter than the query can never be within the bound
+    if len(query) - len(term) > max_distance:
+        return None, None
+
+    # Columns past len(query) + max_distance can't improve either distance
+    window = term[:len(query) + max_distance]
+    previous = list(range(len(window) + 1))
+    for i, query_char in enumerate(query, 1):
+        current = [i] + [0] * len(window)
+        for j, term_char in enumerate(window, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (query_char != term_char)
+            )
+        if min(current) > max_distance:
+            return None, None
+        previous = current
+
+    whole = previous[-1] if len(window) == len(term) and previous[-1] <= max_distance else None
+    prefix = min(previous)
+    return whole, prefix if prefix <= max_distance else None
+
+
+class FuzzyTermIndex:
+    """Trigram index over short terms (names, aliases, keywords) with edit-distance verification"""
+
+    # A prefix hit ("ipamor" -> "ipamorelin") ranks below a whole-term hit with the same edits
+    PREFIX_PENALTY = 0.15
+
+    def __init__(self, min_term_length: int = 3):
+        self.min_term_length = min_term_length
+        self.terms: List[str] = []
+        # term id -> {ordinal: source weight}
+        self.term_owners: List[Dict[int, float]] = []
+        self.term_ids: Dict[str, int] = {}
+        self.gram_postings: Dict[str, List[int]] = {}
+
+    def add(self, ordinal: int, text: str, weight: float = 1.0):
+        """Index a phrase as one compact term plus each of its words"""
+        words = [word for word in TOKEN_PATTERN.findall(str(text).lower()) if len(word) >= self.min_term_length]
+        for term in {compact(text), *words}:
+            if len(term) < self.min_term_length:
+                continue
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                term_id = len(self.terms)
+                self.term_ids[term] = term_id
+                self.terms.append(term)
+                self.term_owners.append({})
+                for gram in _trigrams(term):
+                    self.gram_postings.setdefault(gram, []).append(term_id)
+            owners = self.term_owners[term_id]
+            owners[ordinal] = max(owners.get(ordinal, 0.0), weight)
+
+    def lookup(self, query: str, limit: int = 10) -> List[Tuple[int, float, str]]:
+        """Ranked (ordinal, similarity 0-1, matched term) for a possibly misspelled query"""
+        # The whole query as one compact term ("bpc 157" -> "bpc157")
+        best = self._best_per_ordinal(compact(query))
+
+        # Multi-word queries also score as the mean of per-word matches
+        words = list(dict.fromkeys(
+            word for word in TOKEN_PATTERN.findall(str(query).lower()) if len(word) >= self.min_term_length
+        ))
+        if len(words) > 1:
+            per_word = [self._best_per_ordinal(word) for word in words]
+            for ordinal in set().union(*per_word):
+                score = sum(matches.get(ordinal, (0.0, ''))[0] for matches in per_word) / len(words)
+                if score > best.get(ordinal, (0.0, ''))[0]:
+                    term = max((matches[ordinal] for matches in per_word if ordinal in matches))[1]
+                    best[ordinal] = (score, term)
+
+        ranked = heapq.nlargest(limit, best.items(), key=lambda item: (item[1][0], -item[0]))
+        return [(ordinal, round(score, 4), term) for ordinal, (score, term) in ranked]
+
+    def _best_per_ordinal(self, probe: str) -> Dict[int, Tuple[float, str]]:
+        best: Dict[int, Tuple[float, str]] = {}
+        if len(probe) < self.min_term_length:
+            return best
+        for term_id, similarity in self._match(probe):
+            term = self.terms[term_id]
+            for ordinal, weight in self.term_owners[term_id].items():
+                score = similarity * weight
+                if score > best.get(ordinal, (0.0, ''))[0]:
+                    best[ordinal] = (score, term)
+        return best
+
+    def _match(self, probe: str) -> List[Tuple[int, float]]:
+        max_distance = _max_edits(len(probe))
+        grams = _trigrams(probe)
+        # Each edit can destroy at most three grams
+        required = max(1, len(grams) - 3 * max_distance)
+
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for term_id in self.gram_postings.get(gram, ()):
+                shared[term_id] = shared.get(term_id, 0) + 1
+
+        matches = []
+        for term_id, count in shared.items():
+            if count < required:
+                continue
+            term = self.terms[term_id]
+            whole, prefix = bounded_edit_distance(probe, term, max_distance)
+            if whole is not None:
+                similarity = 1.0 - whole / max(len(probe), len(term))
+            elif prefix is not None:
+                similarity = 1.0 - prefix / len(probe) - self.PREFIX_PENALTY
+            else:
+                continue
+            matches.append((term_id, similarity))
+        return matches
+
+
+class PrefixSuggestIndex:
+    """Sorted-array prefix index for typeahead over names, aliases, categories and tags"""
+
+    # Match quality, best first
+    NAME_START, ALIAS_START, NAME_WORD, ALIAS_WORD = range(4)
+
+    # Upper bound on entries examined per prefix, keeps one-letter queries cheap
+    MAX_SCAN = 256
+
+    def __init__(self):
+        self.protocol_keys: List[str] = []
+        self.protocol_entries: List[Tuple[int, int]] = []  # (rank, ordinal)
+        self.label_keys: Dict[str, List[str]] = {}
+        self.label_values: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def _word_starts(text: str) -> List[str]:
+        """Suffixes of the lowercased text that begin at each word after the first"""
+        lowered = text.lower()
+        return [lowered[match.start():] for match in TOKEN_PATTERN.finditer(lowered)][1:]
+
+    def build(self, protocols: List[Dict[str, Any]], labels: Dict[str, Iterable[str]]):
+        """Index protocol names/aliases by ordinal, and plain label lists (e.g. categories, tags)"""
+        entries = []
+        for ordinal, protocol in enumerate(protocols):
+            name = protocol.get('name', '')
+            entries.append((name.lower(), self.NAME_START, ordinal))
+            entries.extend((suffix, self.NAME_WORD, ordinal) for suffix in self._word_starts(name))
+            for alias in protocol.get('aliases', []):
+                entries.append((alias.lower(), self.ALIAS_START, ordinal))
+                entries.extend((suffix, self.ALIAS_WORD, ordinal) for suffix in self._word_starts(alias))
+        entries.sort()
+        self.protocol_keys = [key for key, _, _ in entries]
+        self.protocol_entries = [(rank, ordinal) for _, rank, ordinal in entries]
+
+        for kind, values in labels.items():
+            keyed = sorted({(value.lower(), value) for value in values if value})
+            self.label_keys[kind] = [key for key, _ in keyed]
+            self.label_values[kind] = [value for _, value in keyed]
+
+    def _scan(self, keys: List[str], prefix: str) -> range:
+        start = bisect_left(keys, prefix)
+        end = start
+        while end < len(keys) and end - start < self.MAX_SCAN and keys[end].startswith(prefix):
+            end += 1
+        return range(start, end)
+
+    def suggest_protocols(self, prefix: str, limit: int = 8) -> List[int]:
+        """Ordinals of protocols whose name or alias (or a word in them) starts with prefix"""
+        prefix = prefix.lower().strip()
+        if not prefix:
+            return []
+        best: Dict[int, Tuple[int, int]] = {}
+        for position in self._scan(self.protocol_keys, prefix):
+            rank, ordinal = self.protocol_entries[position]
+            candidate = (rank, len(self.protocol_keys[position]))
+            if ordinal not in best or candidate < best[ordinal]:
+                best[ordinal] = candidate
+        ranked = sorted(best, key=lambda ordinal: (*best[ordinal], ordinal))
+        return ranked[:limit]
+
+    def suggest_labels(self, kind: str, prefix: str, limit: int = 5) -> List[str]:
+        """Labels of one kind that start with prefix"""
+        prefix = prefix.lower().strip()
+        keys = self.label_keys.get(kind, [])
+        if not prefix:
+            return []
+        return [self.label_values[kind][position] for position in self._scan(keys, prefix)][:limit]
+
+
+def popcount(bitmap: int) -> int:
+    return bin(bitmap).count('1')
+
+
+def iter_bitmap(bitmap: int) -> Iterable[int]:
+    """Yield the set ordinals of a bitmap in ascending order"""
+    while bitmap:
+        lowest = bitmap & -bitmap
+        yield lowest.bit_length() - 1
+        bitmap ^= lowest
+
+
+def bitmap_from_ordinals(ordinals: Iterable[int]) -> int:
+    bitmap = 0
+    for ordinal in ordinals:
+        bitmap |= 1 << ordinal
+    return bitmap
+
+
+class FacetBitmaps:
+    """One bitmap over protocol ordinals per facet value (bit i set = protocol i has the value)"""
+
+    def __init__(self):
+        self.universe = 0
+        self.facets: Dict[str, Dict[str, int]] = {}
+
+    def build(self, protocols: List[Dict[str, Any]], fields: Iterable[str]):
+        self.universe = (1 << len(protocols)) - 1
+        self.facets = {field: {} for field in fields}
+        for ordinal, protocol in enumerate(protocols):
+            bit = 1 << ordinal
+            for field, values in self.facets.items():
+                raw = protocol.get(field)
+                for value in ([raw] if isinstance(raw, str) else raw or []):
+                    values[value] = values.get(value, 0) | bit
+
+    def match_any(self, field: str, values: Optional[Iterable[str]]) -> int:
+        """Bitmap of protocols having any of values (everything when no values are given)"""
+        if not values:
+            return self.universe
+        bitmap = 0
+        for value in values:
+            bitmap |= self.facets[field].get(value, 0)
+        return bitmap
+
+    def counts(self, field: str, within: int) -> Dict[str, int]:
+        """Per-value counts inside a result bitmap, omitting empty values"""
+        counts = {}
+        for value, bitmap in self.facets[field].items():
+            count = popcount(bitmap & within)
+            if count:
+                counts[value] = count
+        return dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
@@ -0,0 +1,154 @@
+"""
+Request Coalescing - Singleflight de-duplication and per-provider admission control for LLM work
+Concurrent identical requests share one in-flight computation, and LLM calls are admitted
+through a bounded queue per provider so bursts cannot exhaust provider rate limits
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '8'))
+# Callers allowed to wait for a slot per provider (0 = unbounded)
+DEFAULT_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE_DEPTH', '100'))
+# Seconds a caller may wait for a slot before being turned away (0 = wait indefinitely)
+DEFAULT_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', '120'))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a provider's queue is full or a caller waited too long for a slot"""
+
+    def __init__(self, provider: str, reason: str, retry_after: int = 5):
+        super().__init__(f"LLM provider '{provider}' is at capacity ({reason})")
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key onto one in-flight task. The work runs as
+    its own task, so a caller disconnecting does not cancel it for the others
+    """
+
+    def __init__(self, name: str = 'default'):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.metrics = {'executions': 0, 'coalesced': 0, 'errors': 0}
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Any:
+        """Run work() for key, or join the run already in flight for it"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.metrics['coalesced'] += 1
+            logger.info(f"Coalesced duplicate {self.name} request for {key}")
+        else:
+            task = asyncio.ensure_future(work())
+            self._inflight[key] = task
+            self.metrics['executions'] += 1
+            task.add_done_callback(lambda finished, key=key: self._finish(key, finished))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.metrics['errors'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.metrics, 'in_flight': len(self._inflight)}
+
+
+class _ProviderLane:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.in_flight = 0
+        self.metrics = {'admitted': 0, 'rejected': 0, 'timed_out': 0, 'max_queue_depth': 0, 'total_wait_seconds': 0.0}
+
+
+class AdmissionController:
+    """Semaphore per LLM provider with a bounded wait queue and queue-depth metrics"""
+
+    def __init__(self,
+                 limits: Optional[Dict[str, int]] = None,
+                 default_limit: int = DEFAULT_MAX_CONCURRENCY,
+                 max_queue: int = DEFAULT_MAX_QUEUE,
+                 queue_timeout: float = DEFAULT_QUEUE_TIMEOUT):
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lanes: Dict[str, _ProviderLane] = {}
+
+    def limit_for(self, provider: str) -> int:
+        return self.limits.get(provider, self.default_limit)
+
+    def _lane(self, provider: str) -> _ProviderLane:
+        lane = self._lanes.get(provider)
+        if lane is None:
+            lane = self._lanes[provider] = _ProviderLane(self.limit_for(provider))
+        return lane
+
+    @asynccontextmanager
+    async def slot(self, provider: str):
+        """Hold one of the provider's concurrency slots for the duration of an LLM call"""
+        lane = self._lane(provider)
+        if not lane.semaphore.locked():
+            # Free slot and nobody queued ahead: admitted without suspending
+            await lane.semaphore.acquire()
+        else:
+            await self._queue(provider, lane)
+
+        lane.in_flight += 1
+        lane.metrics['admitted'] += 1
+        try:
+            yield
+        finally:
+            lane.in_flight -= 1
+            lane.semaphore.release()
+
+    async def _queue(self, provider: str, lane: _ProviderLane):
+        if self.max_queue and lane.waiting >= self.max_queue:
+            lane.metrics['rejected'] += 1
+            raise AdmissionRejected(provider, 'queue full')
+
+        lane.waiting += 1
+        lane.metrics['max_queue_depth'] = max(lane.metrics['max_queue_depth'], lane.waiting)
+        started = time.monotonic()
+        try:
+            if self.queue_timeout:
+                await asyncio.wait_for(lane.semaphore.acquire(), timeout=self.queue_timeout)
+            else:
+                await lane.semaphore.acquire()
+        except asyncio.TimeoutError:
+            lane.metrics['timed_out'] += 1
+            raise AdmissionRejected(provider, 'queue timeout')
+        finally:
+            lane.waiting -= 1
+            lane.metrics['total_wait_seconds'] += time.monotonic() - started
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {}
+        for provider, lane in self._lanes.items():
+            admitted = lane.metrics['admitted']
+            stats[provider] = {
+                **lane.metrics,
+                'total_wait_seconds': round(lane.metrics['total_wait_seconds'], 3),
+                'average_wait_seconds': round(lane.metrics['total_wait_seconds'] / admitted, 3) if admitted else 0.0,
+                'limit': lane.limit,
+                'in_flight': lane.in_flight,
+                'queue_depth': lane.waiting
+            }
+        return stats
+
+
+# Global instances
+llm_admission = AdmissionController()
+protocol_generation_flight = SingleFlight('protocol generation')
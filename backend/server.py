@@ -1,5 +1,8 @@
-from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks, UploadFile, File, Form
-from fastapi.responses import StreamingResponse, Response
+from lazy_imports import LazyService, import_timer
+import_timer.start()
+
+from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks, UploadFile, File, Form, Request, Query
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -11,28 +14,11 @@ from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime
-from openai import AsyncOpenAI
 import json
-import pytesseract
-from PIL import Image
-import pdfplumber
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-import tempfile
-import asyncio
 
 # Import enhanced services
-from enhanced_clinical_database import ENHANCED_CLINICAL_PEPTIDES
-from comprehensive_peptide_reference_expanded import EXPANDED_COMPREHENSIVE_PEPTIDES_DATABASE as COMPREHENSIVE_PEPTIDES_DATABASE, EXPANDED_PEPTIDE_CATEGORIES
 from dr_peptide_ai import DrPeptideAI
 from collective_intelligence_system import collective_intelligence
-from pdf_generation_service import pdf_generator
-from email_service import email_service
 from progress_tracking_service import progress_service
 from predictive_analytics_service import predictive_analytics_service
 from clinical_decision_support import clinical_decision_support
@@ -43,8 +29,22 @@ from adaptive_assessment_engine import adaptive_engine
 from dosing_calculator import dosing_calculator
 from file_analysis_service import FileAnalysisService
 from master_protocol_manager import master_protocol_manager
-from enhanced_pdf_generator import pdf_generator as enhanced_pdf_generator
 from sitemap_generator import sitemap_generator
+from catalog_service import catalog_service, MAX_BATCH_SIZE
+from catalog_responses import catalog_responses
+from llm_cache import llm_response_cache
+from request_coalescing import llm_admission, protocol_generation_flight, AdmissionRejected
+from catalog_snapshot import content_hash
+from protocol_jobs import ProtocolJobQueue, report_stage, current_job_id, DEFAULT_WORKERS
+from llm_gateway import llm_gateway, deadline_scope
+from llm_metrics import llm_metrics, endpoint_scope, request_calls, debug_headers
+from llm_replay import llm_replay
+from structured_output import parse_structured
+
+# PDF (reportlab) and email (fastapi-mail, jinja2) stacks load on first use
+pdf_generator = LazyService('pdf_generation_service', 'pdf_generator')
+enhanced_pdf_generator = LazyService('enhanced_pdf_generator', 'pdf_generator')
+email_service = LazyService('email_service', 'email_service')
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -54,10 +54,16 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# End-to-end time budgets for protocol generation; LLM calls inside get what remains
+PROTOCOL_REQUEST_BUDGET_SECONDS = float(os.environ.get('PROTOCOL_REQUEST_BUDGET_SECONDS', '170'))
+PROTOCOL_JOB_BUDGET_SECONDS = float(os.environ.get('PROTOCOL_JOB_BUDGET_SECONDS', '600'))
+
 # Initialize services
 dr_peptide_ai = DrPeptideAI()
 file_analysis_service = FileAnalysisService()
+protocol_job_queue = ProtocolJobQueue(db.protocol_jobs)
 # Note: file_analysis_service now available for upload processing
+import_timer.stop()
 
 # Create the main app without a prefix
 app = FastAPI(title="PeptideProtocols.ai - Ultimate Practitioner Resource")
@@ -131,6 +137,17 @@ class AdvancedProtocolLibraryItem(BaseModel):
 class ChatMessage(BaseModel):
     message: str
     conversation_history: Optional[List[Dict[str, str]]] = []
+    # Reuse the id returned by the previous reply to keep the same LLM session
+    conversation_id: Optional[str] = None
+
+class ProtocolBatchRequest(BaseModel):
+    ids: List[str] = []
+    names: List[str] = []
+    fields: Optional[List[str]] = None
+
+class PeptideBatchRequest(BaseModel):
+    names: List[str]
+    fields: Optional[List[str]] = None
 
 class FileUploadResponse(BaseModel):
     success: bool
@@ -184,6 +201,7 @@ async def generate_functional_medicine_protocol(assessment: PatientAssessment) -
     
     # Step 1: Generate risk analysis using adaptive assessment engine
     logger.info("Generating adaptive risk analysis...")
+    await report_stage("risk_analysis")
     risk_flags = adaptive_engine.generate_risk_flags(patient_data)
     
     # Step 2: Interpret any lab values if available
@@ -193,6 +211,7 @@ async def generate_functional_medicine_protocol(assessment: PatientAssessment) -
     
     # Step 3: Get enhanced protocol recommendations using Dr. Peptide AI with safety integration
     logger.info("Generating enhanced protocol recommendations...")
+    await report_stage("ai_recommendations")
     protocol_analysis = await dr_peptide_ai.generate_personalized_protocol(patient_data)
     
     if not protocol_analysis.get("success"):
@@ -200,6 +219,7 @@ async def generate_functional_medicine_protocol(assessment: PatientAssessment) -
     
     # Step 4: Calculate personalized dosing for recommended peptides
     logger.info("Calculating personalized dosing...")
+    await report_stage("personalized_dosing")
     recommended_peptides = protocol_analysis.get("recommended_peptides", [])
     if isinstance(recommended_peptides, str):
         recommended_peptides = [recommended_peptides]
@@ -252,6 +272,7 @@ async def generate_functional_medicine_protocol(assessment: PatientAssessment) -
     }
     
     # Step 6: Create enhanced protocol structure with all integrated data
+    await report_stage("protocol_structure")
     protocol_data = await _create_enhanced_protocol_structure(enhanced_protocol_analysis, assessment)
     
     return protocol_data
@@ -525,99 +546,33 @@ async def _get_enhanced_protocol_details(peptide_name: str) -> Optional[Dict[str
     return None
 
 async def _parse_functional_medicine_analysis(analysis_text: str, assessment: PatientAssessment) -> Dict[str, Any]:
-    """Parse Dr. Peptide's analysis into structured protocol format"""
-    
-    parsing_prompt = f"""
-Parse this functional medicine analysis into a structured JSON protocol:
-
-ANALYSIS:
-{analysis_text}
-
-Return JSON with this structure:
-{{
-    "functional_medicine_analysis": {{
-        "root_causes": ["identified root causes"],
-        "key_patterns": ["health patterns found"],
-        "priority_focus": "main area of focus"
-    }},
-    "primary_peptides": [
-        {{
-            "name": "peptide_name",
-            "indication": "why chosen for this patient",
-            "dosage": "specific dose",
-            "frequency": "how often",
-            "duration": "treatment length",
-            "expected_benefits": "what patient can expect"
-        }}
-    ],
-    "supporting_peptides": [
-        {{
-            "name": "peptide_name",
-            "indication": "supporting role",
-            "dosage": "dose",
-            "timing": "when to take"
-        }}
-    ],
-    "supplement_protocol": [
-        {{
-            "supplement": "name",
-            "dosage": "amount",
-            "timing": "when to take",
-            "rationale": "why needed"
-        }}
-    ],
-    "nutrition_plan": {{
-        "dietary_approach": "recommended diet type",
-        "key_foods": ["foods to emphasize"],
-        "foods_to_avoid": ["foods to eliminate"],
-        "meal_timing": "recommendations"
-    }},
-    "lifestyle_recommendations": ["specific lifestyle changes"],
-    "monitoring_biomarkers": ["what to track"],
-    "expected_outcomes": {{
-        "4_weeks": "what to expect at 4 weeks",
-        "12_weeks": "what to expect at 12 weeks",
-        "6_months": "long-term expectations"
-    }},
-    "safety_considerations": ["important safety notes"]
-}}
-"""
-
-    try:
-        from openai import AsyncOpenAI
-        openai_client = AsyncOpenAI(api_key=os.environ['OPENAI_API_KEY'])
-        
-        response = await openai_client.chat.completions.create(
-            model="gpt-5",
-            messages=[
-                {"role": "system", "content": "Parse functional medicine analysis into structured JSON format."},
-                {"role": "user", "content": parsing_prompt}
-            ],
-            temperature=0.1,
-            max_tokens=3000
-        )
-        
-        parsed_protocol = json.loads(response.choices[0].message.content)
+    """
+    Parse Dr. Peptide's analysis into structured protocol format. Generation already asks for
+    JSON, so this is a local parse (near-valid JSON is repaired) rather than a second LLM call
+    """
+    structured = parse_structured(analysis_text)
+    if isinstance(structured.data, dict):
+        parsed_protocol = structured.data
         
         # Add patient-specific information
         parsed_protocol["patient_assessment_id"] = assessment.id
         parsed_protocol["practitioner_notes"] = f"Comprehensive functional medicine protocol generated for {assessment.patient_name} focusing on {', '.join(assessment.primary_concerns)}"
         
         return parsed_protocol
-        
-    except Exception as e:
-        logging.error(f"Protocol parsing error: {e}")
-        # Fallback basic structure
-        return {
-            "functional_medicine_analysis": {"error": "Parsing failed, analysis provided as text"},
-            "raw_analysis": analysis_text,
-            "patient_assessment_id": assessment.id,
-            "practitioner_notes": "Analysis provided in text format due to parsing error"
-        }
+    
+    logging.error(f"Protocol parsing error: {'; '.join(structured.errors) or 'analysis is not a JSON object'}")
+    # Fallback basic structure
+    return {
+        "functional_medicine_analysis": {"error": "Parsing failed, analysis provided as text"},
+        "raw_analysis": analysis_text,
+        "patient_assessment_id": assessment.id,
+        "practitioner_notes": "Analysis provided in text format due to parsing error"
+    }
 
 # Initialize Enhanced Protocol Library
 async def initialize_enhanced_protocol_library():
-    """Initialize with enhanced clinical peptide database"""
+    """Initialize with enhanced clinical peptide database (reads are served by catalog_service)"""
+    enhanced_items = catalog_service.enhanced_items
     
     existing_count = await db.enhanced_protocol_library.count_documents({})
     if existing_count > 0:
@@ -627,7 +582,7 @@ async def initialize_enhanced_protocol_library():
         existing_names = await db.enhanced_protocol_library.distinct("name")
         new_protocols = []
         
-        for peptide_data in ENHANCED_CLINICAL_PEPTIDES:
+        for peptide_data in enhanced_items:
             if peptide_data["name"] not in existing_names:
                 new_protocols.append(peptide_data)
         
@@ -641,11 +596,11 @@ async def initialize_enhanced_protocol_library():
         return
 
     # Add enhanced clinical peptides
-    for peptide_data in ENHANCED_CLINICAL_PEPTIDES:
+    for peptide_data in enhanced_items:
         peptide = AdvancedProtocolLibraryItem(**peptide_data)
         await db.enhanced_protocol_library.insert_one(peptide.dict())
     
-    logging.info(f"Enhanced protocol library initialized with {len(ENHANCED_CLINICAL_PEPTIDES)} comprehensive peptides")
+    logging.info(f"Enhanced protocol library initialized with {len(enhanced_items)} comprehensive peptides")
 
 # API Endpoints
 @api_router.post("/generate-protocol-pdf")
@@ -988,7 +943,8 @@ async def chat_with_dr_peptide(chat_message: ChatMessage):
     try:
         response = await dr_peptide_ai.chat_with_dr_peptide(
             chat_message.message,
-            chat_message.conversation_history
+            chat_message.conversation_history,
+            conversation_id=chat_message.conversation_id
         )
         return response
     except Exception as e:
@@ -999,6 +955,60 @@ async def chat_with_dr_peptide(chat_message: ChatMessage):
             "response": "I apologize, but I'm experiencing technical difficulties. Please try again in a moment."
         }
 
+@api_router.post("/dr-peptide/chat/stream")
+async def stream_chat_with_dr_peptide(chat_message: ChatMessage):
+    """Chat with Dr. Peptide as server-sent events: start, token chunks, then done with protocol metadata"""
+    
+    if not chat_message.message or chat_message.message.strip() == "":
+        raise HTTPException(status_code=400, detail="Message is required and cannot be empty")
+    
+    if len(chat_message.message.strip()) < 3:
+        raise HTTPException(status_code=400, detail="Message must be at least 3 characters long")
+    
+    async def event_stream():
+        async for event in dr_peptide_ai.stream_chat_with_dr_peptide(
+            chat_message.message,
+            chat_message.conversation_history,
+            conversation_id=chat_message.conversation_id
+        ):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Keep reverse proxies from buffering the stream
+        }
+    )
+
+@api_router.get("/dr-peptide/cache/stats")
+async def get_dr_peptide_cache_stats():
+    """Hit/miss metrics for the Dr. Peptide response cache and catalog-answered questions"""
+    return {
+        "success": True,
+        "cache": llm_response_cache.get_stats(),
+        "sessions": dr_peptide_ai.session_pool.get_stats(),
+        "local_answers": dr_peptide_ai.local_answers.get_stats()
+    }
+
+@api_router.get("/llm/admission/stats")
+async def get_llm_admission_stats():
+    """Per-provider concurrency, queue depth and wait times, gateway latency and breaker state, plus coalesced protocol generations"""
+    return {
+        "success": True,
+        "providers": llm_admission.get_stats(),
+        "gateway": llm_gateway.get_stats(),
+        "protocol_generation": protocol_generation_flight.get_stats()
+    }
+
+@api_router.get("/llm/metrics")
+async def get_llm_metrics(format: str = "json"):
+    """Calls, tokens, cache hits, estimated cost and latency/TTFT percentiles per endpoint, provider, model and kind"""
+    if format == "prometheus":
+        return Response(content=llm_metrics.prometheus(), media_type="text/plain; version=0.0.4")
+    return {"success": True, "series": llm_metrics.get_stats(), "replay": llm_replay.get_stats()}
+
 @api_router.post("/dr-peptide/analyze-case")
 async def dr_peptide_case_analysis(assessment_id: str):
     """Get Dr. Peptide's analysis of a patient case"""
@@ -1181,10 +1191,8 @@ async def upload_assessment_files(assessment_id: str, files: List[UploadFile] =
         raise HTTPException(status_code=500, detail=f"File processing failed: {str(e)}")
 
 # Enhanced Protocol Generation
-@api_router.post("/generate-functional-protocol/{assessment_id}")
-async def generate_functional_medicine_protocol_endpoint(assessment_id: str):
-    """Generate comprehensive functional medicine protocol"""
-    
+async def _load_assessment_for_generation(assessment_id: str) -> Dict[str, Any]:
+    """Validate the assessment id and load an assessment complete enough to generate a protocol from"""
     # ✅ ENHANCED VALIDATION: Check assessment_id format
     if not assessment_id or len(assessment_id.strip()) == 0:
         raise HTTPException(status_code=400, detail="Assessment ID is required and cannot be empty")
@@ -1227,6 +1235,23 @@ async def generate_functional_medicine_protocol_endpoint(assessment_id: str):
     if "_id" in assessment_data:
         del assessment_data["_id"]
     
+    return assessment_data
+
+@api_router.post("/generate-functional-protocol/{assessment_id}")
+async def generate_functional_medicine_protocol_endpoint(assessment_id: str):
+    """Generate comprehensive functional medicine protocol"""
+    
+    assessment_data = await _load_assessment_for_generation(assessment_id)
+    
+    # Double-clicks and client retries join the generation already running for this assessment version
+    flight_key = ("functional", assessment_id, content_hash(assessment_data))
+    with deadline_scope(PROTOCOL_REQUEST_BUDGET_SECONDS):
+        return await protocol_generation_flight.do(
+            flight_key, lambda: _generate_functional_protocol(assessment_id, assessment_data)
+        )
+
+async def _generate_functional_protocol(assessment_id: str, assessment_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the protocol pipeline for a validated assessment and save the result"""
     try:
         # Create assessment with defaults for missing fields and empty strings
         assessment_with_defaults = {
@@ -1260,6 +1285,7 @@ async def generate_functional_medicine_protocol_endpoint(assessment_id: str):
             protocol_data["last_updated"] = protocol_data["last_updated"].isoformat()
         
         # ✅ CRITICAL FIX: Save protocol to database with progress tracking integration
+        await report_stage("saving")
         try:
             # Prepare protocol record for database
             protocol_record = {
@@ -1276,10 +1302,23 @@ async def generate_functional_medicine_protocol_endpoint(assessment_id: str):
             }
             
             # Save protocol to database
-            await db.patient_protocols.insert_one(protocol_record)
+            job_id = current_job_id()
+            if job_id:
+                # A job re-run after a lost lease keeps the protocol the first run saved
+                from pymongo import ReturnDocument
+                saved = await db.patient_protocols.find_one_and_update(
+                    {"job_id": job_id},
+                    {"$setOnInsert": {**protocol_record, "job_id": job_id}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                protocol_id, protocol_data = saved["protocol_id"], saved["protocol_data"]
+            else:
+                await db.patient_protocols.insert_one(protocol_record)
             logger.info(f"Protocol {protocol_id} saved successfully to database")
             
             # ✅ CREATE PROGRESS TRACKING automatically
+            await report_stage("progress_tracking")
             initial_metrics = {
                 "energy_levels": 5,  # Default starting values
                 "sleep_quality": 5,
@@ -1325,6 +1364,8 @@ async def generate_functional_medicine_protocol_endpoint(assessment_id: str):
             "tracking_id": tracking_result.get("tracking_id") if 'tracking_result' in locals() else None
         }
         
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Protocol generation error: {str(e)}")
         raise HTTPException(
@@ -1332,37 +1373,104 @@ async def generate_functional_medicine_protocol_endpoint(assessment_id: str):
             detail=f"Failed to generate protocol: {str(e)}"
         )
 
+# Protocol Generation Jobs
+FUNCTIONAL_PROTOCOL_STAGES = [
+    "loading_assessment", "risk_analysis", "ai_recommendations", "personalized_dosing",
+    "protocol_structure", "saving", "progress_tracking"
+]
+
+async def run_functional_protocol_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker side of a queued functional protocol generation"""
+    await report_stage("loading_assessment")
+    assessment_id = payload["assessment_id"]
+    with deadline_scope(PROTOCOL_JOB_BUDGET_SECONDS):
+        assessment_data = await _load_assessment_for_generation(assessment_id)
+        return await _generate_functional_protocol(assessment_id, assessment_data)
+
+protocol_job_queue.register("functional_protocol", run_functional_protocol_job, FUNCTIONAL_PROTOCOL_STAGES)
+
+@api_router.post("/protocol-jobs/functional/{assessment_id}", status_code=202)
+async def enqueue_functional_protocol_job(assessment_id: str):
+    """Queue functional protocol generation; follow it at status_url (polling) or events_url (SSE)"""
+    assessment_data = await _load_assessment_for_generation(assessment_id)
+    
+    try:
+        # Repeated submissions for the same assessment version join the active job
+        job = await protocol_job_queue.enqueue(
+            "functional_protocol",
+            {"assessment_id": assessment_id},
+            dedupe_key=f"{assessment_id}:{content_hash(assessment_data)}"
+        )
+    except Exception as e:
+        logger.error(f"Could not queue protocol generation for {assessment_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to queue protocol generation")
+    
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stages": job["stages"],
+        "status_url": f"/api/protocol-jobs/{job['id']}",
+        "events_url": f"/api/protocol-jobs/{job['id']}/events"
+    }
+
+@api_router.get("/protocol-jobs/{job_id}")
+async def get_protocol_job(job_id: str):
+    """Job status, stage-by-stage progress and, once succeeded, the generated protocol"""
+    job = await protocol_job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Protocol job not found")
+    return job
+
+@api_router.get("/protocol-jobs/{job_id}/events")
+async def stream_protocol_job_events(job_id: str):
+    """Job progress as server-sent events: one 'progress' event per stage change, then 'done'"""
+    if not await protocol_job_queue.get(job_id):
+        raise HTTPException(status_code=404, detail="Protocol job not found")
+    
+    async def event_stream():
+        async for job in protocol_job_queue.watch(job_id):
+            event = "done" if job["status"] in ("succeeded", "failed") else "progress"
+            yield f"event: {event}\ndata: {json.dumps(job, default=str)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Keep reverse proxies from buffering the stream
+        }
+    )
+
+def parse_fields_param(projection, fields: Optional[str], extra: tuple = ()) -> Optional[tuple]:
+    """Validate a ?fields= sparse fieldset against a catalog projection (400 on unknown fields)"""
+    try:
+        return projection.parse_fields(fields, extra=extra)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # Enhanced Protocol Library Endpoints
 @api_router.get("/enhanced-library", response_model=List[AdvancedProtocolLibraryItem])
-async def get_enhanced_protocol_library(category: Optional[str] = None, search: Optional[str] = None):
-    """Get enhanced clinical protocol library"""
-    
-    query = {}
-    if category:
-        query["category"] = category
-    if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"aliases": {"$regex": search, "$options": "i"}},
-            {"mechanism_of_action": {"$regex": search, "$options": "i"}},
-            {"clinical_indications": {"$regex": search, "$options": "i"}}
-        ]
-    
-    library_items = await db.enhanced_protocol_library.find(query).to_list(1000)
-    return [AdvancedProtocolLibraryItem(**item) for item in library_items]
+async def get_enhanced_protocol_library(category: Optional[str] = None, search: Optional[str] = None, fields: Optional[str] = None):
+    """Get enhanced clinical protocol library (fields=name,category,... returns only those fields)"""
+    field_list = parse_fields_param(catalog_service.enhanced_field_views, fields)
+    items = catalog_service.get_enhanced_library(category=category, search=search, fields=field_list)
+    if field_list:
+        # Partial documents do not satisfy the full response model
+        return JSONResponse(content=items)
+    return items
 
 @api_router.get("/enhanced-library/categories")
 async def get_enhanced_library_categories():
     """Get all available categories in enhanced library"""
-    
-    categories = await db.enhanced_protocol_library.distinct("category")
-    return {"categories": categories}
+    return {"categories": catalog_service.enhanced_categories}
 
 @api_router.get("/enhanced-library/{peptide_id}", response_model=AdvancedProtocolLibraryItem)
 async def get_enhanced_peptide_details(peptide_id: str):
     """Get comprehensive peptide information"""
-    
-    peptide_data = await db.enhanced_protocol_library.find_one({"id": peptide_id})
+    peptide_data = catalog_service.get_enhanced_protocol(peptide_id)
+    if not peptide_data:
+        # IDs handed out before the catalog moved in-memory only exist in Mongo
+        peptide_data = await db.enhanced_protocol_library.find_one({"id": peptide_id})
     if not peptide_data:
         raise HTTPException(status_code=404, detail="Peptide not found in enhanced library")
     
@@ -1606,20 +1714,24 @@ async def search_protocol_library(
     query: Optional[str] = None,
     category: Optional[str] = None,
     tags: Optional[str] = None,
-    limit: int = 50
+    limit: int = 50,
+    fields: Optional[str] = None
 ):
     """Advanced protocol search with filters and ranking"""
+    field_list = parse_fields_param(master_protocol_manager.field_views, fields, extra=('search_score',))
     try:
         # Parse tags if provided
         tag_list = tags.split(',') if tags else None
         
         # Search protocols
-        results = master_protocol_manager.search_protocols(
+        search_results = master_protocol_manager.search(
             query=query,
             category=category,
             tags=tag_list,
-            limit=limit
+            limit=limit,
+            fields=field_list
         )
+        results = search_results["protocols"]
         
         return {
             "success": True,
@@ -1627,7 +1739,9 @@ async def search_protocol_library(
             "category": category,
             "tags": tag_list,
             "total_results": len(results),
+            "total_matches": search_results["total_matches"],
             "protocols": results,
+            "facet_counts": search_results["facet_counts"],
             "available_categories": master_protocol_manager.get_categories(),
             "available_tags": master_protocol_manager.get_all_tags()
         }
@@ -1636,28 +1750,77 @@ async def search_protocol_library(
         logging.error(f"Protocol search error: {e}")
         raise HTTPException(status_code=500, detail="Search failed")
 
+@api_router.get("/protocols/library/suggest")
+async def suggest_protocol_library(q: str = "", limit: int = 8):
+    """Typeahead suggestions for the protocol search box (id, name and category only)"""
+    try:
+        limit = max(1, min(limit, 25))
+        suggestions = master_protocol_manager.suggest(q, limit=limit)
+        
+        return {
+            "success": True,
+            "query": q,
+            "suggestions": suggestions["protocols"],
+            "categories": suggestions["categories"],
+            "tags": suggestions["tags"]
+        }
+        
+    except Exception as e:
+        logging.error(f"Protocol suggest error: {e}")
+        raise HTTPException(status_code=500, detail="Suggest failed")
+
+@api_router.get("/protocols/library/changes")
+async def get_protocol_library_changes(request: Request, since_version: str = '', fields: Optional[str] = None):
+    """Delta sync: protocols added, changed and removed since the client's catalog version token"""
+    field_list = parse_fields_param(master_protocol_manager.field_views, fields)
+    try:
+        current_version = master_protocol_manager.catalog_version
+        
+        def build_changes():
+            changes = master_protocol_manager.changes_since(since_version, field_list)
+            if changes is None:
+                # Version this host has no snapshot for: the client must page through /library/all again
+                return {
+                    "success": True,
+                    "full_sync_required": True,
+                    "from_version": since_version,
+                    "to_version": current_version
+                }
+            return {
+                "success": True,
+                "full_sync_required": False,
+                "up_to_date": since_version == current_version,
+                **changes
+            }
+        
+        return await catalog_responses.respond(request, (current_version, 'protocol_changes', since_version, field_list), build_changes)
+        
+    except Exception as e:
+        logging.error(f"Library changes error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to compute library changes")
+
 @api_router.get("/protocols/library/categories")
-async def get_protocol_categories():
+async def get_protocol_categories(request: Request):
     """Get all available protocol categories"""
     try:
-        return {
+        return await catalog_responses.respond(request, (catalog_service.catalog_version, 'protocol_categories'), lambda: {
             "success": True,
             "categories": master_protocol_manager.get_categories(),
             "total_categories": len(master_protocol_manager.get_categories())
-        }
+        })
     except Exception as e:
         logging.error(f"Categories fetch error: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch categories")
 
 @api_router.get("/protocols/library/tags")
-async def get_protocol_tags():
+async def get_protocol_tags(request: Request):
     """Get all available protocol tags"""
     try:
-        return {
+        return await catalog_responses.respond(request, (catalog_service.catalog_version, 'protocol_tags'), lambda: {
             "success": True,
             "tags": master_protocol_manager.get_all_tags(),
             "total_tags": len(master_protocol_manager.get_all_tags())
-        }
+        })
     except Exception as e:
         logging.error(f"Tags fetch error: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch tags")
@@ -1681,6 +1844,24 @@ async def get_library_stats():
         logging.error(f"Stats fetch error: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch stats")
 
+@api_router.post("/protocols/batch")
+async def get_protocols_batch(request: ProtocolBatchRequest):
+    """Fetch many protocols by id and/or name in one call (optional field projection)"""
+    if len(request.ids) + len(request.names) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch requests are limited to {MAX_BATCH_SIZE} ids and names")
+    field_list = parse_fields_param(master_protocol_manager.field_views, ','.join(request.fields or []))
+    try:
+        result = catalog_service.get_protocols_batch(request.ids, request.names, field_list)
+        return {
+            "success": True,
+            "protocols": result["protocols"],
+            "not_found": result["not_found"],
+            "total_found": len(result["protocols"])
+        }
+    except Exception as e:
+        logging.error(f"Protocol batch fetch error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch protocols")
+
 @api_router.get("/protocols/{protocol_id}")
 async def get_protocol_details(protocol_id: str):
     """Get detailed information for a specific protocol"""
@@ -1732,19 +1913,22 @@ async def download_protocol_pdf(protocol_id: str):
         raise HTTPException(status_code=500, detail="Failed to generate PDF")
 
 @api_router.get("/protocols/library/all")
-async def get_all_protocols(limit: int = 100, offset: int = 0):
-    """Get all protocols with pagination"""
+async def get_all_protocols(request: Request, limit: int = Query(100, ge=1, le=500), offset: int = Query(0, ge=0),
+                            fields: Optional[str] = None):
+    """Get all protocols with pagination (fields=name,category,... returns only those fields)"""
+    field_list = parse_fields_param(master_protocol_manager.field_views, fields)
     try:
-        all_protocols = master_protocol_manager.all_protocols[offset:offset + limit]
+        def build_page():
+            return {
+                "success": True,
+                "protocols": master_protocol_manager.page(offset, limit, field_list),
+                "total_protocols": len(master_protocol_manager.all_protocols),
+                "limit": limit,
+                "offset": offset,
+                "has_more": offset + limit < len(master_protocol_manager.all_protocols)
+            }
         
-        return {
-            "success": True,
-            "protocols": all_protocols,
-            "total_protocols": len(master_protocol_manager.all_protocols),
-            "limit": limit,
-            "offset": offset,
-            "has_more": offset + limit < len(master_protocol_manager.all_protocols)
-        }
+        return await catalog_responses.respond(request, (catalog_service.catalog_version, 'protocols_all', limit, offset, field_list), build_page)
         
     except Exception as e:
         logging.error(f"All protocols fetch error: {e}")
@@ -1759,36 +1943,56 @@ async def create_basic_assessment(assessment_data: Dict[str, Any]):
     return assessment
 
 @api_router.get("/peptides", response_model=List[Dict[str, Any]])
-async def get_comprehensive_peptides():
+async def get_comprehensive_peptides(request: Request, fields: Optional[str] = None):
     """Get comprehensive peptides database with detailed clinical information"""
-    return COMPREHENSIVE_PEPTIDES_DATABASE
+    field_list = parse_fields_param(catalog_service.reference_field_views, fields)
+    return await catalog_responses.respond(
+        request,
+        (catalog_service.catalog_version, 'peptides', field_list),
+        lambda: catalog_service.get_reference_peptides(field_list)
+    )
 
 @api_router.get("/peptides/categories")
 async def get_peptide_categories():
     """Get all available peptide categories"""
     try:
-        return {"categories": EXPANDED_PEPTIDE_CATEGORIES}
+        return {"categories": catalog_service.reference_categories}
     except Exception as e:
         logger.error(f"Error getting peptide categories: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/peptides/batch")
+async def get_peptides_batch(request: PeptideBatchRequest):
+    """Fetch many reference peptides by name in one call (optional field projection)"""
+    if len(request.names) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch requests are limited to {MAX_BATCH_SIZE} names")
+    field_list = parse_fields_param(catalog_service.reference_field_views, ','.join(request.fields or []))
+    try:
+        result = catalog_service.get_peptides_batch(request.names, field_list)
+        return {
+            "success": True,
+            "peptides": result["peptides"],
+            "not_found": result["not_found"],
+            "total_found": len(result["peptides"])
+        }
+    except Exception as e:
+        logging.error(f"Peptide batch fetch error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch peptides")
+
 @api_router.get("/peptides/{peptide_name}")
 async def get_peptide_by_name(peptide_name: str):
     """Get detailed information for a specific peptide"""
     # Find peptide by name (case insensitive)
-    for peptide in COMPREHENSIVE_PEPTIDES_DATABASE:
-        if peptide["name"].lower() == peptide_name.lower():
-            return peptide
+    peptide = catalog_service.get_reference_peptide(peptide_name)
+    if peptide:
+        return peptide
     
     raise HTTPException(status_code=404, detail=f"Peptide '{peptide_name}' not found")
 
 @api_router.get("/peptides/category/{category}")
 async def get_peptides_by_category(category: str):
     """Get peptides filtered by category"""
-    filtered_peptides = [
-        peptide for peptide in COMPREHENSIVE_PEPTIDES_DATABASE
-        if peptide["category"].lower() == category.lower()
-    ]
+    filtered_peptides = catalog_service.get_reference_by_category(category)
     
     if not filtered_peptides:
         raise HTTPException(status_code=404, detail=f"No peptides found in category '{category}'")
@@ -1798,27 +2002,7 @@ async def get_peptides_by_category(category: str):
 @api_router.get("/library", response_model=List[Dict[str, Any]])
 async def get_basic_library():
     """Get basic library for backward compatibility"""
-    # Return basic format from enhanced library
-    enhanced_items = await db.enhanced_protocol_library.find({}).to_list(1000)
-    
-    basic_items = []
-    for item in enhanced_items:
-        basic_item = {
-            "id": item["id"],
-            "name": item["name"],
-            "category": item["category"],
-            "mechanism": item["mechanism_of_action"][:200] + "..." if len(item["mechanism_of_action"]) > 200 else item["mechanism_of_action"],
-            "indications": item["clinical_indications"][:5],  # Limit for compatibility
-            "standard_dosing": item["complete_dosing_schedule"],
-            "administration": item["administration_techniques"].get("injection_sites", "See detailed protocols"),
-            "contraindications": item["contraindications_and_precautions"].get("absolute_contraindications", []),
-            "side_effects": [effect["effect"] for effect in item["safety_profile"].get("common_side_effects", [])],
-            "monitoring": item["monitoring_requirements"].get("ongoing_monitoring", []),
-            "references": [ref.get("title", "") for ref in item["scientific_references"][:3]]
-        }
-        basic_items.append(basic_item)
-    
-    return basic_items
+    return catalog_service.get_basic_library()
 
 # Email Integration Endpoints
 @api_router.post("/email/send-protocol")
@@ -2722,112 +2906,155 @@ async def generate_enhanced_protocol_with_intelligence(assessment_id: str):
         if not assessment_data:
             raise HTTPException(status_code=404, detail=f"Patient assessment with ID {assessment_id} not found")
         
-        # Generate base protocol first
-        base_protocol_response = await generate_functional_medicine_protocol_endpoint(assessment_id)
-        base_protocol = base_protocol_response.get("protocol", {})
-        
-        if not base_protocol:
-            raise HTTPException(status_code=500, detail="Failed to generate base protocol")
-        
-        # Enhance with clinical intelligence
-        intelligence_enhancements = {}
-        
-        # 1. Predictive Analytics
-        try:
-            prediction_result = predictive_analytics_service.generate_outcome_prediction(
-                patient_data=assessment_data,
-                peptides=base_protocol.get("recommended_peptides", [])
-            )
-            intelligence_enhancements["predictive_analytics"] = prediction_result
-        except Exception as e:
-            logger.warning(f"Predictive analytics failed: {e}")
-        
-        # 2. Risk Stratification  
-        try:
-            risk_result = predictive_analytics_service.calculate_risk_stratification(
-                patient_data=assessment_data,
-                peptides=base_protocol.get("recommended_peptides", [])
-            )
-            intelligence_enhancements["risk_stratification"] = risk_result
-        except Exception as e:
-            logger.warning(f"Risk stratification failed: {e}")
-        
-        # 3. Clinical Reasoning
-        try:
-            reasoning_result = advanced_practitioner_tools.generate_clinical_reasoning(
-                patient_data=assessment_data,
-                assessment_data=base_protocol
-            )
-            intelligence_enhancements["clinical_reasoning"] = reasoning_result
-        except Exception as e:
-            logger.warning(f"Clinical reasoning failed: {e}")
-        
-        # 4. Safety Analysis
-        try:
-            safety_result = safety_quality_assurance.execute_multi_layer_safety_check(
-                patient_data=assessment_data,
-                protocol_data=base_protocol
-            )
-            intelligence_enhancements["safety_analysis"] = safety_result
-        except Exception as e:
-            logger.warning(f"Safety analysis failed: {e}")
-        
-        # 5. Quality Score
-        try:
-            quality_result = safety_quality_assurance.calculate_protocol_quality_score(
-                patient_data=assessment_data,
-                protocol_data=base_protocol
-            )
-            intelligence_enhancements["quality_assessment"] = quality_result
-        except Exception as e:
-            logger.warning(f"Quality assessment failed: {e}")
-        
-        # 6. Practice Integration
-        try:
-            practice_result = advanced_practitioner_tools.generate_practice_integration_data(
-                patient_data=assessment_data,
-                protocol_data=base_protocol
-            )
-            intelligence_enhancements["practice_integration"] = practice_result
-        except Exception as e:
-            logger.warning(f"Practice integration failed: {e}")
-        
-        # 7. Patient Education
-        try:
-            education_result = advanced_practitioner_tools.generate_patient_education_plan(
-                patient_data=assessment_data,
-                protocol_data=base_protocol
-            )
-            intelligence_enhancements["patient_education"] = education_result
-        except Exception as e:
-            logger.warning(f"Patient education failed: {e}")
-        
-        return {
-            "message": "Enhanced protocol with clinical intelligence generated successfully",
-            "protocol_id": base_protocol.get("protocol_id"),
-            "base_protocol": base_protocol,
-            "clinical_intelligence": intelligence_enhancements,
-            "enhancement_summary": {
-                "predictive_success": "predictive_analytics" in intelligence_enhancements,
-                "risk_assessment_success": "risk_stratification" in intelligence_enhancements,
-                "clinical_reasoning_success": "clinical_reasoning" in intelligence_enhancements,
-                "safety_analysis_success": "safety_analysis" in intelligence_enhancements,
-                "quality_score_success": "quality_assessment" in intelligence_enhancements,
-                "practice_integration_success": "practice_integration" in intelligence_enhancements,
-                "patient_education_success": "patient_education" in intelligence_enhancements
-            },
-            "generated_at": datetime.utcnow().isoformat()
-        }
+        # Double-clicks and client retries join the run already in flight for this assessment version
+        flight_key = ("enhanced", assessment_id, content_hash(assessment_data, exclude=("_id",)))
+        return await protocol_generation_flight.do(
+            flight_key, lambda: _enhance_protocol_with_intelligence(assessment_id, assessment_data)
+        )
         
-    except HTTPException:
+    except (HTTPException, AdmissionRejected):
         raise
     except Exception as e:
         logger.error(f"Error generating enhanced protocol: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate enhanced protocol: {str(e)}")
 
+async def _enhance_protocol_with_intelligence(assessment_id: str, assessment_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Base protocol plus the clinical intelligence suite for a loaded assessment"""
+    # Generate base protocol first
+    base_protocol_response = await generate_functional_medicine_protocol_endpoint(assessment_id)
+    base_protocol = base_protocol_response.get("protocol", {})
+    
+    if not base_protocol:
+        raise HTTPException(status_code=500, detail="Failed to generate base protocol")
+    
+    # Enhance with clinical intelligence
+    intelligence_enhancements = {}
+    
+    # 1. Predictive Analytics
+    try:
+        prediction_result = predictive_analytics_service.generate_outcome_prediction(
+            patient_data=assessment_data,
+            peptides=base_protocol.get("recommended_peptides", [])
+        )
+        intelligence_enhancements["predictive_analytics"] = prediction_result
+    except Exception as e:
+        logger.warning(f"Predictive analytics failed: {e}")
+    
+    # 2. Risk Stratification  
+    try:
+        risk_result = predictive_analytics_service.calculate_risk_stratification(
+            patient_data=assessment_data,
+            peptides=base_protocol.get("recommended_peptides", [])
+        )
+        intelligence_enhancements["risk_stratification"] = risk_result
+    except Exception as e:
+        logger.warning(f"Risk stratification failed: {e}")
+    
+    # 3. Clinical Reasoning
+    try:
+        reasoning_result = advanced_practitioner_tools.generate_clinical_reasoning(
+            patient_data=assessment_data,
+            assessment_data=base_protocol
+        )
+        intelligence_enhancements["clinical_reasoning"] = reasoning_result
+    except Exception as e:
+        logger.warning(f"Clinical reasoning failed: {e}")
+    
+    # 4. Safety Analysis
+    try:
+        safety_result = safety_quality_assurance.execute_multi_layer_safety_check(
+            patient_data=assessment_data,
+            protocol_data=base_protocol
+        )
+        intelligence_enhancements["safety_analysis"] = safety_result
+    except Exception as e:
+        logger.warning(f"Safety analysis failed: {e}")
+    
+    # 5. Quality Score
+    try:
+        quality_result = safety_quality_assurance.calculate_protocol_quality_score(
+            patient_data=assessment_data,
+            protocol_data=base_protocol
+        )
+        intelligence_enhancements["quality_assessment"] = quality_result
+    except Exception as e:
+        logger.warning(f"Quality assessment failed: {e}")
+    
+    # 6. Practice Integration
+    try:
+        practice_result = advanced_practitioner_tools.generate_practice_integration_data(
+            patient_data=assessment_data,
+            protocol_data=base_protocol
+        )
+        intelligence_enhancements["practice_integration"] = practice_result
+    except Exception as e:
+        logger.warning(f"Practice integration failed: {e}")
+    
+    # 7. Patient Education
+    try:
+        education_result = advanced_practitioner_tools.generate_patient_education_plan(
+            patient_data=assessment_data,
+            protocol_data=base_protocol
+        )
+        intelligence_enhancements["patient_education"] = education_result
+    except Exception as e:
+        logger.warning(f"Patient education failed: {e}")
+    
+    return {
+        "message": "Enhanced protocol with clinical intelligence generated successfully",
+        "protocol_id": base_protocol.get("protocol_id"),
+        "base_protocol": base_protocol,
+        "clinical_intelligence": intelligence_enhancements,
+        "enhancement_summary": {
+            "predictive_success": "predictive_analytics" in intelligence_enhancements,
+            "risk_assessment_success": "risk_stratification" in intelligence_enhancements,
+            "clinical_reasoning_success": "clinical_reasoning" in intelligence_enhancements,
+            "safety_analysis_success": "safety_analysis" in intelligence_enhancements,
+            "quality_score_success": "quality_assessment" in intelligence_enhancements,
+            "practice_integration_success": "practice_integration" in intelligence_enhancements,
+            "patient_education_success": "patient_education" in intelligence_enhancements
+        },
+        "generated_at": datetime.utcnow().isoformat()
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """LLM provider at capacity: ask the client to retry instead of failing outright"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Per-request LLM breakdown headers, on request (X-Debug-LLM: 1) or for every response
+LLM_DEBUG_HEADERS = os.environ.get('LLM_DEBUG_HEADERS', '').lower() in ('1', 'true', 'yes')
+
+def _route_label(scope: Dict[str, Any]) -> str:
+    """Route template (e.g. 'POST /api/dr-peptide/chat') so metrics are not split per path parameter"""
+    from starlette.routing import Match
+    label = scope.get("llm_endpoint_label")
+    if label is None:
+        label = f"{scope['method']} {scope['path']}"
+        for route in app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                label = f"{scope['method']} {route.path}"
+                break
+        scope["llm_endpoint_label"] = label
+    return label
+
+@app.middleware("http")
+async def llm_metrics_middleware(request: Request, call_next):
+    """Attribute LLM calls to the route that made them and optionally report them in headers"""
+    with endpoint_scope(lambda: _route_label(request.scope)):
+        response = await call_next(request)
+        if LLM_DEBUG_HEADERS or request.headers.get("x-debug-llm") == "1":
+            response.headers.update(debug_headers(request_calls()))
+    return response
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -2847,8 +3074,19 @@ logger = logging.getLogger(__name__)
 async def startup_event():
     """Initialize enhanced protocol library on startup"""
     await initialize_enhanced_protocol_library()
+    if os.environ.get('LLM_CACHE_MONGO_ENABLED', '').lower() in ('1', 'true', 'yes'):
+        # Share cached Dr. Peptide answers across workers
+        llm_response_cache.attach_shared_tier(db.llm_response_cache)
+    try:
+        # One saved protocol per generation job, however often the job is re-run
+        await db.patient_protocols.create_index("job_id", unique=True, sparse=True)
+    except Exception as e:
+        logging.warning(f"Could not create patient_protocols job_id index: {e}")
+    protocol_job_queue.start(DEFAULT_WORKERS)
+    import_timer.log_report()
     logging.info("PeptideProtocols.ai - Ultimate Practitioner Resource initialized")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await protocol_job_queue.stop()
     client.close()
\ No newline at end of file
@@ -0,0 +1,290 @@
+"""
+Structured Output - Schema-constrained JSON answers from a single LLM call
+Prompts carry a compact JSON Schema; answers are parsed locally, near-valid JSON (code fences,
+trailing commas, comments, Python literals, single quotes, truncation at max tokens) is
+repaired, then values are coerced and validated against the schema - no second LLM round trip
+"""
+
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null',
+             'True': 'true', 'False': 'false', 'None': 'null', 'NaN': 'null', 'Infinity': 'null'}
+_CLOSERS = {'{': '}', '[': ']'}
+_QUOTES = {'"': '"', "'": "'", '“': '”'}
+# A number token, exponent included; lenient about the sign, leading and trailing dots and a cut-off exponent
+_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?:[eE][-+]?)?')
+_JSON_ESCAPES = set('"\\/bfnrtu')
+
+
+@dataclass
+class StructuredResult:
+    """Parsed answer plus what it took to get there"""
+    data: Any
+    errors: List[str] = field(default_factory=list)
+    repaired: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.data is not None and not self.errors
+
+
+def schema_instructions(schema: Dict[str, Any]) -> str:
+    """Prompt suffix asking for JSON only, in the schema's shape"""
+    return (
+        "Respond with a single JSON object only - no markdown, no commentary - matching this JSON Schema:\n"
+        + json.dumps(schema, separators=(',', ':'))
+    )
+
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort rewrite of near-valid JSON into valid JSON: takes the first object or array
+    in text, drops comments and trailing commas, quotes bare keys, maps Python literals,
+    converts single/curly-quoted strings and closes whatever truncation left open
+    """
+    starts = [index for index in (text.find('{'), text.find('[')) if index >= 0]
+    if not starts:
+        return text
+    out: List[str] = []
+    # Per open bracket: [bracket, expecting_key, start of the current key in out]
+    stack: List[List[Any]] = []
+    awaiting_value = False
+    index, length = min(starts), len(text)
+
+    while index < length:
+        char = text[index]
+
+        if char in _QUOTES:
+            closing = _QUOTES[char]
+            is_key = bool(stack) and stack[-1][0] == '{' and stack[-1][1]
+            if is_key:
+                stack[-1][2] = len(out)
+            awaiting_value = False
+            out.append('"')
+            index += 1
+            closed = False
+            while index < length:
+                char = text[index]
+                if char == '\\' and index + 1 < length:
+                    escaped = text[index + 1]
+                    if escaped in _JSON_ESCAPES:
+                        out.append(char + escaped)
+                    elif escaped == "'":
+                        # Python/JS escape inside a single-quoted string; needs none in JSON
+                        out.append(escaped)
+                    else:
+                        out.append('\\\\' + escaped)
+                    index += 2
+                    continue
+                if char == closing:
+                    closed = True
+                    index += 1
+                    break
+                out.append({'"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'}.get(char, char))
+                index += 1
+            out.append('"')
+            if not closed:
+                break
+            continue
+
+        if char == '/' and text.startswith('//', index):
+            newline = text.find('\n', index)
+            index = length if newline < 0 else newline
+            continue
+        if char == '/' and text.startswith('/*', index):
+            end = text.find('*/', index + 2)
+            index = length if end < 0 else end + 2
+            continue
+
+        if char in '{[':
+            awaiting_value = False
+            stack.append([char, char == '{', None])
+            out.append(char)
+        elif char in '}]':
+            _drop_trailing_comma(out)
+            if awaiting_value:
+                _drop_dangling_key(out, stack)
+                awaiting_value = False
+            while stack and _CLOSERS[stack[-1][0]] != char:
+                out.append(_CLOSERS[stack.pop()[0]])
+            if stack:
+                stack.pop()
+                out.append(char)
+            if not stack:
+                break
+        elif char == ':':
+            if stack and stack[-1][0] == '{':
+                stack[-1][1] = False
+            awaiting_value = True
+            out.append(char)
+        elif char == ',':
+            if stack and stack[-1][0] == '{':
+                stack[-1][1] = True
+                stack[-1][2] = None
+            out.append(char)
+        elif (char.isdigit() or char in '-+.') and _NUMBER.match(text, index):
+            end = _NUMBER.match(text, index).end()
+            bare = end < length and (text[end].isalpha() or text[end] == '_')
+            if bare:
+                # "5mg", "2x": a bare string that starts with digits
+                while end < length and (text[end].isalnum() or text[end] == '_'):
+                    end += 1
+            if stack and stack[-1][0] == '{' and stack[-1][1]:
+                stack[-1][2] = len(out)
+                out.append(json.dumps(text[index:end]))
+            else:
+                out.append(json.dumps(text[index:end]) if bare else _json_number(text[index:end]))
+            awaiting_value = False
+            index = end
+            continue
+        elif char.isalpha() or char == '_':
+            end = index
+            while end < length and (text[end].isalnum() or text[end] == '_'):
+                end += 1
+            word = text[index:end]
+            if stack and stack[-1][0] == '{' and stack[-1][1]:
+                stack[-1][2] = len(out)
+                out.append(json.dumps(word))
+            else:
+                out.append(_LITERALS.get(word, json.dumps(word)))
+            awaiting_value = False
+            index = end
+            continue
+        else:
+            if not char.isspace():
+                awaiting_value = False
+            out.append(char)
+        index += 1
+
+    # Truncated answer: drop a dangling comma or key, then close what is still open
+    _drop_trailing_comma(out)
+    if awaiting_value or (stack and stack[-1][0] == '{' and stack[-1][1] and stack[-1][2] is not None
+                          and ''.join(out[stack[-1][2]:]).rstrip().endswith('"')):
+        _drop_dangling_key(out, stack)
+    while stack:
+        _drop_trailing_comma(out)
+        out.append(_CLOSERS[stack.pop()[0]])
+    return ''.join(out)
+
+
+def _json_number(token: str) -> str:
+    """'+.5' -> '0.5', '5.' -> '5.0', '1e' -> '1' (exponent cut off by truncation)"""
+    token = token.lstrip('+').rstrip('eE+-')
+    sign = '-' if token.startswith('-') else ''
+    token = token.lstrip('-')
+    if token.startswith('.'):
+        token = '0' + token
+    if token.endswith('.'):
+        token += '0'
+    return sign + token
+
+
+def _drop_trailing_comma(out: List[str]):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+
+def _drop_dangling_key(out: List[str], stack: List[List[Any]]):
+    """Remove a key whose value never arrived ('"key":' or '"key"' at the end of an object)"""
+    if stack and stack[-1][0] == '{' and stack[-1][2] is not None:
+        del out[stack[-1][2]:]
+        stack[-1][1] = True
+        stack[-1][2] = None
+        _drop_trailing_comma(out)
+
+
+def coerce(value: Any, schema: Dict[str, Any]) -> Any:
+    """Fix type slips the schema makes unambiguous (a string where a list is expected, "12" for 12)"""
+    types = schema.get('type')
+    types = types if isinstance(types, list) else [types] if types else []
+    if not types:
+        return value
+    if value is None:
+        return value
+    if 'array' in types and not isinstance(value, list):
+        if isinstance(value, str):
+            value = [part.strip() for part in value.replace('\n', ',').split(',') if part.strip()]
+        else:
+            value = [value]
+    if isinstance(value, list) and 'array' in types:
+        items = schema.get('items', {})
+        return [coerce(item, items) for item in value]
+    if isinstance(value, dict) and 'object' in types:
+        properties = schema.get('properties', {})
+        return {key: coerce(item, properties.get(key, {})) for key, item in value.items()}
+    if isinstance(value, str) and ('number' in types or 'integer' in types) and 'string' not in types:
+        try:
+            number = float(value.strip().split()[0]) if value.strip() else None
+        except ValueError:
+            return value
+        if number is None:
+            return None if 'null' in types else value
+        return int(number) if 'integer' in types and number.is_integer() else number
+    if isinstance(value, list) and 'string' in types:
+        return ', '.join(str(item) for item in value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and 'string' in types and 'number' not in types:
+        return str(value)
+    return value
+
+
+_TYPE_CHECKS = {
+    'object': lambda value: isinstance(value, dict),
+    'array': lambda value: isinstance(value, list),
+    'string': lambda value: isinstance(value, str),
+    'integer': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'number': lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    'boolean': lambda value: isinstance(value, bool),
+    'null': lambda value: value is None
+}
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = '$') -> List[str]:
+    """Errors for the JSON Schema subset used here: type, properties, required, items, enum, minItems"""
+    types = schema.get('type')
+    types = types if isinstance(types, list) else [types] if types else []
+    if types and not any(_TYPE_CHECKS[name](value) for name in types):
+        return [f"{path}: expected {' or '.join(types)}, got {type(value).__name__}"]
+    errors = []
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+    if isinstance(value, dict):
+        for key in schema.get('required', []):
+            if key not in value:
+                errors.append(f"{path}.{key}: missing")
+        for key, subschema in schema.get('properties', {}).items():
+            if key in value:
+                errors.extend(validate(value[key], subschema, f"{path}.{key}"))
+    elif isinstance(value, list):
+        if len(value) < schema.get('minItems', 0):
+            errors.append(f"{path}: expected at least {schema['minItems']} item(s)")
+        items = schema.get('items')
+        if items:
+            for position, item in enumerate(value):
+                errors.extend(validate(item, items, f"{path}[{position}]"))
+    return errors
+
+
+def parse_structured(text: str, schema: Optional[Dict[str, Any]] = None) -> StructuredResult:
+    """Parse an LLM answer as JSON (repairing it if needed), then coerce and validate against schema"""
+    text = (text or '').strip().lstrip('﻿')
+    repaired = False
+    try:
+        data = json.loads(text)
+    except ValueError:
+        repaired = True
+        try:
+            data = json.loads(repair_json(text))
+        except ValueError as e:
+            return StructuredResult(None, [f"invalid JSON: {e}"], repaired)
+    if schema is None:
+        return StructuredResult(data, [], repaired)
+    data = coerce(data, schema)
+    return StructuredResult(data, validate(data, schema), repaired)
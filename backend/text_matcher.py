@@ -0,0 +1,117 @@
+"""
+Text Matcher - Aho-Corasick multi-pattern matching for free text
+Protocol names, aliases, concern keywords and medication names are compiled once into
+one automaton, and every occurrence in a text is found in a single linear pass
+"""
+
+from collections import deque
+from typing import List, Dict, Any, Iterable, Iterator, Set, Tuple
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum()
+
+
+class AhoCorasickMatcher:
+    """
+    Case-insensitive matcher over many patterns, each carrying a value. Matches must start
+    on a word boundary ("pain" is not found in "spain"); whole-word patterns must also end
+    on one ("ps" is not found in "helps"), others match as prefixes ("muscle" in "muscles")
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # (pattern length, value, whole_word) for every pattern ending at a state
+        self._outputs: List[List[Tuple[int, Any, bool]]] = [[]]
+        self._built = False
+        self.pattern_count = 0
+
+    def add(self, pattern: str, value: Any, whole_word: bool = True) -> 'AhoCorasickMatcher':
+        pattern = pattern.strip().lower()
+        if not pattern:
+            return self
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            state = next_state
+        self._outputs[state].append((len(pattern), value, whole_word))
+        self.pattern_count += 1
+        self._built = False
+        return self
+
+    def add_all(self, patterns: Iterable[str], value: Any, whole_word: bool = True) -> 'AhoCorasickMatcher':
+        for pattern in patterns:
+            self.add(pattern, value, whole_word)
+        return self
+
+    def build(self) -> 'AhoCorasickMatcher':
+        """Compute failure links breadth-first and fold each state's suffix outputs into it"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+        self._built = True
+        return self
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yield (start, end, value) for every boundary-respecting match, overlaps included"""
+        if not self._built:
+            self.build()
+        text = (text or '').lower()
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        length = len(text)
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not outputs[state]:
+                continue
+            end = index + 1
+            ends_word = end == length or not _is_word_char(text[end])
+            for pattern_length, value, whole_word in outputs[state]:
+                start = end - pattern_length
+                if start > 0 and _is_word_char(text[start - 1]) and _is_word_char(text[start]):
+                    continue
+                if whole_word and not ends_word and _is_word_char(text[index]):
+                    continue
+                yield start, end, value
+
+    def find_values(self, text: str) -> Set[Any]:
+        """Distinct values of all patterns found in text"""
+        return {value for _, _, value in self.finditer(text)}
+
+    def __len__(self) -> int:
+        return self.pattern_count
+
+
+def iter_text_leaves(value: Any) -> Iterator[str]:
+    """Strings in a nested record (dict keys included), for matching without serializing it"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield str(key)
+            yield from iter_text_leaves(item)
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            yield from iter_text_leaves(item)
+    elif value is not None:
+        yield str(value)
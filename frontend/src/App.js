@@ -53,6 +53,8 @@ const PeptideProtocolsApp = () => {
   const [chatMessages, setChatMessages] = useState([]);
   const [chatInput, setChatInput] = useState('');
   const [chatLoading, setChatLoading] = useState(false);
+  // Returned by the first Dr. Peptide reply and echoed back so follow-ups share one LLM session
+  const [chatConversationId, setChatConversationId] = useState(null);
   const [uploadedFiles, setUploadedFiles] = useState([]);
   const [accessCode, setAccessCode] = useState('');
   const [protocolProgress, setProtocolProgress] = useState(null);
@@ -275,41 +277,51 @@ const PeptideProtocolsApp = () => {
     try {
       console.log('📤 Making API call to generate protocol...');
       
-      // Set longer timeout for protocol generation (3 minutes) and add progress feedback
-      const timeoutMs = 180000; // 3 minutes
-      const controller = new AbortController();
-      const timeoutId = setTimeout(() => controller.abort(), timeoutMs);
-      
-      // Show progress messages to user
-      let progressMessage = "Generating your personalized protocol...";
-      setProtocolProgress(progressMessage);
+      // Generation runs as a background job; follow its real stages until it finishes (up to 5 minutes)
+      const stageMessages = {
+        loading_assessment: "Analyzing your health assessment...",
+        risk_analysis: "Reviewing safety and risk factors...",
+        ai_recommendations: "Selecting optimal peptide protocols...",
+        personalized_dosing: "Calculating personalized dosing...",
+        protocol_structure: "Generating clinical recommendations...",
+        saving: "Finalizing your comprehensive protocol...",
+        progress_tracking: "Finalizing your comprehensive protocol..."
+      };
+      setProtocolProgress("Generating your personalized protocol...");
       
-      const progressInterval = setInterval(() => {
-        const messages = [
-          "Analyzing your health assessment...",
-          "Selecting optimal peptide protocols...", 
-          "Calculating personalized dosing...",
-          "Generating clinical recommendations...",
-          "Finalizing your comprehensive protocol..."
-        ];
-        const randomMessage = messages[Math.floor(Math.random() * messages.length)];
-        setProtocolProgress(randomMessage);
-      }, 10000); // Update every 10 seconds
+      const queued = await axios.post(`${API}/protocol-jobs/functional/${assessmentId}`);
+      const jobId = queued.data.job_id;
+      console.log('📋 Protocol generation queued as job:', jobId);
       
-      const response = await axios.post(`${API}/generate-functional-protocol/${assessmentId}`, {}, {
-        signal: controller.signal,
-        timeout: timeoutMs
-      });
+      const deadline = Date.now() + 300000; // 5 minutes
+      let job = null;
+      while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        job = (await axios.get(`${API}/protocol-jobs/${jobId}`)).data;
+        if (job.stage && stageMessages[job.stage]) {
+          setProtocolProgress(stageMessages[job.stage]);
+        }
+        if (job.status === 'succeeded' || job.status === 'failed') {
+          break;
+        }
+      }
       
-      clearTimeout(timeoutId);
-      clearInterval(progressInterval);
+      if (!job || job.status === 'queued' || job.status === 'running') {
+        const timeoutError = new Error('Protocol generation timeout');
+        timeoutError.code = 'ECONNABORTED';
+        throw timeoutError;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Protocol generation failed');
+      }
       
-      console.log('✅ Protocol generation response received:', response.status);
-      console.log('📊 Response data structure:', Object.keys(response.data));
+      const result = job.result || {};
+      console.log('✅ Protocol generation job finished:', job.status);
+      console.log('📊 Result data structure:', Object.keys(result));
       
-      if (response.data && response.data.protocol) {
-        console.log('✅ Setting generated protocol:', response.data.protocol);
-        setGeneratedProtocol(response.data.protocol);
+      if (result.protocol) {
+        console.log('✅ Setting generated protocol:', result.protocol);
+        setGeneratedProtocol(result.protocol);
         console.log('✅ Setting view to protocol');
         setCurrentView('protocol');
         setProtocolProgress(null);
@@ -345,9 +357,13 @@ const PeptideProtocolsApp = () => {
     try {
       const response = await axios.post(`${API}/dr-peptide/chat`, {
         message,
-        conversation_history: chatMessages
+        conversation_history: chatMessages,
+        conversation_id: chatConversationId
       });
 
+      if (response.data.conversation_id) {
+        setChatConversationId(response.data.conversation_id);
+      }
       if (response.data.success) {
         const aiMessage = { role: 'assistant', content: response.data.response };
         setChatMessages(prev => [...prev, aiMessage]);
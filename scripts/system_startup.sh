@@ -18,4 +18,8 @@ fi
 cd /app/backend
 pip install -r requirements.txt
 
+# Precompile the clinical catalog so workers skip recompiling it on boot
+echo "📚 Building catalog artifact..."
+python catalog_artifact.py build
+
 echo "✅ System startup complete - all dependencies ready"
\ No newline at end of file
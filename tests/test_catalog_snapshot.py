@@ -0,0 +1,148 @@
+"""
+Catalog Snapshot - stable protocol IDs, content-derived versions and delta sync across builds
+"""
+
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from catalog_artifact import source_updated_at  # noqa: E402
+from catalog_snapshot import identity_key, protocol_id_for  # noqa: E402
+from master_protocol_manager import MasterProtocolManager  # noqa: E402
+
+BATCH = [
+    {
+        'name': 'BPC-157',
+        'category': 'Healing & Recovery',
+        'description': 'Body protection compound',
+        'mechanism_of_action': 'Angiogenesis and tendon repair',
+        'clinical_indications': ['Tendon injuries', 'Joint inflammation']
+    },
+    {
+        'name': 'Semaglutide',
+        'category': 'Weight Management',
+        'description': 'GLP-1 receptor agonist',
+        'mechanism_of_action': 'GLP-1 receptor agonism',
+        'clinical_indications': ['Type 2 diabetes', 'Obesity']
+    },
+    {
+        'name': 'Selank',
+        'category': 'Cognitive Enhancement',
+        'description': 'Anxiolytic peptide',
+        'mechanism_of_action': 'GABA modulation',
+        'clinical_indications': ['Anxiety']
+    }
+]
+
+
+@pytest.fixture(autouse=True)
+def updated_at(monkeypatch):
+    """Pin the catalog data timestamp rather than reading it from git"""
+    monkeypatch.setenv('CATALOG_UPDATED_AT', '2025-01-01T00:00:00')
+    source_updated_at.cache_clear()
+    yield
+    source_updated_at.cache_clear()
+
+
+def build(snapshot_dir, batch):
+    """One host compiling the catalog with its own snapshot directory"""
+    os.environ['CATALOG_SNAPSHOT_DIR'] = str(snapshot_dir)
+    try:
+        return MasterProtocolManager(sources=[copy.deepcopy(batch)])
+    finally:
+        del os.environ['CATALOG_SNAPSHOT_DIR']
+        source_updated_at.cache_clear()
+
+
+def edited(batch):
+    """The batch after a data fix to Semaglutide, Selank removed and TB-500 added"""
+    batch = copy.deepcopy(batch)
+    batch[1]['description'] = 'GLP-1 receptor agonist for weight management'
+    del batch[2]
+    batch.append({'name': 'TB-500', 'category': 'Healing & Recovery', 'description': 'Thymosin beta-4 fragment'})
+    return batch
+
+
+def ids_by_name(manager):
+    return {protocol['name']: protocol['id'] for protocol in manager.all_protocols}
+
+
+def test_ids_survive_content_edits(tmp_path):
+    before = build(tmp_path, BATCH)
+    after = build(tmp_path, edited(BATCH))
+    assert ids_by_name(after)['Semaglutide'] == ids_by_name(before)['Semaglutide']
+    assert ids_by_name(after)['BPC-157'] == ids_by_name(before)['BPC-157']
+
+
+def test_identity_ignores_punctuation_and_case():
+    assert identity_key({'name': 'BPC-157', 'category': 'Healing & Recovery'}) == \
+        identity_key({'name': 'bpc 157', 'category': 'healing recovery'})
+    assert protocol_id_for('bpc157|healingrecovery', 1) != protocol_id_for('bpc157|healingrecovery')
+
+
+def test_hosts_agree_on_version(tmp_path):
+    host_a = build(tmp_path / 'a', BATCH)
+    host_b = build(tmp_path / 'b', BATCH)
+    assert host_a.catalog_version == host_b.catalog_version
+    assert build(tmp_path / 'a', edited(BATCH)).catalog_version != host_a.catalog_version
+
+
+def test_changes_since_previous_build(tmp_path):
+    before = build(tmp_path, BATCH)
+    after = build(tmp_path, edited(BATCH))
+    changes = after.changes_since(before.catalog_version)
+    assert changes['from_version'] == before.catalog_version
+    assert changes['to_version'] == after.catalog_version
+    assert [protocol['name'] for protocol in changes['changed']] == ['Semaglutide']
+    assert [protocol['name'] for protocol in changes['added']] == ['TB-500']
+    assert changes['removed'] == [ids_by_name(before)['Selank']]
+
+
+def test_changes_since_current_and_empty(tmp_path):
+    manager = build(tmp_path, BATCH)
+    current = manager.changes_since(manager.catalog_version)
+    assert current['added'] == current['changed'] == current['removed'] == []
+    assert len(manager.changes_since('0')['added']) == len(BATCH)
+    assert len(manager.changes_since('')['added']) == len(BATCH)
+
+
+@pytest.mark.parametrize('token', ['3', 'ffffffffffffffff', '../manifest'])
+def test_unknown_version_requires_full_resync(tmp_path, token):
+    assert build(tmp_path, BATCH).changes_since(token) is None
+
+
+def test_version_from_another_host_requires_full_resync(tmp_path):
+    old = build(tmp_path / 'a', BATCH)
+    # Host b never loaded the old catalog, so it cannot diff against it
+    fresh = build(tmp_path / 'b', edited(BATCH))
+    assert fresh.changes_since(old.catalog_version) is None
+
+
+def test_reverting_content_reuses_snapshot(tmp_path):
+    first = build(tmp_path, BATCH)
+    build(tmp_path, edited(BATCH))
+    reverted = build(tmp_path, BATCH)
+    assert reverted.catalog_version == first.catalog_version
+    assert [protocol['name'] for protocol in reverted.changes_since(first.catalog_version)['changed']] == []
+
+
+def timestamps(manager):
+    return {protocol['name']: (protocol['created_at'], protocol['last_updated']) for protocol in manager.all_protocols}
+
+
+def test_hosts_agree_on_timestamps(tmp_path):
+    assert timestamps(build(tmp_path / 'a', BATCH)) == timestamps(build(tmp_path / 'b', BATCH))
+
+
+def test_edit_stamps_only_the_changed_protocol(tmp_path, monkeypatch):
+    build(tmp_path, BATCH)
+    monkeypatch.setenv('CATALOG_UPDATED_AT', '2025-02-01T00:00:00')
+    after = timestamps(build(tmp_path, edited(BATCH)))
+    assert after['Semaglutide'] == ('2025-01-01T00:00:00', '2025-02-01T00:00:00')
+    assert after['BPC-157'] == ('2025-01-01T00:00:00', '2025-01-01T00:00:00')
+    assert after['TB-500'] == ('2025-02-01T00:00:00', '2025-02-01T00:00:00')
+
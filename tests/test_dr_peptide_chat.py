@@ -0,0 +1,81 @@
+"""
+Dr. Peptide chat - conversation ids, local answers and what each turn sends to the LLM
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('emergentintegrations')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from dr_peptide_ai import DrPeptideAI  # noqa: E402
+
+CATALOG_QUESTION = 'What is the dose of semaglutide?'
+
+
+@pytest.fixture(scope='module')
+def doctor():
+    return DrPeptideAI()
+
+
+@pytest.fixture
+def sent(doctor, monkeypatch):
+    """Record LLM calls instead of making them"""
+    calls = []
+
+    async def send(prompt, kind, conversation_id=None, cache_if=None):
+        calls.append({'prompt': prompt, 'kind': kind, 'conversation_id': conversation_id})
+        return 'LLM answer'
+
+    monkeypatch.setattr(doctor, '_send_llm_message', send)
+    return calls
+
+
+def chat(doctor, message, **kwargs):
+    return asyncio.run(doctor.chat_with_dr_peptide(message, **kwargs))
+
+
+def test_standalone_catalog_question_is_answered_locally(doctor, sent):
+    response = chat(doctor, CATALOG_QUESTION)
+    assert response['answered_locally'] and sent == []
+    # No id from the client: a fresh one comes back, but no session is pooled for it
+    assert response['conversation_id']
+    assert not doctor.session_pool.has_session(response['conversation_id'])
+
+
+def test_follow_up_goes_to_the_llm(doctor, sent):
+    history = [{'role': 'user', 'content': 'Tell me about semaglutide'}, {'role': 'assistant', 'content': '...'}]
+    response = chat(doctor, CATALOG_QUESTION, conversation_history=history)
+    assert response['response'] == 'LLM answer'
+    assert 'CONVERSATION HISTORY' in sent[0]['prompt']
+
+
+def test_conversation_turn_goes_to_the_llm_with_its_id(doctor, sent):
+    response = chat(doctor, CATALOG_QUESTION, conversation_id='conv-1')
+    assert response['conversation_id'] == 'conv-1'
+    assert sent[0]['conversation_id'] == 'conv-1'
+
+
+def test_one_off_turn_carries_the_system_prompt(doctor, sent):
+    chat(doctor, 'Which peptides help tendon healing after surgery?')
+    assert sent[0]['conversation_id'] is None
+    assert doctor.system_prompt.strip()[:200] in sent[0]['prompt']
+
+
+def test_pooled_turn_omits_system_prompt_and_history(doctor, sent, monkeypatch):
+    monkeypatch.setattr(doctor.session_pool, 'has_session', lambda conversation_id: True)
+    history = [{'role': 'user', 'content': 'earlier turn'}]
+    chat(doctor, 'And for a tendon injury?', conversation_history=history, conversation_id='conv-2')
+    prompt = sent[0]['prompt']
+    assert doctor.system_prompt.strip()[:200] not in prompt
+    assert 'earlier turn' not in prompt
+    assert prompt.endswith('CURRENT MESSAGE: And for a tendon injury?')
+
+
+def test_process_chat_stays_out_of_the_shared_cache(doctor, sent):
+    asyncio.run(doctor.process_chat('Follow-up for patient Jane: how is the BPC-157 protocol going?'))
+    assert sent[0]['kind'] == 'patient_chat'
@@ -0,0 +1,98 @@
+"""
+LLM Response Cache - local LRU, the shared Mongo tier, and which kinds may use it
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from llm_cache import DEFAULT_TTLS, LOCAL_ONLY_KINDS, LLMResponseCache, cache_key  # noqa: E402
+
+SHARED_KINDS = sorted(set(DEFAULT_TTLS) - LOCAL_ONLY_KINDS)
+
+
+class FakeCollection:
+    """The slice of a motor collection the shared tier uses, kept in a dict"""
+
+    def __init__(self):
+        self.documents = {}
+
+    async def create_index(self, *args, **kwargs):
+        return 'expires_at_1'
+
+    async def find_one(self, query):
+        return self.documents.get(query['_id'])
+
+    async def replace_one(self, query, document, upsert=False):
+        self.documents[query['_id']] = document
+
+
+@pytest.fixture
+def collection():
+    return FakeCollection()
+
+
+def cache_with(collection):
+    cache = LLMResponseCache()
+    cache.attach_shared_tier(collection)
+    return cache
+
+
+@pytest.mark.parametrize('kind', sorted(LOCAL_ONLY_KINDS))
+def test_patient_kinds_stay_in_process(collection, kind):
+    cache = cache_with(collection)
+    key = cache_key(kind, 'model', 'prompt with patient context')
+    asyncio.run(cache.set(key, kind, 'answer'))
+    assert collection.documents == {}
+    assert asyncio.run(cache.get(key, kind)) == 'answer'
+
+
+@pytest.mark.parametrize('kind', sorted(LOCAL_ONLY_KINDS))
+def test_patient_kinds_never_read_the_shared_tier(collection, kind):
+    key = cache_key(kind, 'model', 'prompt')
+    asyncio.run(cache_with(collection).set(key, 'chat', 'planted by another worker'))
+    assert asyncio.run(cache_with(collection).get(key, kind)) is None
+
+
+@pytest.mark.parametrize('kind', SHARED_KINDS)
+def test_generic_kinds_are_shared_between_workers(collection, kind):
+    key = cache_key(kind, 'model', 'What is the dose of BPC-157?')
+    asyncio.run(cache_with(collection).set(key, kind, 'answer'))
+    assert collection.documents[key]['kind'] == kind
+
+    other_worker = cache_with(collection)
+    assert asyncio.run(other_worker.get(key, kind)) == 'answer'
+    assert other_worker.metrics['shared_hits'] == 1
+
+
+def test_follow_up_chat_is_local_only():
+    assert 'patient_chat' in LOCAL_ONLY_KINDS
+    assert 'chat' not in LOCAL_ONLY_KINDS
+
+
+def test_key_normalizes_whitespace_and_case():
+    assert cache_key('chat', 'model', 'Dose of  BPC-157?\n') == cache_key('chat', 'model', 'dose of bpc-157?')
+    assert cache_key('chat', 'model', 'x') != cache_key('rationale', 'model', 'x')
+
+
+def test_entries_expire(monkeypatch):
+    cache = LLMResponseCache(ttls={'chat': 10})
+    clock = [1000.0]
+    monkeypatch.setattr('llm_cache.time.monotonic', lambda: clock[0])
+    asyncio.run(cache.set('key', 'chat', 'answer'))
+    clock[0] += 11
+    assert asyncio.run(cache.get('key', 'chat')) is None
+    assert cache.metrics['expirations'] == 1
+
+
+def test_lru_evicts_oldest():
+    cache = LLMResponseCache(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        asyncio.run(cache.set(key, 'chat', key.upper()))
+    assert asyncio.run(cache.get('a', 'chat')) is None
+    assert asyncio.run(cache.get('c', 'chat')) == 'C'
+    assert cache.metrics['evictions'] == 1
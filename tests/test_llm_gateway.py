@@ -0,0 +1,146 @@
+"""
+LLM Gateway - deadlines, the circuit breaker and what counts as a provider failure
+"""
+
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from llm_gateway import CircuitBreaker, CircuitOpen, DeadlineExceeded, LLMGateway, deadline_scope  # noqa: E402
+from request_coalescing import AdmissionController, AdmissionRejected  # noqa: E402
+
+
+def make_gateway(timeout=0.5, failures=2, reset=60.0):
+    gateway = LLMGateway(timeouts={'test': timeout}, admission=AdmissionController())
+    gateway.route('test').breaker = CircuitBreaker(failure_threshold=failures, reset_timeout=reset)
+    return gateway
+
+
+async def answer(*_):
+    return 'ok'
+
+
+async def fail(*_):
+    raise RuntimeError('provider error')
+
+
+async def hang(*_):
+    await asyncio.sleep(10)
+
+
+def run(gateway, attempt, **kwargs):
+    return asyncio.run(gateway.call('test', attempt, **kwargs))
+
+
+def test_success_is_returned_and_recorded():
+    gateway = make_gateway()
+    assert run(gateway, answer) == 'ok'
+    assert gateway.route('test').metrics['successes'] == 1
+    assert gateway.route('test').breaker.state == 'closed'
+
+
+def test_breaker_opens_after_consecutive_failures():
+    gateway = make_gateway(failures=2)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            run(gateway, fail)
+    assert gateway.route('test').breaker.state == 'open'
+    with pytest.raises(CircuitOpen):
+        run(gateway, answer)
+    assert gateway.route('test').breaker.metrics['short_circuited'] == 1
+
+
+def test_half_open_probe_closes_breaker_on_success():
+    gateway = make_gateway(failures=1, reset=0.0)
+    with pytest.raises(RuntimeError):
+        run(gateway, fail)
+    assert gateway.route('test').breaker.state == 'half_open'
+    assert run(gateway, answer) == 'ok'
+    assert gateway.route('test').breaker.state == 'closed'
+
+
+def test_timeout_counts_against_the_provider():
+    gateway = make_gateway(timeout=0.05, failures=1)
+    with pytest.raises(DeadlineExceeded):
+        run(gateway, hang)
+    assert gateway.route('test').metrics['timeouts'] == 1
+    assert gateway.route('test').breaker.state == 'open'
+
+
+def test_admission_rejection_is_not_a_provider_failure():
+    gateway = make_gateway(failures=1)
+
+    @asynccontextmanager
+    async def full_queue():
+        raise AdmissionRejected('test', 'queue full')
+        yield
+
+    with pytest.raises(AdmissionRejected):
+        run(gateway, answer, acquire=full_queue)
+    assert gateway.route('test').breaker.state == 'closed'
+    assert gateway.route('test').metrics['failures'] == 0
+
+
+def test_queue_wait_does_not_count_toward_the_timeout():
+    gateway = make_gateway(timeout=0.1)
+
+    @asynccontextmanager
+    async def slow_slot():
+        await asyncio.sleep(0.2)
+        yield 'session'
+
+    async def echo(resource):
+        return resource
+
+    assert run(gateway, echo, acquire=slow_slot) == 'session'
+
+
+def test_exhausted_request_budget_skips_the_call():
+    gateway = make_gateway(failures=1)
+
+    async def scoped():
+        with deadline_scope(0.5):
+            return await gateway.call('test', answer)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scoped())
+    assert gateway.route('test').metrics['calls'] == 0
+    assert gateway.route('test').breaker.state == 'closed'
+
+
+@asynccontextmanager
+async def session():
+    yield 'session'
+
+
+async def collect(gateway, open_stream):
+    return [chunk async for chunk in gateway.stream('test', session, open_stream)]
+
+
+def test_stream_passes_chunks_through():
+    gateway = make_gateway()
+
+    async def chunks(resource):
+        for chunk in ('a', 'b', resource):
+            yield chunk
+
+    assert asyncio.run(collect(gateway, chunks)) == ['a', 'b', 'session']
+    assert gateway.route('test').metrics['successes'] == 1
+
+
+def test_stream_deadline_covers_the_whole_stream():
+    gateway = make_gateway(timeout=0.1, failures=1)
+
+    async def stalls(_):
+        yield 'a'
+        await asyncio.sleep(10)
+        yield 'b'
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(collect(gateway, stalls))
+    assert gateway.route('test').breaker.state == 'open'
@@ -0,0 +1,68 @@
+"""
+LLM Session Pool - one session per conversation, throwaway sessions for one-shot calls
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from llm_session_pool import LLMSessionPool  # noqa: E402
+from request_coalescing import AdmissionController  # noqa: E402
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def factory(kind):
+        def create(session_id):
+            created.append((kind, session_id))
+            return f"{kind}:{session_id}"
+        return create
+
+    pool = LLMSessionPool(factory('one-shot'), admission=AdmissionController(),
+                          conversation_factory=factory('conversation'), **kwargs)
+    return pool, created
+
+
+async def borrow(pool, conversation_id=None):
+    async with pool.session(conversation_id) as client:
+        return client
+
+
+def test_conversation_reuses_its_session():
+    pool, created = make_pool()
+    first = asyncio.run(borrow(pool, 'conv-1'))
+    second = asyncio.run(borrow(pool, 'conv-1'))
+    assert first == second == 'conversation:conv-1'
+    assert created == [('conversation', 'conv-1')]
+    assert pool.metrics['created'] == 1 and pool.metrics['reused'] == 1
+
+
+def test_one_shot_calls_get_throwaway_sessions():
+    pool, created = make_pool()
+    asyncio.run(borrow(pool))
+    asyncio.run(borrow(pool))
+    assert [kind for kind, _ in created] == ['one-shot', 'one-shot']
+    assert created[0][1] != created[1][1]
+    assert not pool.has_session(None)
+    assert pool.get_stats()['active_sessions'] == 0
+
+
+def test_has_session_reflects_eviction():
+    pool, _ = make_pool(max_sessions=1)
+    assert not pool.has_session('conv-1')
+    asyncio.run(borrow(pool, 'conv-1'))
+    assert pool.has_session('conv-1')
+    asyncio.run(borrow(pool, 'conv-2'))
+    # Capacity eviction dropped the oldest conversation; its next turn starts a new session
+    assert not pool.has_session('conv-1')
+    assert pool.metrics['evicted_capacity'] == 1
+
+
+def test_idle_sessions_are_not_reported_as_pooled():
+    pool, _ = make_pool(idle_timeout=0)
+    asyncio.run(borrow(pool, 'conv-1'))
+    assert not pool.has_session('conv-1')
+    assert pool.metrics['evicted_idle'] == 1
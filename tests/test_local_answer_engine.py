@@ -0,0 +1,94 @@
+"""
+Local Answer Engine - which questions are answered from the catalog and which go to the LLM
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from local_answer_engine import LocalAnswerEngine  # noqa: E402
+
+PROTOCOLS = [
+    {
+        'name': 'Semaglutide',
+        'description': 'GLP-1 receptor agonist',
+        'complete_dosing_schedule': {'week_1_4': '0.25mg weekly', 'week_5_8': '0.5mg weekly'},
+        'safety_profile': {'common_side_effects': ['Nausea', 'Diarrhea']},
+        'administration_techniques': {'storage': 'Refrigerate at 2-8C'},
+        'cost_considerations': '$900-1300 per month',
+        'expected_timelines': {'weeks_4_8': 'Appetite reduction'}
+    },
+    {
+        'name': 'BPC-157',
+        'description': 'Body protection compound',
+        'complete_dosing_schedule': {'standard': '250-500mcg daily'},
+        'safety_profile': {'common_side_effects': ['Injection site irritation']},
+        'administration_techniques': {'storage': 'Refrigerate after reconstitution'}
+    },
+    {'name': 'TB-500', 'complete_dosing_schedule': {'loading': '2-2.5mg twice weekly'}}
+]
+
+
+@pytest.fixture
+def engine():
+    return LocalAnswerEngine(PROTOCOLS, enabled=True)
+
+
+@pytest.mark.parametrize('message, protocol, intents', [
+    ('What is the dose of semaglutide?', 'Semaglutide', ['dosing']),
+    ('semaglutide dosing', 'Semaglutide', ['dosing']),
+    ('What are the side effects of BPC-157?', 'BPC-157', ['side_effects']),
+    ('Is semaglutide safe?', 'Semaglutide', ['side_effects']),
+    ('How should BPC 157 be stored?', 'BPC-157', ['storage']),
+    ('How much does semaglutide cost?', 'Semaglutide', ['cost']),
+    ('how long does semaglutide take to work', 'Semaglutide', ['timeline']),
+    ('What is BPC157?', 'BPC-157', ['overview'])
+])
+def test_template_questions_are_answered_locally(engine, message, protocol, intents):
+    answer = engine.answer(message)
+    assert answer is not None
+    assert answer['protocol']['name'] == protocol
+    assert answer['intents'] == intents
+
+
+@pytest.mark.parametrize('message', [
+    # Patient-specific: population, condition, co-medication, body weight
+    'How much semaglutide should a child take',
+    'semaglutide dose for kidney disease',
+    'What dose of semaglutide for someone on warfarin',
+    'what dose of semaglutide for a woman',
+    'Is semaglutide safe for a diabetic?',
+    "What's the BPC-157 dose for 80 kg",
+    'Should I take BPC-157 for my knee?',
+    # Comparative or about several protocols
+    'BPC-157 vs TB-500 side effects',
+    'Can I stack BPC-157 and TB-500?',
+    # No protocol, no intent, or catalog has no data for the intent
+    'What is the best peptide for fat loss?',
+    'Tell me about BPC-157 and my shoulder injury',
+    'How much does BPC-157 cost?'
+])
+def test_other_questions_go_to_the_llm(engine, message):
+    assert engine.answer(message) is None
+
+
+def test_answer_renders_catalog_fields(engine):
+    answer = engine.answer('What is the dose of semaglutide?')
+    assert answer['text'].startswith('### Semaglutide')
+    assert '0.25mg weekly' in answer['text']
+
+
+def test_disabled_engine_defers(engine):
+    engine.enabled = False
+    assert engine.answer('What is the dose of semaglutide?') is None
+
+
+def test_stats_count_answered_and_deferred(engine):
+    engine.answer('What is the dose of semaglutide?')
+    engine.answer('semaglutide dose for kidney disease')
+    stats = engine.get_stats()
+    assert stats['answered'] == 1 and stats['deferred'] == 1
+    assert stats['intents'] == {'dosing': 1}
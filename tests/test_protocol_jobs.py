@@ -0,0 +1,232 @@
+"""
+Protocol Jobs - claiming, running, de-duplicating and losing leases on Mongo-backed jobs
+"""
+
+import asyncio
+import copy
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('pymongo')
+from pymongo.errors import DuplicateKeyError  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from protocol_jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, ProtocolJobQueue, current_job_id, report_stage  # noqa: E402
+
+
+def _get(document, path):
+    for key in path.split('.'):
+        if isinstance(document, list):
+            document = document[int(key)]
+        elif isinstance(document, dict) and key in document:
+            document = document[key]
+        else:
+            return None
+    return document
+
+
+def _set(document, path, value):
+    *parents, last = path.split('.')
+    for key in parents:
+        document = document[int(key)] if isinstance(document, list) else document[key]
+    if isinstance(document, list):
+        document[int(last)] = value
+    else:
+        document[last] = value
+
+
+def _matches(document, query):
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(_matches(document, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict) and '$lt' in condition:
+            value = _get(document, key)
+            if value is None or not value < condition['$lt']:
+                return False
+        elif _get(document, key) != condition:
+            return False
+    return True
+
+
+class FakeJobCollection:
+    """The operations ProtocolJobQueue uses, over a list of dicts (unique sparse active_key)"""
+
+    def __init__(self):
+        self.documents = []
+        self.fail_updates = 0
+
+    async def create_index(self, *args, **kwargs):
+        return 'index'
+
+    async def insert_one(self, document):
+        key = document.get('active_key')
+        if key and any(existing.get('active_key') == key for existing in self.documents):
+            raise DuplicateKeyError('active_key')
+        self.documents.append(copy.deepcopy(document))
+
+    async def find_one(self, query):
+        for document in self.documents:
+            if _matches(document, query):
+                return copy.deepcopy(document)
+        return None
+
+    def _apply(self, document, update):
+        for path, value in update.get('$set', {}).items():
+            _set(document, path, value)
+        for path, amount in update.get('$inc', {}).items():
+            _set(document, path, (_get(document, path) or 0) + amount)
+        for path in update.get('$unset', {}):
+            document.pop(path, None)
+
+    async def update_one(self, query, update):
+        if self.fail_updates:
+            self.fail_updates -= 1
+            raise ConnectionError('mongo unavailable')
+        for document in self.documents:
+            if _matches(document, query):
+                self._apply(document, update)
+                return SimpleNamespace(matched_count=1)
+        return SimpleNamespace(matched_count=0)
+
+    async def find_one_and_update(self, query, update, sort=None, return_document=None):
+        candidates = [document for document in self.documents if _matches(document, query)]
+        for field, direction in reversed(sort or []):
+            candidates.sort(key=lambda document: document[field], reverse=direction < 0)
+        if not candidates:
+            return None
+        self._apply(candidates[0], update)
+        return copy.deepcopy(candidates[0])
+
+
+def make_queue(handler, lease_seconds=60, max_attempts=3):
+    queue = ProtocolJobQueue(FakeJobCollection(), lease_seconds=lease_seconds, max_attempts=max_attempts)
+    queue.register('protocol', handler, ['analyze', 'generate'])
+    return queue
+
+
+async def claim_and_run(queue):
+    job = await queue._claim()
+    assert job is not None
+    await queue._run(job)
+    return await queue.get(job['id'])
+
+
+def test_job_runs_through_its_stages():
+    seen = {}
+
+    async def handler(payload):
+        seen['job_id'] = current_job_id()
+        await report_stage('analyze')
+        await report_stage('generate')
+        return {'protocol': payload['name']}
+
+    async def scenario():
+        queue = make_queue(handler)
+        queued = await queue.enqueue('protocol', {'name': 'BPC-157'})
+        assert queued['status'] == QUEUED
+        return queued, await claim_and_run(queue)
+
+    queued, finished = asyncio.run(scenario())
+    assert finished['status'] == SUCCEEDED
+    assert finished['result'] == {'protocol': 'BPC-157'}
+    assert [stage['status'] for stage in finished['stages']] == [SUCCEEDED, SUCCEEDED]
+    assert seen['job_id'] == queued['id']
+    assert 'active_key' not in finished and 'lease_until' not in finished
+
+
+def test_handler_error_fails_the_job():
+    async def handler(payload):
+        raise ValueError('no protocol')
+
+    async def scenario():
+        queue = make_queue(handler)
+        await queue.enqueue('protocol', {})
+        return await claim_and_run(queue)
+
+    finished = asyncio.run(scenario())
+    assert finished['status'] == FAILED
+    assert finished['error'] == 'no protocol'
+
+
+def test_duplicate_submission_joins_the_active_job():
+    async def handler(payload):
+        return {}
+
+    async def scenario():
+        queue = make_queue(handler)
+        first = await queue.enqueue('protocol', {}, dedupe_key='assessment-1')
+        second = await queue.enqueue('protocol', {}, dedupe_key='assessment-1')
+        await claim_and_run(queue)
+        # Once the first job finishes, the same key starts a new job
+        third = await queue.enqueue('protocol', {}, dedupe_key='assessment-1')
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert second['id'] == first['id']
+    assert third['id'] != first['id']
+
+
+def test_unknown_kind_is_rejected():
+    queue = make_queue(lambda payload: payload)
+    with pytest.raises(ValueError):
+        asyncio.run(queue.enqueue('unknown', {}))
+
+
+def test_job_past_max_attempts_is_failed():
+    async def handler(payload):
+        return {}
+
+    async def scenario():
+        queue = make_queue(handler, max_attempts=1)
+        job = await queue.enqueue('protocol', {})
+        queue.collection.documents[0]['attempts'] = 1
+        assert await queue._claim() is None
+        return await queue.get(job['id'])
+
+    job = asyncio.run(scenario())
+    assert job['status'] == FAILED
+    assert 'Abandoned' in job['error']
+
+
+def test_lost_lease_stops_the_run_without_overwriting():
+    async def handler(payload):
+        await asyncio.sleep(5)
+        return {'stale': True}
+
+    async def scenario():
+        queue = make_queue(handler, lease_seconds=0.15)
+        job = await queue.enqueue('protocol', {})
+        claimed = await queue._claim()
+        run = asyncio.ensure_future(queue._run(claimed))
+        await asyncio.sleep(0.01)
+        # Another worker re-claims the job after this one's lease lapsed
+        queue.collection.documents[0].update(worker_id='other-worker', attempts=2)
+        await asyncio.wait_for(run, timeout=2)
+        return await queue.get(job['id'])
+
+    job = asyncio.run(scenario())
+    assert job['status'] == RUNNING
+    assert job['worker_id'] == 'other-worker'
+    assert job['result'] is None
+
+
+def test_heartbeat_survives_failed_renewals():
+    async def handler(payload):
+        await asyncio.sleep(0.3)
+        return {'done': True}
+
+    async def scenario():
+        queue = make_queue(handler, lease_seconds=0.15)
+        job = await queue.enqueue('protocol', {})
+        queue.collection.fail_updates = 1
+        await claim_and_run(queue)
+        return await queue.get(job['id'])
+
+    job = asyncio.run(scenario())
+    assert job['status'] == SUCCEEDED
+    assert job['result'] == {'done': True}
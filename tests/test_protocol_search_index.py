@@ -0,0 +1,75 @@
+"""
+Protocol Search Index - BM25 ranking, prefix expansion and exact-name boosts
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from master_protocol_manager import master_protocol_manager  # noqa: E402
+from protocol_search_index import ProtocolSearchIndex  # noqa: E402
+
+
+def ranked_names(query, limit=5):
+    return [protocol['name'] for protocol in master_protocol_manager.search(query=query, limit=limit)['protocols']]
+
+
+@pytest.mark.parametrize('query, first', [
+    # Prefixes prefer the completion most of the catalog uses
+    ('sema', 'Semaglutide'),
+    ('semag', 'Semaglutide'),
+    ('tirz', 'Tirzepatide'),
+    # A full name or alias ranks its protocol first
+    ('semax', 'Semax'),
+    ('TB-500', 'TB-500'),
+    ('bpc157', 'BPC-157'),
+    ('BPC-157', 'BPC-157'),
+    ('ipamorelin', 'Ipamorelin')
+])
+def test_catalog_ranking(query, first):
+    assert ranked_names(query)[0] == first
+
+
+def test_prefix_still_finds_rare_completions():
+    assert 'Semax' in ranked_names('sema', limit=10)
+
+
+def build(protocols):
+    index = ProtocolSearchIndex()
+    index.build(protocols)
+    return index
+
+
+def top(index, protocols, query):
+    return [protocols[ordinal]['name'] for ordinal, _ in index.top_k(index.score(query), 10)]
+
+
+def test_common_completion_outranks_rare_one():
+    protocols = [
+        {'name': 'Semax', 'aliases': ['Semax nasal']},
+        {'name': 'Semaglutide', 'clinical_indications': ['Obesity']},
+        {'name': 'Semaglutide Microdose', 'clinical_indications': ['Semaglutide maintenance']},
+        {'name': 'Tirzepatide', 'clinical_indications': ['Alternative to semaglutide']}
+    ]
+    ranked = top(build(protocols), protocols, 'sema')
+    assert ranked[:2] == ['Semaglutide Microdose', 'Semaglutide']
+    assert ranked.index('Semax') > ranked.index('Semaglutide')
+
+
+def test_exact_token_outranks_prefix_expansion():
+    protocols = [
+        {'name': 'Selank Extended'},
+        {'name': 'Sel'},
+        {'name': 'Selenium Complex', 'clinical_indications': ['Selenium deficiency']}
+    ]
+    assert top(build(protocols), protocols, 'sel')[0] == 'Sel'
+
+
+def test_all_tokens_must_match():
+    protocols = [{'name': 'BPC-157', 'clinical_indications': ['Tendon repair']}, {'name': 'TB-500'}]
+    index = build(protocols)
+    assert top(index, protocols, 'bpc tendon') == ['BPC-157']
+    assert index.score('bpc shoulder') == {}
@@ -0,0 +1,108 @@
+"""
+Structured Output - repair_json and parse_structured on the near-valid JSON LLMs produce
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from structured_output import coerce, parse_structured, repair_json, validate  # noqa: E402
+
+# (near-valid input, what it should parse to once repaired)
+REPAIR_CASES = [
+    # Wrapping and comments
+    ('```json\n{"a": 1}\n```', {'a': 1}),
+    ('Here is the protocol: {"a": 1} Hope this helps!', {'a': 1}),
+    ('{"a": 1, // dose\n "b": 2}', {'a': 1, 'b': 2}),
+    ('{"a": /* note */ 1}', {'a': 1}),
+    # Trailing commas
+    ('{"a": 1,}', {'a': 1}),
+    ('{"a": [1, 2,],}', {'a': [1, 2]}),
+    # Numbers, exponents included
+    ('{"a": 1e-5, "b": 2,', {'a': 1e-5, 'b': 2}),
+    ('{"x": 1.5e3,}', {'x': 1500.0}),
+    ('{"a": [1, 2E+2, -3.25e-1', {'a': [1, 200.0, -0.325]}),
+    ('{"a": -.5, "b": +3, "c": 5.}', {'a': -0.5, 'b': 3, 'c': 5.0}),
+    ('{"a": 1e', {'a': 1}),
+    ('{"dose": 250mcg}', {'dose': '250mcg'}),
+    # Keys
+    ('{a: 1, b_c: "x"}', {'a': 1, 'b_c': 'x'}),
+    ('{1: "a"}', {'1': 'a'}),
+    # Python and JS literals
+    ("{'a': True, 'b': None, 'c': False}", {'a': True, 'b': None, 'c': False}),
+    ('{"a": NaN, "b": Infinity}', {'a': None, 'b': None}),
+    # Quotes and escapes
+    ("{'a': 'it\\'s'}", {'a': "it's"}),
+    ("{'a': 'say \"hi\"'}", {'a': 'say "hi"'}),
+    ('{“a”: “b”}', {'a': 'b'}),
+    ('{"a": "line\nbreak\ttab"}', {'a': 'line\nbreak\ttab'}),
+    ('{"a": "x\\qy"}', {'a': 'x\\qy'}),
+    ('{"a": "\\u00e9\\n"}', {'a': 'é\n'}),
+    # Truncation at max tokens
+    ('{"a": 1, "b": [1, 2', {'a': 1, 'b': [1, 2]}),
+    ('{"a": 1, "b": "unfinished', {'a': 1, 'b': 'unfinished'}),
+    ('{"a": 1, "b":', {'a': 1}),
+    ('{"a": 1, "b"', {'a': 1}),
+    ('{"a": {"b": {"c": 1', {'a': {'b': {'c': 1}}}),
+    ('[{"a": 1}, {"b": 2', [{'a': 1}, {'b': 2}]),
+]
+
+
+@pytest.mark.parametrize('text, expected', REPAIR_CASES)
+def test_repair_json(text, expected):
+    assert json.loads(repair_json(text)) == expected
+
+
+def test_repair_json_leaves_valid_json_unchanged():
+    text = '{"a": [1, 2.5, -3e-2], "b": {"c": "d\\"e"}, "f": null}'
+    assert json.loads(repair_json(text)) == json.loads(text)
+
+
+def test_repair_json_without_json_returns_text():
+    assert repair_json('no json here') == 'no json here'
+
+
+SCHEMA = {
+    'type': 'object',
+    'required': ['peptides', 'dose'],
+    'properties': {
+        'peptides': {'type': 'array', 'items': {'type': 'string'}, 'minItems': 1},
+        'dose': {'type': 'number'},
+        'notes': {'type': 'string'}
+    }
+}
+
+
+def test_parse_structured_valid():
+    result = parse_structured('{"peptides": ["BPC-157"], "dose": 3.5}', SCHEMA)
+    assert result.ok and not result.repaired
+    assert result.data == {'peptides': ['BPC-157'], 'dose': 3.5}
+
+
+def test_parse_structured_repairs_and_coerces():
+    result = parse_structured("{'peptides': 'BPC-157, TB-500', 'dose': '3.5 mcg/kg', 'notes': ['a', 'b'],}", SCHEMA)
+    assert result.ok and result.repaired
+    assert result.data == {'peptides': ['BPC-157', 'TB-500'], 'dose': 3.5, 'notes': 'a, b'}
+
+
+def test_parse_structured_reports_schema_errors():
+    result = parse_structured('{"peptides": [], "notes": 1}', SCHEMA)
+    assert not result.ok
+    assert '$.dose: missing' in result.errors
+    assert '$.peptides: expected at least 1 item(s)' in result.errors
+
+
+def test_parse_structured_invalid_json():
+    result = parse_structured('not json at all', SCHEMA)
+    assert result.data is None and not result.ok
+
+
+def test_coerce_and_validate_nullable_number():
+    schema = {'type': ['number', 'null']}
+    assert coerce('', schema) is None
+    assert validate(None, schema) == []
+    assert validate('x', schema) == ['$: expected number or null, got str']